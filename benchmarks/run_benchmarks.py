@@ -0,0 +1,353 @@
+# benchmarks/run_benchmarks.py
+"""
+Offline performance benchmarks for the Lab 2 pipeline.
+
+Builds a synthetic git repository and tiny random stand-in models, points the
+pipeline's configuration at them, and times each stage: mining, baseline
+generation, the three RowProcessor tasks, int8 against float32 scoring (with
+their score agreement), DataHandler.save_progress for both results backends,
+the text report and each plot, and the memory used to resume the results table
+with the object and the compact schema. Results are written as JSON
+so runs on different commits can be compared with --compare.
+
+Run from the project root:
+    python -m benchmarks.run_benchmarks --commits 500 --rows 32
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import logging
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.config_loader import config
+from benchmarks.synthetic_repo import build_synthetic_repo
+from benchmarks.tiny_models import build_tiny_models
+
+def _summarize(name: str, latencies: list, items: int, unit: str) -> dict:
+    """Throughput and latency statistics for a stage that ran `len(latencies)` calls over `items` units."""
+    total = sum(latencies)
+    ordered = sorted(latencies)
+    result = {
+        "calls": len(latencies), unit: items, "total_s": round(total, 4),
+        f"{unit}_per_s": round(items / total, 2) if total else None,
+        "latency_mean_s": round(statistics.mean(latencies), 5),
+        "latency_p50_s": round(ordered[len(ordered) // 2], 5),
+        "latency_p95_s": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 5),
+    }
+    logging.info(f"{name}: {items} {unit} in {total:.2f}s ({result[f'{unit}_per_s']} {unit}/s, p50 {result['latency_p50_s']}s)")
+    return result
+
+def _timed(fn, *args, **kwargs) -> tuple:
+    started = time.perf_counter()
+    value = fn(*args, **kwargs)
+    return value, time.perf_counter() - started
+
+def configure(workdir: str, repo_path: str, t5_path: str, causal_path: str) -> None:
+    """Points the shared configuration at the benchmark workspace."""
+    config['io'].update({
+        'repo_url': repo_path, 'local_repo_path': repo_path, 'processing_limit': None,
+        'output_csv_path': os.path.join(workdir, 'results.csv'),
+        'results_db_path': os.path.join(workdir, 'results.sqlite'),
+        'summary_path': os.path.join(workdir, 'results_summary.json'),
+        'visuals_dir': os.path.join(workdir, 'visuals'),
+        'blob_store_dir': os.path.join(workdir, 'blob_store'),
+    })
+    config['mining'].update({'cache_dir': os.path.join(workdir, 'mining_cache'), 'incremental': False, 'update_clone': False})
+    config['models'].update({'baseline_llm': t5_path, 'analysis_llm': causal_path})
+    # Cached responses would measure the cache, not the models.
+    config['response_cache']['enabled'] = False
+
+def bench_mining() -> tuple:
+    from src.data_miner import mine_repository
+    df, seconds = _timed(mine_repository)
+    result = _summarize("Mining", [seconds], df[config['columns']['hash']].nunique(), "commits")
+    result["rows"] = len(df)
+    return df, result
+
+def bench_baseline(df):
+    from src.llm.t5_handler import generate_baseline_messages
+    from src.utils import select_device
+    df["Baseline_Message"] = None
+    df, seconds = _timed(generate_baseline_messages, df, select_device())
+    return df, _summarize("Baseline generation", [seconds], len(df), "rows")
+
+def bench_row_tasks(df) -> dict:
+    """Times each RowProcessor task over the rows, one batch of `analysis_batch_rows` at a time."""
+    from src.llm.qwen_handler import QwenHandler
+    from src.row_processor import RowProcessor
+    from src.utils import parse_json_from_response
+    handler = QwenHandler()
+    processor = RowProcessor(handler)
+    batch_rows = config['inference']['analysis_batch_rows']
+    latencies = {"diff_compaction": [], "rectify": [], "evaluate": [], "classify": []}
+    for start in range(0, len(df), batch_rows):
+        batch = df.iloc[start:start + batch_rows]
+        compacted, seconds = _timed(processor.compact_diffs, batch)
+        latencies["diff_compaction"].append(seconds)
+        diffs = [diff for diff, _ in compacted]
+        responses, seconds = _timed(handler.rectify_batch, diffs)
+        latencies["rectify"].append(seconds)
+        rectified = [parse_json_from_response(r, 'rectified_message') or "fix: rectification failed" for r in responses]
+        candidates = list(zip(batch["Message"], batch["Baseline_Message"], rectified))
+        if config['inference']['evaluation_mode'] == 'joint':
+            _, seconds = _timed(handler.evaluate_joint_batch, [(diff, list(msgs)) for diff, msgs in zip(diffs, candidates)])
+        else:
+            _, seconds = _timed(handler.evaluate_batch, [(diff, msg) for diff, msgs in zip(diffs, candidates) for msg in msgs])
+        latencies["evaluate"].append(seconds)
+        _, seconds = _timed(handler.classify_batch, list(zip(batch["Message"], rectified)))
+        latencies["classify"].append(seconds)
+    results = {task: _summarize(f"Task {task}", times, len(df), "rows") for task, times in latencies.items()}
+    results["generated_tokens"] = handler.stats.tokens
+    results["generated_tokens_per_s"] = round(handler.stats.tokens / handler.stats.seconds, 2) if handler.stats.seconds else None
+    return results
+
+def bench_save_progress(df) -> dict:
+    """Times update_row + save_progress per row, as the pipeline does, for each results backend."""
+    import pandas as pd
+    from src.data_handler import DataHandler
+    results = {}
+    cols = config['columns']
+    mined_cols = [cols[key] for key in ('hash', 'message', 'filename', 'diff', 'source_before', 'source_current')]
+    for backend in ('sqlite', 'csv'):
+        config['io']['results_backend'] = backend
+        for path in (config['io']['output_csv_path'], config['io']['results_db_path']):
+            if os.path.exists(path): os.remove(path)
+        handler = DataHandler(df[mined_cols].copy())
+        latencies = []
+        for idx in handler.get_dataframe().index:
+            started = time.perf_counter()
+            handler.update_row(idx, {"Rectified_Message": "fix: benchmark", "Rectifier_Score": 3, "Developer_Score": 2})
+            handler.save_progress()
+            latencies.append(time.perf_counter() - started)
+        _, finalize_s = _timed(handler.finalize)
+        results[backend] = _summarize(f"save_progress ({backend})", latencies, len(latencies), "rows")
+        results[backend]["finalize_s"] = round(finalize_s, 4)
+    return results
+
+def _resume_results_table(io_settings: dict, mined_df) -> dict:
+    """Runs in a fresh process: resumes a DataHandler from the results CSV and reports its memory use."""
+    from src.data_handler import DataHandler
+    from src.metrics import current_rss_mb, peak_rss_mb
+    config['io'].update(io_settings)
+    rss_before = current_rss_mb()
+    handler, seconds = _timed(DataHandler, mined_df)
+    table = handler.df.memory_usage(deep=True).sum()
+    if handler.commits is not None:
+        table += handler.commits.memory_usage(deep=True).sum()
+    return {
+        "resume_s": round(seconds, 4), "table_mb": round(table / 2**20, 2),
+        "rss_before_mb": round(rss_before, 1), "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+def bench_dataframe_memory(df) -> dict:
+    """Resumes from a results CSV with the object and the compact schema, each in its own process so peak RSS is comparable."""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    cols = config['columns']
+    mined_cols = [cols[key] for key in ('hash', 'message', 'filename', 'diff', 'source_before', 'source_current')]
+    df.to_csv(config['io']['output_csv_path'], index=False)
+    results = {}
+    for schema, compact in (("object", False), ("compact", True)):
+        io_settings = dict(config['io'], results_backend='csv', compact_schema=compact)
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            results[schema] = pool.submit(_resume_results_table, io_settings, df[mined_cols]).result()
+        logging.info(
+            f"Resume with {schema} schema: {len(df)} rows, table {results[schema]['table_mb']} MB, "
+            f"RSS {results[schema]['rss_before_mb']} MB before, peak {results[schema]['peak_rss_mb']} MB "
+            f"({results[schema]['resume_s']}s)"
+        )
+    return results
+
+def _score_with_quantization(sections: dict, scheme, items: list) -> dict:
+    """Runs in a fresh process: scores (diff, message) items by logprobs with the given CPU quantization."""
+    from src.llm.qwen_handler import QwenHandler
+    from src.metrics import peak_rss_mb
+    for section, values in sections.items():
+        config[section].update(values)
+    config['cpu_inference'].update(enabled=True, quantization=scheme)
+    config['response_cache']['enabled'] = False
+    handler = QwenHandler()
+    scores, seconds = _timed(handler.score_batch, items)
+    return {"scores": scores, "seconds": seconds, "peak_rss_mb": peak_rss_mb()}
+
+def bench_quantization(df) -> dict:
+    """
+    Scores the same prompts with float32 and int8 CPU weights, each in its own
+    process, and reports how often the int8 score agrees with float32.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    items = [(diff, msg) for diff, msgs in zip(df["Diff"], zip(df["Message"], df["Baseline_Message"])) for msg in msgs]
+    sections = {section: dict(config[section]) for section in ("models", "inference")}
+    runs = {}
+    for scheme in (None, "int8"):
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            runs[scheme or "float32"] = pool.submit(_score_with_quantization, sections, scheme, items).result()
+    reference, quantized = runs["float32"]["scores"], runs["int8"]["scores"]
+    results = {
+        scheme: dict(_summarize(f"Logprob scoring ({scheme})", [run["seconds"]], len(items), "prompts"), peak_rss_mb=round(run["peak_rss_mb"], 1))
+        for scheme, run in runs.items()
+    }
+    results["int8_score_agreement"] = round(sum(a["score"] == b["score"] for a, b in zip(reference, quantized)) / len(items), 4)
+    results["int8_expected_abs_diff"] = round(sum(abs(a["expected"] - b["expected"]) for a, b in zip(reference, quantized)) / len(items), 4)
+    logging.info(
+        f"int8 vs float32: {results['int8_score_agreement'] * 100:.1f}% identical scores, "
+        f"mean expected-score difference {results['int8_expected_abs_diff']}"
+    )
+    return results
+
+def _synthetic_results(df):
+    """Adds plausible analysis values so the report and plots have data to work with."""
+    import numpy as np
+    rng = np.random.default_rng(0)
+    df = df.copy()
+    for col in ("Developer_Score", "Baseline_LLM_Score", "Rectifier_Score"):
+        df[col] = rng.integers(1, 6, len(df))
+    df["Improvement_Category"] = rng.choice(["Cosmetic", "Semantic", "Corrective", "Trivial", "Regressive"], len(df))
+    return df
+
+def bench_reporting(df) -> dict:
+    """Times the summary scan of the results CSV, the text report from it, and reading the summary index."""
+    from src.reporting import generate_text_report
+    from src.summary_index import SummaryIndex, scan_results_csv, load_summary
+    csv_path = config['io']['output_csv_path']
+    df.to_csv(csv_path, index=False)
+    results = {}
+    summary, seconds = _timed(scan_results_csv, csv_path)
+    results["csv_scan"] = _summarize("Summary scan of results CSV", [seconds], len(df), "rows")
+    _, seconds = _timed(generate_text_report, summary)
+    results["text_report"] = _summarize("Text report", [seconds], len(df), "rows")
+    index = SummaryIndex()
+    index.update(df, df.index)
+    index.write(config['io']['summary_path'], csv_path)
+    _, seconds = _timed(load_summary)
+    results["summary_load"] = _summarize("Summary index load", [seconds], len(df), "rows")
+    return results
+
+def bench_plotting(df) -> dict:
+    from src.summary_index import summarize_dataframe
+    from plotting.renderer import figure_jobs, render_figure, render_figures, setup_matplotlib
+    setup_matplotlib()
+    output_dir = config['io']['visuals_dir']
+    visuals_cfg = config['visuals']
+    os.makedirs(output_dir, exist_ok=True)
+    results = {}
+    summary = summarize_dataframe(df)
+    jobs = figure_jobs(summary, strip_max_points=visuals_cfg['strip_max_points'])
+    for job in jobs:
+        started = time.perf_counter()
+        render_figure(job, output_dir)
+        results[job.generator] = _summarize(f"Plot {job.generator}", [time.perf_counter() - started], len(df), "rows")
+    # A full render in the process pool, then a repeat that finds every figure unchanged.
+    for name, skip in (("render_all", False), ("render_all_unchanged", True)):
+        started = time.perf_counter()
+        render_figures(jobs, output_dir, workers=visuals_cfg['workers'], skip_unchanged=skip)
+        results[name] = _summarize(f"Render all figures{' (unchanged)' if skip else ''}", [time.perf_counter() - started], len(df), "rows")
+    return results
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def _metadata(args) -> dict:
+    import torch
+    import transformers
+    import pandas as pd
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec='seconds'), "git_commit": _git_commit(),
+        "python": platform.python_version(), "platform": platform.platform(), "cpu_count": os.cpu_count(),
+        "torch": torch.__version__, "transformers": transformers.__version__, "pandas": pd.__version__,
+        "torch_threads": torch.get_num_threads(), "args": vars(args),
+        "config": {section: config[section] for section in ("mining", "inference", "cpu_inference", "pipeline")},
+    }
+
+def compare(current: dict, baseline_path: str) -> None:
+    """Prints the relative change of every timing between a baseline results file and this run."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    def flatten(tree, prefix=""):
+        for key, value in tree.items():
+            if isinstance(value, dict):
+                yield from flatten(value, f"{prefix}{key}.")
+            elif key.endswith("_s") and not key.endswith("_per_s") and isinstance(value, (int, float)):
+                yield f"{prefix}{key}", value
+
+    before = dict(flatten(baseline["benchmarks"]))
+    print(f"\nTiming change vs {baseline_path} ({baseline['meta']['git_commit']} -> {current['meta']['git_commit']}):")
+    for key, value in flatten(current["benchmarks"]):
+        if before.get(key):
+            print(f"  {key:<60} {before[key]:>10.4f}s -> {value:>10.4f}s ({(value / before[key] - 1) * 100:+6.1f}%)")
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the Lab 2 pipeline.")
+    parser.add_argument("--commits", type=int, default=300, help="Commits in the synthetic repository.")
+    parser.add_argument("--files", type=int, default=40, help="Initial files in the synthetic repository.")
+    parser.add_argument("--rows", type=int, default=24, help="Mined rows used for the model and persistence stages.")
+    parser.add_argument("--hidden-size", type=int, default=64, help="Hidden size of the tiny stand-in models.")
+    parser.add_argument("--workdir", help="Workspace directory (default: a temporary directory, removed afterwards).")
+    parser.add_argument("--output", help="Results JSON path (default: benchmarks/results/<commit>-<time>.json).")
+    parser.add_argument("--compare", metavar="RESULTS_JSON", help="Print timing changes against an earlier results file.")
+    parser.add_argument("--skip", nargs="*", default=[], choices=["baseline", "tasks", "quantization", "save_progress", "reporting", "plotting", "memory"])
+    return parser.parse_args()
+
+def main() -> None:
+    from src.utils import setup_logging
+    args = parse_args()
+    setup_logging()
+    workdir = args.workdir or tempfile.mkdtemp(prefix="lab2-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        repo_path, setup_s = _timed(build_synthetic_repo, os.path.join(workdir, "repo"), args.commits, args.files)
+        (t5_path, causal_path), models_s = _timed(build_tiny_models, os.path.join(workdir, "models"), args.hidden_size)
+        logging.info(f"Built synthetic repository in {setup_s:.2f}s and tiny models in {models_s:.2f}s under {workdir}")
+        configure(workdir, repo_path, t5_path, causal_path)
+
+        benchmarks = {}
+        df, benchmarks["mining"] = bench_mining()
+        rows = df.head(args.rows).reset_index(drop=True)
+        if "baseline" not in args.skip:
+            rows, benchmarks["baseline"] = bench_baseline(rows)
+        else:
+            rows["Baseline_Message"] = "update code"
+        if "tasks" not in args.skip:
+            benchmarks["row_tasks"] = bench_row_tasks(rows)
+        if "quantization" not in args.skip:
+            benchmarks["quantization"] = bench_quantization(rows)
+        if "save_progress" not in args.skip:
+            benchmarks["save_progress"] = bench_save_progress(rows)
+        analyzed = _synthetic_results(df)
+        if "reporting" not in args.skip:
+            benchmarks["reporting"] = bench_reporting(analyzed)
+        if "plotting" not in args.skip:
+            benchmarks["plotting"] = bench_plotting(analyzed)
+        if "memory" not in args.skip:
+            benchmarks["dataframe_memory"] = bench_dataframe_memory(analyzed)
+
+        report = {"meta": _metadata(args), "benchmarks": benchmarks}
+        output = args.output or os.path.join(
+            os.path.dirname(__file__), "results", f"{report['meta']['git_commit']}-{datetime.now():%Y%m%d-%H%M%S}.json"
+        )
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+        logging.info(f"Benchmark results written to {output}")
+        if args.compare:
+            compare(report, args.compare)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
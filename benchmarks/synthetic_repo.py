@@ -0,0 +1,86 @@
+# benchmarks/synthetic_repo.py
+"""
+Builds a synthetic git repository for mining benchmarks.
+
+Commits are streamed into `git fast-import`, so even histories with thousands
+of commits are created in seconds. The history mixes bug-fix and feature
+commits that edit, add and delete Python files, giving the miner realistic
+multi-hunk diffs to extract.
+"""
+import os
+import random
+import subprocess
+
+BUG_FIX_MESSAGES = ["fix crash when {name} is empty", "Fix off-by-one error in {name}", "bug: handle missing {name}", "patch {name} regression"]
+OTHER_MESSAGES = ["add {name} support", "refactor {name}", "docs: describe {name}", "bump {name} version"]
+
+def _random_line(rng: random.Random, depth: int) -> str:
+    name = rng.choice(["value", "result", "items", "config", "payload", "index"])
+    body = rng.choice([f"{name} = {name} + {rng.randint(1, 99)}", f"return {name}", f"{name}.append({rng.randint(0, 9)})",
+                       f"if {name} is None: raise ValueError('{name}')", f"log.debug('{name}=%s', {name})"])
+    return "    " * depth + body
+
+def _new_file(rng: random.Random, n_functions: int) -> list:
+    lines = ["import logging", "", "log = logging.getLogger(__name__)", ""]
+    for i in range(n_functions):
+        lines.append(f"def func_{i}(value, items=None):")
+        lines.extend(_random_line(rng, 1) for _ in range(rng.randint(3, 12)))
+        lines.append("")
+    return lines
+
+def _edit(rng: random.Random, lines: list) -> list:
+    """Applies a few clustered replacements, insertions and deletions."""
+    lines = list(lines)
+    for _ in range(rng.randint(1, 3)):
+        at = rng.randrange(4, max(len(lines), 5))
+        for offset in range(rng.randint(1, 4)):
+            i = min(at + offset, len(lines))
+            action = rng.random()
+            if action < 0.5 and i < len(lines):
+                lines[i] = _random_line(rng, 1)
+            elif action < 0.8 or i >= len(lines):
+                lines.insert(i, _random_line(rng, 1))
+            else:
+                del lines[i]
+    return lines
+
+def _data(text: str) -> bytes:
+    payload = text.encode('utf-8')
+    return b"data %d\n" % len(payload) + payload + b"\n"
+
+def build_synthetic_repo(path: str, n_commits: int = 500, n_files: int = 40, files_per_commit: int = 3,
+                         bug_fix_ratio: float = 0.5, seed: int = 0) -> str:
+    """Creates a repository at `path` (which must not exist) and returns the path."""
+    rng = random.Random(seed)
+    os.makedirs(path)
+    subprocess.run(["git", "init", "-q", path], check=True)
+    subprocess.run(["git", "-C", path, "symbolic-ref", "HEAD", "refs/heads/main"], check=True)
+
+    files = {f"pkg/module_{i:03d}.py": _new_file(rng, rng.randint(3, 10)) for i in range(n_files)}
+    stream = [b"commit refs/heads/main\nmark :1\ncommitter Bench <bench@example.com> 1600000000 +0000\n", _data("initial import")]
+    stream.extend(b"M 100644 inline %s\n" % name.encode() + _data("\n".join(lines) + "\n") for name, lines in files.items())
+
+    for mark in range(2, n_commits + 1):
+        templates = BUG_FIX_MESSAGES if rng.random() < bug_fix_ratio else OTHER_MESSAGES
+        message = rng.choice(templates).format(name=rng.choice(["parser", "cache", "loader", "session", "geocoder"]))
+        stream.append(b"commit refs/heads/main\nmark :%d\ncommitter Bench <bench@example.com> %d +0000\n" % (mark, 1600000000 + mark * 60))
+        stream.append(_data(f"{message}\n\nSynthetic commit {mark}."))
+        stream.append(b"from :%d\n" % (mark - 1))
+        for _ in range(rng.randint(1, files_per_commit)):
+            action = rng.random()
+            if action < 0.05:
+                name = f"pkg/new_{mark:05d}.py"
+                files[name] = _new_file(rng, rng.randint(1, 4))
+            elif action < 0.08 and len(files) > 1:
+                name = rng.choice(sorted(files))
+                del files[name]
+                stream.append(b"D %s\n" % name.encode())
+                continue
+            else:
+                name = rng.choice(sorted(files))
+                files[name] = _edit(rng, files[name])
+            stream.append(b"M 100644 inline %s\n" % name.encode() + _data("\n".join(files[name]) + "\n"))
+
+    subprocess.run(["git", "-C", path, "fast-import", "--quiet"], input=b"".join(stream), check=True)
+    subprocess.run(["git", "-C", path, "checkout", "-q", "-f", "main"], check=True)
+    return path
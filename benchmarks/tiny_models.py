@@ -0,0 +1,58 @@
+# benchmarks/tiny_models.py
+"""
+Builds randomly initialized tiny stand-ins for the baseline and analysis LLMs.
+
+Both share a small byte-level BPE tokenizer trained on diff-like text, so they
+load through the same AutoTokenizer/AutoModel code paths as the real models
+without any download. Their outputs are meaningless; only speed is measured.
+"""
+import os
+import torch
+from tokenizers import Tokenizer, models, pre_tokenizers, decoders, trainers
+from transformers import PreTrainedTokenizerFast, Qwen2Config, Qwen2ForCausalLM, T5Config, T5ForConditionalGeneration
+
+CHAT_TEMPLATE = (
+    "{% for m in messages %}<|im_start|>{{ m['role'] }}\n{{ m['content'] }}<|im_end|>\n{% endfor %}"
+    "{% if add_generation_prompt %}<|im_start|>assistant\n{% endif %}"
+)
+TRAINING_TEXT = [
+    "def func(value, items=None):\n    return value + 1\n", "@@ -10,7 +10,8 @@ def func_2(value):",
+    "fix: handle missing config in loader", '{"score": 3, "justification": "clear and specific"}',
+    '{"rectified_message": "fix(parser): handle empty input"}', '{"improvement_category": "Semantic", "reason": "adds scope"}',
+]
+
+def _train_tokenizer(vocab_size: int) -> Tokenizer:
+    tokenizer = Tokenizer(models.BPE(unk_token=None))
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(
+        vocab_size=vocab_size, special_tokens=["<pad>", "</s>", "<unk>", "<|im_start|>", "<|im_end|>"],
+        initial_alphabet=pre_tokenizers.ByteLevel.alphabet()
+    )
+    tokenizer.train_from_iterator(TRAINING_TEXT * 100, trainer)
+    return tokenizer
+
+def build_tiny_models(out_dir: str, hidden_size: int = 64, num_layers: int = 2, vocab_size: int = 1000, seed: int = 0) -> tuple:
+    """Saves a tiny T5 and a tiny Qwen2 model under `out_dir`. Returns (t5_path, causal_lm_path)."""
+    torch.manual_seed(seed)
+    tokenizer = _train_tokenizer(vocab_size)
+    t5_path, causal_path = os.path.join(out_dir, "tiny-t5"), os.path.join(out_dir, "tiny-causal-lm")
+
+    causal_tokenizer = PreTrainedTokenizerFast(tokenizer_object=tokenizer, pad_token="<pad>", eos_token="<|im_end|>", unk_token="<unk>")
+    causal_tokenizer.chat_template = CHAT_TEMPLATE
+    causal_tokenizer.save_pretrained(causal_path)
+    Qwen2ForCausalLM(Qwen2Config(
+        vocab_size=len(causal_tokenizer), hidden_size=hidden_size, intermediate_size=hidden_size * 2,
+        num_hidden_layers=num_layers, num_attention_heads=4, num_key_value_heads=2, max_position_embeddings=16384,
+        pad_token_id=causal_tokenizer.pad_token_id, eos_token_id=causal_tokenizer.eos_token_id,
+        bos_token_id=causal_tokenizer.eos_token_id
+    )).save_pretrained(causal_path)
+
+    t5_tokenizer = PreTrainedTokenizerFast(tokenizer_object=tokenizer, pad_token="<pad>", eos_token="</s>", unk_token="<unk>")
+    t5_tokenizer.save_pretrained(t5_path)
+    T5ForConditionalGeneration(T5Config(
+        vocab_size=len(t5_tokenizer), d_model=hidden_size, d_ff=hidden_size * 2, d_kv=hidden_size // 4,
+        num_layers=num_layers, num_heads=4, pad_token_id=t5_tokenizer.pad_token_id,
+        eos_token_id=t5_tokenizer.eos_token_id, decoder_start_token_id=t5_tokenizer.pad_token_id
+    )).save_pretrained(t5_path)
+    return t5_path, causal_path
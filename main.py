@@ -1,20 +1,133 @@
 # main.py
 """
 Main entry point for the CS202 Lab 2 analysis pipeline.
+
+Runs the whole pipeline by default, or a single command:
+
+    mine      mine the repository into the mining cache
+    baseline  mine, then generate missing baseline messages
+    analyze   mine, then analyze rows that have a baseline message
+    report    print the text report from the results summary
+    status    show mining, baseline and analysis progress
+    plot      render the report figures
+
+Heavy libraries (torch, transformers, pydriller, matplotlib) are imported only
+by the commands that need them, so `report` and `status` start quickly.
+`--config` selects another configuration file, `--set section.key=value`
+overrides single settings, and `-v` logs how long each first import took.
+
+For sharded analysis, run one shard per process or machine with `--shard i/N`
+and combine their results with `--merge`, or use `--shards N` to run N local
+shard processes and merge automatically.
 """
-import pandas as pd
-from src.pipeline import AnalysisPipeline
-from src.reporting import generate_text_report
-from src.utils import setup_logging
+import sys
+import time
+import logging
+import argparse
+import builtins
 from src.config_loader import config
+from src.utils import setup_logging
+
+COMMANDS = {
+    "run": "Run the whole pipeline and print the report (default).",
+    "mine": "Mine the repository into the mining cache.",
+    "baseline": "Mine, then generate missing baseline messages.",
+    "analyze": "Mine, then analyze rows that already have a baseline message.",
+    "report": "Print the text report from the results summary.",
+    "status": "Show mining, baseline and analysis progress without loading any model.",
+    "plot": "Render the report figures into the visuals directory.",
+}
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="CS202 Lab 2 commit message analysis pipeline.")
+    parser.add_argument("command", nargs="?", default="run", choices=list(COMMANDS),
+                        help="; ".join(f"{name}: {text}" for name, text in COMMANDS.items()))
+    parser.add_argument("--config", metavar="PATH", help="Configuration file to use instead of config.yaml.")
+    parser.add_argument("--set", dest="overrides", action="append", default=[], metavar="SECTION.KEY=VALUE",
+                        help="Override one setting (value parsed as YAML), e.g. --set io.processing_limit=50. Repeatable.")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Log the time taken by each slow module import.")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--shard", metavar="i/N", help="Analyze only shard i of N, writing to its own results part.")
+    mode.add_argument("--shards", type=int, metavar="N", help="Analyze with N local shard processes, then merge.")
+    mode.add_argument("--merge", action="store_true", help="Merge shard results parts into the final output.")
+    args = parser.parse_args()
+    if (args.shard or args.shards or args.merge) and args.command != "run":
+        parser.error("--shard, --shards and --merge can only be used with the run command.")
+    try:
+        config.configure(args.config, args.overrides)
+    except (KeyError, ValueError) as e:
+        parser.error(str(e).strip("'\""))
+    return args
+
+def time_imports(threshold_ms: float = 20.0) -> None:
+    """
+    Logs each first import of a top-level package, or of a module imported
+    directly by the command, that takes at least `threshold_ms`. Times include
+    nested imports, which are logged first and indented by nesting depth.
+    """
+    original_import = builtins.__import__
+    depth = 0
+
+    def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+        nonlocal depth
+        if level or name in sys.modules:
+            return original_import(name, globals, locals, fromlist, level)
+        depth += 1
+        start = time.perf_counter()
+        try:
+            return original_import(name, globals, locals, fromlist, level)
+        finally:
+            depth -= 1
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if elapsed_ms >= threshold_ms and (depth == 0 or '.' not in name):
+                logging.info(f"{'  ' * depth}import {name}: {elapsed_ms:.0f} ms")
+
+    builtins.__import__ = timed_import
+
+def print_report() -> None:
+    from src.reporting import generate_text_report
+    from src.summary_index import load_summary
+    summary = load_summary()
+    if summary is None:
+        logging.error(f"No results found at {config['io']['output_csv_path']}; run the pipeline first.")
+        raise SystemExit(1)
+    # Generate the final text summary from the results summary
+    generate_text_report(summary)
+
+def run(args: argparse.Namespace) -> None:
+    if args.command == "status":
+        from src.status import print_status
+        print_status()
+    elif args.command == "report":
+        print_report()
+    elif args.command == "plot":
+        import visualize
+        visualize.main()
+    elif args.command in ("mine", "baseline", "analyze"):
+        from src.pipeline import AnalysisPipeline
+        AnalysisPipeline().run(stages=("mine",) if args.command == "mine" else ("mine", args.command))
+    elif args.shard:
+        from src.sharding import parse_shard_spec, run_shard
+        run_shard(*parse_shard_spec(args.shard))
+    else:
+        if args.shards:
+            from src.sharding import run_local_shards
+            run_local_shards(args.shards)
+        elif args.merge:
+            from src.sharding import merge_shards
+            merge_shards()
+        else:
+            from src.pipeline import AnalysisPipeline
+            # Run the main data processing pipeline
+            AnalysisPipeline().run()
+        print_report()
 
 if __name__ == "__main__":
+    started = time.perf_counter()
+    args = parse_args()
     setup_logging()
-    
-    # Run the main data processing pipeline
-    pipeline = AnalysisPipeline()
-    pipeline.run()
-    
-    # Generate the final text summary from the completed CSV
-    final_df = pd.read_csv(config['io']['output_csv_path'])
-    generate_text_report(final_df)
\ No newline at end of file
+    if args.verbose:
+        time_imports()
+    run(args)
+    if args.verbose:
+        logging.info(f"'{args.command}' finished in {time.perf_counter() - started:.2f}s.")
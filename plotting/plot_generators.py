@@ -1,9 +1,10 @@
 # plotting/plot_generators.py
 """
 Contains dedicated functions for generating each of the visualizations
-for the final report. Each function is self-contained and returns a
-matplotlib Figure object.
+for the final report. Each function is self-contained, takes the results
+summary (see `src.summary_index`) and returns a matplotlib Figure object.
 """
+from typing import Optional
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
@@ -11,10 +12,29 @@ import numpy as np
 import matplotlib.patches as mpatches
 from plotting.styler import COLORS_MAIN, COLORS_DONUT
 
-def create_quality_comparison_chart(df: pd.DataFrame) -> plt.Figure:
+SCORE_SOURCES = {'Developer_Score': 'Developer', 'Baseline_LLM_Score': 'Baseline LLM', 'Rectifier_Score': 'Rectifier'}
+
+def _score_histogram(summary: dict, col: str) -> pd.Series:
+    """Counts per score value of one source, indexed by the integer score."""
+    histogram = summary['scores'].get(col, {})
+    return pd.Series({int(score): count for score, count in histogram.items()}, dtype='int64')
+
+def _strip_counts(hist: pd.Series, max_points: Optional[int]) -> pd.Series:
+    """
+    Points per score drawn in the strip layer: the histogram itself, or above
+    `max_points` scores a proportional sample that keeps every non-empty bin.
+    """
+    total = hist.sum()
+    if not max_points or total <= max_points:
+        return hist
+    return np.maximum((hist * max_points / total).round().astype('int64'), 1)
+
+def create_quality_comparison_chart(summary: dict) -> plt.Figure:
     """Generates the horizontal bar chart comparing average scores."""
-    mean_scores = df[['Developer_Score', 'Baseline_LLM_Score', 'Rectifier_Score']].mean()
-    mean_scores.index = ['Developer', 'Baseline LLM', 'Rectifier']
+    mean_scores = pd.Series({
+        label: (hist.index * hist).sum() / hist.sum() if hist.sum() else np.nan
+        for label, hist in ((label, _score_histogram(summary, col)) for col, label in SCORE_SOURCES.items())
+    })
     scores_series = mean_scores.sort_values(ascending=True)
     fig, ax = plt.subplots(figsize=(10, 6))
     bars = ax.barh(scores_series.index, scores_series.values, color=[COLORS_MAIN[label] for label in scores_series.index])
@@ -28,14 +48,24 @@ def create_quality_comparison_chart(df: pd.DataFrame) -> plt.Figure:
     fig.tight_layout(rect=[0, 0, 1, 0.93])
     return fig
 
-def create_score_distribution_chart(df: pd.DataFrame) -> plt.Figure:
-    """Generates the violin plot showing score distributions."""
-    df_long = df.melt(value_vars=['Developer_Score', 'Baseline_LLM_Score', 'Rectifier_Score'], var_name='Message Source', value_name='Quality Score')
-    df_long['Message Source'] = df_long['Message Source'].map({'Developer_Score': 'Developer', 'Baseline_LLM_Score': 'Baseline LLM', 'Rectifier_Score': 'Rectifier'})
+def create_score_distribution_chart(summary: dict, strip_max_points: Optional[int] = None) -> plt.Figure:
+    """
+    Generates the violin plot showing score distributions. The strip layer draws
+    at most about `strip_max_points` points per source (all of them when None).
+    """
+    histograms = {label: _score_histogram(summary, col) for col, label in SCORE_SOURCES.items()}
+    # Scores are integers, so expanding the histograms reproduces the scored rows exactly.
+    def expand(counts: dict) -> pd.DataFrame:
+        return pd.concat([
+            pd.DataFrame({'Message Source': label, 'Quality Score': np.repeat(hist.index.to_numpy(), hist.to_numpy())})
+            for label, hist in counts.items()
+        ], ignore_index=True)
+    df_long = expand(histograms)
+    df_strip = expand({label: _strip_counts(hist, strip_max_points) for label, hist in histograms.items()})
     order = ['Developer', 'Baseline LLM', 'Rectifier']
     fig, ax = plt.subplots(figsize=(10, 7))
     sns.violinplot(data=df_long, x='Message Source', y='Quality Score', order=order, palette=COLORS_MAIN, inner='box', hue='Message Source', legend=False, ax=ax, linewidth=2)
-    sns.stripplot(data=df_long, x='Message Source', y='Quality Score', order=order, color='#404040', alpha=0.1, jitter=0.2, size=3, ax=ax)
+    sns.stripplot(data=df_strip, x='Message Source', y='Quality Score', order=order, color='#404040', alpha=0.1, jitter=0.2, size=3, ax=ax)
     fig.suptitle("Rectifier's Scores are Less Variable and Skew Higher", fontsize=22, fontweight='bold', ha='left', x=0.125, y=0.98)
     ax.set_title('Score distribution reveals consistency and performance', fontsize=14, loc='left', pad=10, color='gray')
     ax.set_xlabel('Message Source', fontsize=12, labelpad=15, color='gray')
@@ -47,9 +77,9 @@ def create_score_distribution_chart(df: pd.DataFrame) -> plt.Figure:
     fig.tight_layout(rect=[0, 0, 1, 0.93])
     return fig
 
-def create_improvement_breakdown_chart(df: pd.DataFrame) -> plt.Figure:
+def create_improvement_breakdown_chart(summary: dict) -> plt.Figure:
     """Generates the donut chart with non-overlapping external labels for small slices."""
-    category_counts = df['Improvement_Category'].value_counts()
+    category_counts = pd.Series(summary['categories'], dtype='int64')
     category_order = ['Corrective', 'Semantic', 'Cosmetic', 'Trivial', 'Regressive']
     df_donut = pd.DataFrame({'counts': category_counts}).reindex(category_order).dropna().sort_values(by='counts', ascending=False)
     percentages = df_donut['counts'] * 100 / df_donut['counts'].sum()
@@ -0,0 +1,127 @@
+# plotting/renderer.py
+"""
+Renders the report figures, optionally in a process pool, and skips figures
+whose inputs have not changed since they were last rendered.
+
+Each figure is a `FigureJob`: an output file, a generator from
+`plot_generators`, the summary it plots and the generator's options. A job's
+input hash covers the summary counts, the options and the source of the
+plotting modules, and is recorded in a manifest in the output directory; a
+figure whose hash matches and whose file still exists is not rendered again.
+Variants of the report figures (for another repository or time window) are
+more jobs over another summary, so they are cached and parallelized alike.
+"""
+import os
+import json
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+MANIFEST_NAME = ".render_manifest.json"
+
+REPORT_FIGURES = {
+    "figure_1_quality_comparison": "create_quality_comparison_chart",
+    "figure_2_score_distribution": "create_score_distribution_chart",
+    "figure_3_improvement_breakdown": "create_improvement_breakdown_chart",
+}
+
+_PLOTTING_SOURCES = [os.path.join(os.path.dirname(os.path.abspath(__file__)), name) for name in ("plot_generators.py", "styler.py", "renderer.py")]
+
+class FigureJob:
+    """One figure to render: `generator(summary, **options)` saved as `filename`."""
+    def __init__(self, filename: str, generator: str, summary: dict, options: dict = None):
+        self.filename = filename
+        self.generator = generator
+        self.summary = summary
+        self.options = options or {}
+
+    def input_hash(self, source_digest: str) -> str:
+        """Hash of everything the figure depends on; the summary's timestamps and file signature are left out."""
+        counts = {key: self.summary.get(key) for key in ("rows", "scores", "categories")}
+        payload = json.dumps([self.generator, counts, self.options, source_digest], sort_keys=True)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+def figure_jobs(summary: dict, variant: str = "", strip_max_points: int = None) -> list:
+    """The report figures for `summary`; a `variant` name is appended to each filename."""
+    suffix = f"_{variant}" if variant else ""
+    options = {"create_score_distribution_chart": {"strip_max_points": strip_max_points}}
+    return [
+        FigureJob(f"{stem}{suffix}.png", generator, summary, options.get(generator))
+        for stem, generator in REPORT_FIGURES.items()
+    ]
+
+def _source_digest() -> str:
+    digest = hashlib.sha1()
+    for path in _PLOTTING_SOURCES:
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def setup_matplotlib() -> None:
+    """Selects the non-interactive backend and applies the report styles (run once per rendering process)."""
+    import matplotlib
+    matplotlib.use("Agg")
+    from plotting import styler
+    styler.apply_global_styles()
+
+def render_figure(job: FigureJob, output_dir: str) -> str:
+    """Draws and saves one figure, returning its filename."""
+    import matplotlib.pyplot as plt
+    from plotting import plot_generators
+    fig = getattr(plot_generators, job.generator)(job.summary, **job.options)
+    fig.savefig(os.path.join(output_dir, job.filename), bbox_inches='tight')
+    plt.close(fig)
+    return job.filename
+
+def _load_manifest(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def _write_manifest(path: str, manifest: dict) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def render_figures(jobs: list, output_dir: str, workers: int = None, skip_unchanged: bool = True) -> list:
+    """
+    Renders `jobs` into `output_dir`, in up to `workers` processes (one per core
+    when None), and returns the filenames rendered. With `skip_unchanged`,
+    figures whose input hash matches the manifest and whose file exists are skipped.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    manifest = _load_manifest(manifest_path)
+    source_digest = _source_digest()
+    hashes = {job.filename: job.input_hash(source_digest) for job in jobs}
+    pending = []
+    for job in jobs:
+        if skip_unchanged and manifest.get(job.filename) == hashes[job.filename] and os.path.exists(os.path.join(output_dir, job.filename)):
+            print(f"Skipping {job.filename} (inputs unchanged).")
+        else:
+            pending.append(job)
+
+    # Processes beyond the number of cores only add start-up time.
+    workers = min(workers or os.cpu_count() or 1, os.cpu_count() or 1, len(pending))
+    rendered = []
+    try:
+        if workers > 1:
+            print(f"Rendering {len(pending)} figures in {workers} processes...")
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'), initializer=setup_matplotlib) as pool:
+                futures = [pool.submit(render_figure, job, output_dir) for job in pending]
+                for future in as_completed(futures):
+                    rendered.append(future.result())
+                    print(f"Generated {rendered[-1]}.")
+        elif pending:
+            setup_matplotlib()
+            for job in pending:
+                print(f"Generating {job.filename}...")
+                rendered.append(render_figure(job, output_dir))
+    finally:
+        # Record whatever finished, so a failed figure does not force the others to be redrawn.
+        if rendered:
+            manifest.update({filename: hashes[filename] for filename in rendered})
+            _write_manifest(manifest_path, manifest)
+    return rendered
@@ -0,0 +1,51 @@
+# src/blob_store.py
+"""
+A content-addressed, deduplicated on-disk store for file bodies.
+
+Mined rows reference source files by the SHA-1 of their UTF-8 content instead
+of embedding them, so each distinct file version is written to disk exactly
+once no matter how many commits touch it, and it is only read back on demand.
+"""
+import os
+import zlib
+import hashlib
+import tempfile
+from typing import Optional
+
+class BlobStore:
+    """Stores zlib-compressed text under `<root>/<key[:2]>/<key[2:]>`."""
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def key_for(text: str) -> str:
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key[2:])
+
+    def put(self, text: Optional[str]) -> Optional[str]:
+        """Stores `text` if it is not already present and returns its key."""
+        if text is None:
+            return None
+        key = self.key_for(text)
+        path = self._path(key)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write-then-rename keeps concurrent writers (e.g. mining workers) from exposing partial blobs.
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as f:
+                f.write(zlib.compress(text.encode('utf-8')))
+            os.replace(tmp_path, path)
+        return key
+
+    def get(self, key: Optional[str]) -> Optional[str]:
+        """Loads the text stored under `key`, or None for a missing source."""
+        if not isinstance(key, str) or not key:
+            return None
+        with open(self._path(key), 'rb') as f:
+            return zlib.decompress(f.read()).decode('utf-8')
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
@@ -5,11 +5,21 @@ Loads the central YAML configuration file for the project.
 This module ensures that the configuration is loaded only once and can be
 accessed as a shared Python object across the entire application, providing
 a single source of truth for all settings.
+
+The file is read on first access rather than at import time. `configure` picks
+a different file and applies `section.key=value` overrides; both are passed on
+through environment variables, so worker processes see the same settings.
 """
-import yaml
+import os
+import json
+from collections.abc import MutableMapping
+
+CONFIG_PATH_ENV = "LAB2_CONFIG"
+CONFIG_OVERRIDES_ENV = "LAB2_CONFIG_OVERRIDES"
 
 def load_config(path: str = 'config.yaml') -> dict:
     """Loads a YAML file and returns its content as a dictionary."""
+    import yaml
     try:
         with open(path, 'r') as f:
             return yaml.safe_load(f)
@@ -20,5 +30,67 @@ def load_config(path: str = 'config.yaml') -> dict:
         print(f"FATAL ERROR: Error parsing YAML configuration file: {e}")
         exit()
 
-# Load the configuration once when the module is first imported.
-config = load_config()
\ No newline at end of file
+def parse_override(override: str) -> tuple:
+    """Splits 'section.key=value' into (['section', 'key'], value), parsing the value as YAML."""
+    import yaml
+    key, sep, value = override.partition('=')
+    if not sep or not key:
+        raise ValueError(f"Invalid override '{override}': expected section.key=value.")
+    return key.split('.'), yaml.safe_load(value)
+
+def apply_override(settings: dict, path: list, value) -> None:
+    """Sets an existing key of `settings`; unknown keys are rejected so typos do not go unnoticed."""
+    node = settings
+    for depth, key in enumerate(path):
+        if not isinstance(node, dict) or key not in node:
+            raise KeyError(f"Unknown configuration key '{'.'.join(path[:depth + 1])}'.")
+        if depth == len(path) - 1:
+            node[key] = value
+        else:
+            node = node[key]
+
+class LazyConfig(MutableMapping):
+    """The configuration dictionary, loaded when it is first used."""
+    def __init__(self):
+        self._data = None
+
+    def _load(self) -> dict:
+        if self._data is None:
+            data = load_config(os.environ.get(CONFIG_PATH_ENV, 'config.yaml'))
+            for path, value in json.loads(os.environ.get(CONFIG_OVERRIDES_ENV, '[]')):
+                apply_override(data, path, value)
+            self._data = data
+        return self._data
+
+    def configure(self, path: str = None, overrides: list = ()) -> None:
+        """Selects the configuration file and 'section.key=value' overrides, then reloads on next use."""
+        if path is not None:
+            os.environ[CONFIG_PATH_ENV] = path
+        if overrides:
+            parsed = [parse_override(override) for override in overrides]
+            os.environ[CONFIG_OVERRIDES_ENV] = json.dumps(parsed)
+        self._data = None
+        try:
+            self._load()
+        except KeyError:
+            os.environ.pop(CONFIG_OVERRIDES_ENV, None)
+            self._data = None
+            raise
+
+    def __getitem__(self, key):
+        return self._load()[key]
+
+    def __setitem__(self, key, value):
+        self._load()[key] = value
+
+    def __delitem__(self, key):
+        del self._load()[key]
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+# Shared by every module; the file is read on first access.
+config = LazyConfig()
@@ -1,71 +1,313 @@
 # src/data_handler.py
 """
 Handles all data loading, merging, and saving operations for the pipeline's DataFrame.
+
+With `io.compact_schema`, the results table is kept in compact dtypes: Arrow
+strings (when pyarrow is installed), categoricals for the hash, filename and
+improvement category, and small integer scores. Commit messages, which repeat
+for every file of a commit, move to a side table keyed by hash and are joined
+back on demand by `with_commit_fields`.
 """
 import os
 import logging
+from typing import Optional
 import pandas as pd
 from src.config_loader import config
+from src.metrics import metrics, current_rss_mb
+from src.results_store import ResultsStore
+from src.summary_index import SummaryIndex
+
+# Rows per chunk when reading a previous results CSV or exporting a compact table.
+CSV_CHUNK_ROWS = 10_000
+
+def string_dtype() -> pd.StringDtype:
+    """Arrow-backed strings when pyarrow is installed, otherwise pandas' own string dtype."""
+    try:
+        import pyarrow  # noqa: F401
+        return pd.StringDtype("pyarrow")
+    except ImportError:
+        return pd.StringDtype("python")
 
 class DataHandler:
-    def __init__(self, mined_df: pd.DataFrame):
-        self.df = self._initialize_dataframe(mined_df)
+    def __init__(self, mined_df: Optional[pd.DataFrame] = None):
+        """Wraps `mined_df`, or starts empty so that rows can be added in chunks with `add_rows`."""
+        cols = config['columns']
         self.output_path = config['io']['output_csv_path']
+        self.key_cols = [cols['hash'], cols['message'], cols['filename'], cols['diff']]
+        self.string_cols = [
+            cols['baseline_msg'], cols['rectified_msg'], cols['improvement_cat'],
+            cols['improvement_reason'], cols['dev_justify'], cols['llm_justify'],
+            cols['rectifier_justify']
+        ]
+        self.numeric_cols = [
+            cols['dev_score'], cols['llm_score'], cols['rectifier_score'], cols['diff_tokens'],
+            cols['dev_score_expected'], cols['llm_score_expected'], cols['rectifier_score_expected']
+        ]
+        self.analysis_cols = self.string_cols + self.numeric_cols
+
+        self.compact = config['io']['compact_schema']
+        self.hash_col, self.message_col = cols['hash'], cols['message']
+        self.commits = None
+        self._message_position = 1
+        self.dtypes = self._compact_dtypes() if self.compact else {}
+
+        self.store = None
+        if config['io']['results_backend'] == 'sqlite':
+            self.store = ResultsStore(config['io']['results_db_path'])
+        self._dirty = set()
+        self._previous_results = None
+        self.summary = SummaryIndex()
+        self.summary_path = config['io']['summary_path']
+        rss_before = current_rss_mb()
+        self.df = self._initialize_dataframe(mined_df) if mined_df is not None else None
+        if self.df is not None:
+            self.summary.update(self.df, self.df.index)
+            self._log_memory(rss_before)
+
+    def _compact_dtypes(self) -> dict:
+        cols = config['columns']
+        text = string_dtype()
+        dtypes = {col: text for col in self.string_cols + [cols['diff'], cols['source_before'], cols['source_current']]}
+        dtypes.update({cols['hash']: 'category', cols['filename']: 'category', cols['improvement_cat']: 'category'})
+        dtypes.update({col: 'Int8' for col in (cols['dev_score'], cols['llm_score'], cols['rectifier_score'])})
+        dtypes.update({col: 'float32' for col in (cols['dev_score_expected'], cols['llm_score_expected'], cols['rectifier_score_expected'])})
+        dtypes[cols['diff_tokens']] = 'Int32'
+        return dtypes
+
+    def _log_memory(self, rss_before: float) -> None:
+        table_mb = self.df.memory_usage(deep=True).sum() / 2**20
+        if self.commits is not None:
+            table_mb += self.commits.memory_usage(deep=True).sum() / 2**20
+        schema = "compact" if self.compact else "object"
+        logging.info(
+            f"Results table: {len(self.df)} rows in {table_mb:.1f} MB ({schema} schema); "
+            f"RSS {rss_before:.0f} MB before loading, {current_rss_mb():.0f} MB after."
+        )
+
+    def _ensure_schema(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Adds any missing analysis columns with their correct initial types."""
+        for col in self.string_cols:
+            if col not in df.columns:
+                df[col] = pd.Series(dtype=self.dtypes.get(col, 'object'), index=df.index)
+        for col in self.numeric_cols:
+            if col not in df.columns:
+                df[col] = pd.Series(dtype=self.dtypes.get(col, 'float64'), index=df.index) # Use float to allow for NaN
+        if self.compact:
+            df = df.astype({col: dtype for col, dtype in self.dtypes.items() if col in df.columns and not self._has_dtype(df[col], dtype)})
+        return df
+
+    @staticmethod
+    def _has_dtype(series: pd.Series, dtype) -> bool:
+        """True if `series` already has `dtype`; strings with the same storage count, whatever their missing-value marker."""
+        if isinstance(dtype, pd.StringDtype) and isinstance(series.dtype, pd.StringDtype):
+            return series.dtype.storage == dtype.storage
+        return series.dtype == dtype
+
+    def _normalize_commits(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Moves the commit message into the commit side table, leaving one copy per commit."""
+        if not self.compact or self.message_col not in df.columns:
+            return df
+        self._message_position = df.columns.get_loc(self.message_col)
+        commits = df[[self.hash_col, self.message_col]].drop_duplicates(self.hash_col).astype(str)
+        commits = commits.set_index(self.hash_col)[self.message_col].astype(string_dtype()).to_frame()
+        self.commits = commits if self.commits is None else pd.concat([self.commits, commits[~commits.index.isin(self.commits.index)]])
+        return df.drop(columns=[self.message_col])
+
+    def with_commit_fields(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Returns `df` with the commit message column, joined from the side table when it was normalized out."""
+        if self.message_col in df.columns:
+            return df
+        joined = df.copy()
+        messages = self.commits[self.message_col].reindex(joined[self.hash_col].astype(str)).values
+        joined.insert(self._message_position, self.message_col, messages)
+        return joined
 
     def _initialize_dataframe(self, mined_df: pd.DataFrame) -> pd.DataFrame:
         """
-        Intelligently merges newly mined data with existing results OR initializes a clean
-        DataFrame with a stable schema for a fresh run.
+        Merges newly mined data with existing results by row key, OR initializes a
+        clean DataFrame with a stable schema for a fresh run.
         """
-        cols = config['columns']
-        key_cols = [cols['hash'], cols['message'], cols['filename'], cols['diff']]
-        
-        output_path = config['io']['output_csv_path']
-        if os.path.exists(output_path):
-            logging.info(f"Resuming from existing file: {output_path}")
-            processed_df = pd.read_csv(output_path)
-            analysis_cols = [
-                cols['baseline_msg'], cols['rectified_msg'], cols['improvement_cat'],
-                cols['improvement_reason'], cols['dev_score'], cols['llm_score'],
-                cols['rectifier_score'], cols['dev_justify'], cols['llm_justify'],
-                cols['rectifier_justify']
-            ]
-            cols_to_merge = key_cols + [c for c in analysis_cols if c in processed_df.columns]
-            merged_df = pd.merge(mined_df, processed_df[cols_to_merge], on=key_cols, how='left')
-        else:
-            logging.info("No existing results file found. Initializing new DataFrame schema.")
-            merged_df = mined_df
-            
-            # Define columns and their correct initial types
-            string_cols = [
-                cols['baseline_msg'], cols['rectified_msg'], cols['improvement_cat'],
-                cols['improvement_reason'], cols['dev_justify'], cols['llm_justify'],
-                cols['rectifier_justify']
-            ]
-            numeric_cols = [
-                cols['dev_score'], cols['llm_score'], cols['rectifier_score']
-            ]
-            
-            # Initialize with types that pandas understands correctly
-            for col in string_cols:
-                merged_df[col] = pd.Series(dtype='object')
-            for col in numeric_cols:
-                merged_df[col] = pd.Series(dtype='float64') # Use float to allow for NaN
-        
+        row_keys = pd.Series(self.row_keys(mined_df), index=mined_df.index)
+        merged_df = self._ensure_schema(self._normalize_commits(mined_df))
+        completed = self._load_previous_results()
+        if completed is not None and not completed.empty:
+            self._fill_from_results(merged_df, completed, row_keys)
         return merged_df
 
+    def _read_results_csv(self) -> pd.DataFrame:
+        """
+        Reads the analysis columns of the results CSV indexed by row key. Chunks are
+        read one at a time and their key columns (including the diff) are dropped
+        once hashed, so memory holds only the analysis values of completed rows.
+        """
+        parts = []
+        wanted = self.key_cols + self.analysis_cols
+        for chunk in pd.read_csv(self.output_path, usecols=lambda c: c in wanted, chunksize=CSV_CHUNK_ROWS):
+            present_cols = [c for c in self.analysis_cols if c in chunk.columns]
+            chunk = chunk.dropna(subset=present_cols, how='all')
+            # Empty strings in the key columns come back from the CSV as NaN.
+            keys = self.row_keys(chunk[self.key_cols].fillna(''))
+            chunk = chunk[present_cols]
+            chunk.index = keys
+            if self.compact:
+                chunk = chunk.astype({c: self.dtypes[c] for c in present_cols if self.dtypes[c] != 'category'})
+            parts.append(chunk)
+        if not parts:
+            return pd.DataFrame(columns=self.analysis_cols)
+        results = pd.concat(parts)
+        return results[~results.index.duplicated(keep='last')]
+
+    def _load_previous_results(self):
+        """Reads the existing results once, indexed by row key; later chunks merge against the same copy."""
+        if self._previous_results is None:
+            if self.store is not None:
+                if len(self.store) == 0 and os.path.exists(self.output_path):
+                    self._import_csv_into_store()
+                self._previous_results = pd.DataFrame.from_dict(self.store.load(), orient='index')
+                if not self._previous_results.empty:
+                    logging.info(f"Resuming from {len(self._previous_results)} stored rows in {config['io']['results_db_path']}")
+                else:
+                    logging.info("No stored results found. Initializing new DataFrame schema.")
+            elif os.path.exists(self.output_path):
+                logging.info(f"Resuming from existing file: {self.output_path}")
+                # The source code columns are never merged, so skip parsing them entirely.
+                self._previous_results = self._read_results_csv()
+            else:
+                logging.info("No existing results file found. Initializing new DataFrame schema.")
+                self._previous_results = False
+        return self._previous_results if self._previous_results is not False else None
+
+    def row_keys(self, df: pd.DataFrame) -> list:
+        if self.message_col not in df.columns:
+            df = self.with_commit_fields(df[[self.hash_col] + self.key_cols[2:]])
+        return [ResultsStore.row_key(values) for values in zip(*(df[c].tolist() for c in self.key_cols))]
+
+    def _fill_from_results(self, df: pd.DataFrame, results: pd.DataFrame, row_keys: pd.Series = None) -> pd.Index:
+        """Copies analysis columns from `results` (indexed by row key) into matching rows of `df`."""
+        if row_keys is None:
+            row_keys = pd.Series(self.row_keys(df), index=df.index)
+        matched = row_keys[row_keys.isin(results.index)]
+        if not matched.empty:
+            stored = results.reindex(matched.values)
+            for col in self.analysis_cols:
+                if col in stored.columns:
+                    self._assign(df, matched.index, col, stored[col])
+        return matched.index
+
+    @staticmethod
+    def _assign(df: pd.DataFrame, index, col: str, values: pd.Series) -> None:
+        """Writes `values` into `df.loc[index, col]` in the column's dtype, adding any new categories first."""
+        dtype = df[col].dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            new = pd.Index(values.dropna().unique()).difference(dtype.categories)
+            if len(new):
+                df[col] = df[col].cat.add_categories(new)
+            df.loc[index, col] = values.astype(object).values
+        else:
+            df.loc[index, col] = values.astype(dtype).values
+
+    @staticmethod
+    def set_values(df: pd.DataFrame, index, data: dict) -> None:
+        """Sets one row's columns from `data`, extending categorical columns with values they have not seen."""
+        for col, value in data.items():
+            if isinstance(df[col].dtype, pd.CategoricalDtype) and isinstance(value, str) and value not in df[col].cat.categories:
+                df[col] = df[col].cat.add_categories([value])
+        df.loc[index, list(data.keys())] = list(data.values())
+
+    def result_records(self, df: pd.DataFrame) -> list:
+        """(row key, analysis values) pairs for the rows of `df`, with missing values as None."""
+        analysis = df[self.analysis_cols].astype(object)
+        return list(zip(self.row_keys(df), analysis.where(analysis.notnull(), None).to_dict('records')))
+
+    def _import_csv_into_store(self) -> None:
+        """One-off migration of results saved by the CSV backend into the results store."""
+        logging.info(f"Importing existing results from {self.output_path} into the results store.")
+        results = self._read_results_csv().astype(object)
+        self.store.write(list(zip(results.index, results.where(results.notnull(), None).to_dict('records'))))
+
+    def _concat(self, df: pd.DataFrame, chunk: pd.DataFrame) -> pd.DataFrame:
+        """Appends `chunk`, keeping categorical columns categorical by unifying their categories."""
+        for col in df.columns:
+            if isinstance(df[col].dtype, pd.CategoricalDtype) and isinstance(chunk[col].dtype, pd.CategoricalDtype):
+                categories = df[col].cat.categories.union(chunk[col].cat.categories)
+                df[col] = df[col].cat.set_categories(categories)
+                chunk[col] = chunk[col].cat.set_categories(categories)
+        return pd.concat([df, chunk])
+
+    def add_rows(self, mined_chunk: pd.DataFrame) -> pd.DataFrame:
+        """Merges a chunk of newly mined rows with previous results and appends it. Returns a copy of the new rows."""
+        start = len(self.df) if self.df is not None else 0
+        merged_chunk = self._initialize_dataframe(mined_chunk.reset_index(drop=True))
+        merged_chunk.index = pd.RangeIndex(start, start + len(merged_chunk))
+        self.df = merged_chunk if self.df is None else self._concat(self.df, merged_chunk)
+        self.summary.update(self.df, merged_chunk.index)
+        return self.with_commit_fields(merged_chunk)
+
+    def merge_results(self, results: dict, persist: bool = True) -> int:
+        """
+        Fills in rows from {row key: analysis values}, e.g. the result parts of
+        sharded workers. With `persist`, the rows are saved on the next save.
+        Returns the number of rows updated.
+        """
+        if not results:
+            return 0
+        matched = self._fill_from_results(self.df, pd.DataFrame.from_dict(results, orient='index'))
+        self.summary.update(self.df, matched)
+        if persist:
+            self._dirty.update(matched)
+        return len(matched)
+
     def get_dataframe(self) -> pd.DataFrame:
+        """The results table itself; with the compact schema it has no message column (see `with_commit_fields`)."""
         return self.df
 
     def get_rows_to_process(self, column_to_check: str) -> pd.DataFrame:
         """Returns rows that need processing based on a check for null values."""
-        return self.df[self.df[column_to_check].isnull()]
+        return self.with_commit_fields(self.df[self.df[column_to_check].isnull()])
 
     def update_row(self, index, data: dict):
         """Updates a single row in the DataFrame with new data."""
-        for key, value in data.items():
-            self.df.loc[index, key] = value
+        self.set_values(self.df, index, data)
+        self._dirty.add(index)
+
+    def mark_updated(self, indices) -> None:
+        """Flags rows that were modified directly on the DataFrame as needing a save."""
+        self._dirty.update(indices)
+
+    def _write_csv(self) -> None:
+        """Writes the full results table; compact tables are joined with the commit table one chunk at a time."""
+        if self.message_col in self.df.columns:
+            self.df.to_csv(self.output_path, index=False)
+            return
+        tmp_path = f"{self.output_path}.tmp"
+        for start in range(0, max(len(self.df), 1), CSV_CHUNK_ROWS):
+            chunk = self.with_commit_fields(self.df.iloc[start:start + CSV_CHUNK_ROWS])
+            chunk.to_csv(tmp_path, index=False, mode='w' if start == 0 else 'a', header=start == 0)
+        os.replace(tmp_path, self.output_path)
 
     def save_progress(self):
-        """Saves the entire DataFrame to the output CSV file."""
-        self.df.to_csv(self.output_path, index=False)
\ No newline at end of file
+        """
+        Persists progress. The CSV backend rewrites the entire output file; the
+        SQLite backend durably writes only the rows updated since the last save.
+        """
+        with metrics.stage("save_progress"):
+            self.summary.update(self.df, self._dirty)
+            if self.store is None:
+                self._write_csv()
+                self.summary.write(self.summary_path, self.output_path)
+                self._dirty.clear()
+                return
+            if not self._dirty:
+                return
+            self.store.write(self.result_records(self.df.loc[sorted(self._dirty)]))
+            self.summary.write(self.summary_path)
+            self._dirty.clear()
+
+    def finalize(self) -> None:
+        """Writes the complete results CSV once the run is over."""
+        if self.store is not None:
+            self.save_progress()
+            with metrics.stage("finalize"):
+                self._write_csv()
+                self.summary.write(self.summary_path, self.output_path)
+            logging.info(f"Exported {len(self.df)} rows to {self.output_path}")
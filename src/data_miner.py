@@ -2,63 +2,230 @@
 """Module for mining bug-fixing commits from a Git repository."""
 import os
 import logging
+import multiprocessing
 import re
+import subprocess
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from typing import Optional
 import pandas as pd
-from pydriller import Repository
+from pydriller import Git
 from tqdm.auto import tqdm
 from src.config_loader import config
+from src.blob_store import BlobStore
+from src.metrics import metrics
+from src.mining_cache import MiningCache
+from src.native_miner import iter_commits_native
 
-def mine_repository(limit: Optional[int] = None) -> pd.DataFrame:
+BUG_KEYWORDS = [
+    "fixed", "bug", "fixes", "fix", "crash", "solves", "resolves", "issue",
+    "regression", "fail", "npe", "except", "broken", "error", "hang",
+    "leak", "overflow", "avoid", "workaround", "break", "stop"
+]
+BUG_REGEX = re.compile(
+    r'.*((solv(ed|es|e|ing))|(fix(s|es|ing|ed)?)|((error|bug|issue)(s)?)).*',
+    re.IGNORECASE
+)
+# A single matcher equivalent to `any(k in msg.lower() for k in BUG_KEYWORDS) or BUG_REGEX.match(msg)`.
+# Every BUG_REGEX alternative except the "solv..." words already contains a keyword, and because
+# `.` does not cross newlines, BUG_REGEX.match can only succeed on the first line of the message.
+BUG_MATCHER = re.compile(
+    '|'.join(re.escape(k) for k in BUG_KEYWORDS) + r'|\A[^\n]*solv(?:e|ing)',
+    re.IGNORECASE
+)
+
+def is_bug_fix(message: str) -> bool:
+    """Returns True if a commit message looks like a bug fix."""
+    return BUG_MATCHER.search(message) is not None
+
+def extract_rows(commit, cols: dict, blob_store: Optional[BlobStore] = None) -> list:
+    """
+    Builds one row per modified Python file of a PyDriller commit. With a blob
+    store, the source columns hold content keys instead of the file bodies.
+    """
+    rows = []
+    for mod in commit.modified_files:
+        if mod.diff and mod.new_path and mod.new_path.endswith('.py'):
+            source_before, source_current = mod.source_code_before, mod.source_code
+            if blob_store:
+                source_before, source_current = blob_store.put(source_before), blob_store.put(source_current)
+            rows.append({
+                cols['hash']: commit.hash,
+                cols['message']: commit.msg,
+                cols['filename']: mod.new_path,
+                cols['diff']: mod.diff,
+                cols['source_before']: source_before,
+                cols['source_current']: source_current
+            })
+    return rows
+
+def _apply_limit(rows: list, limit: Optional[int], hash_col: str, kept_hashes: set) -> list:
+    """Keeps only the rows belonging to the first `limit` commits, counting those already in `kept_hashes`."""
+    if not limit:
+        return rows
+    limited = []
+    for row in rows:
+        if row[hash_col] not in kept_hashes:
+            if len(kept_hashes) >= limit: break
+            kept_hashes.add(row[hash_col])
+        limited.append(row)
+    return limited
+
+def _is_remote(repo_url: str) -> bool:
+    return repo_url.startswith(("git@", "https://", "http://", "git://"))
+
+def _prepare_local_repo(repo_url: str, local_path: str) -> str:
+    """Returns a local path to mine, cloning or fast-forwarding remote repositories."""
+    if not _is_remote(repo_url):
+        return repo_url
+    if os.path.isdir(os.path.join(local_path, '.git')):
+        if not config['mining']['update_clone']:
+            return local_path
+        result = subprocess.run(['git', '-C', local_path, 'pull', '--ff-only', '--quiet'], capture_output=True, text=True)
+        if result.returncode != 0:
+            logging.warning(f"Could not update local clone at {local_path}; mining the existing history. {result.stderr.strip()}")
+    else:
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        logging.info(f"Cloning {repo_url} into {local_path}")
+        subprocess.run(['git', 'clone', '--quiet', repo_url, local_path], check=True)
+    return local_path
+
+def _is_ancestor_of_head(repo_path: str, commit_hash: str) -> bool:
+    result = subprocess.run(['git', '-C', repo_path, 'merge-base', '--is-ancestor', commit_hash, 'HEAD'], capture_output=True)
+    return result.returncode == 0
+
+def _list_commit_hashes(repo_path: str, rev: str) -> list:
+    """Lists commit hashes in the same oldest-first order PyDriller traverses them."""
+    result = subprocess.run(['git', '-C', repo_path, 'rev-list', '--reverse', rev], capture_output=True, text=True, check=True)
+    return result.stdout.split()
+
+_worker_git = None
+
+def _init_mining_worker(repo_path: str, open_lock) -> None:
+    """Opens one PyDriller repository per worker. Opening writes to .git/config, so it is serialized."""
+    global _worker_git
+    with open_lock:
+        _worker_git = Git(repo_path)
+
+def _mine_commit_chunk(hashes: list, cols: dict, blob_store: Optional[BlobStore]) -> list:
+    """Worker entry point: mines a contiguous range of commits into (hash, rows) pairs."""
+    mined = []
+    for commit_hash in hashes:
+        commit = _worker_git.get_commit(commit_hash)
+        mined.append((commit_hash, extract_rows(commit, cols, blob_store) if is_bug_fix(commit.msg) else []))
+    return mined
+
+def _iter_commits_serial(repo_path: str, rev: str, cols: dict, blob_store: Optional[BlobStore]):
+    git_repo = Git(repo_path)
+    for commit in git_repo.get_list_commits(rev):
+        yield commit.hash, (extract_rows(commit, cols, blob_store) if is_bug_fix(commit.msg) else [])
+    git_repo.clear()
+
+def _iter_commits_parallel(repo_path: str, rev: str, cols: dict, blob_store: Optional[BlobStore], workers: int, chunk_size: int):
+    """
+    Splits the commit range into contiguous chunks and mines them in a process
+    pool. Results are yielded in history order regardless of completion order.
+    """
+    hashes = _list_commit_hashes(repo_path, rev)
+    chunks = [hashes[i:i + chunk_size] for i in range(0, len(hashes), chunk_size)]
+    logging.info(f"Mining {len(hashes)} commits in {len(chunks)} chunks across {workers} worker processes.")
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_mining_worker, initargs=(repo_path, multiprocessing.Lock()))
+    try:
+        for mined_chunk in executor.map(_mine_commit_chunk, chunks, repeat(cols), repeat(blob_store)):
+            yield from mined_chunk
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def stream_repository(limit: Optional[int] = None, chunk_rows: Optional[int] = None):
     """
     Mines the configured Git repository for bug-fixing commits, extracting
     metadata, diffs, and the full source code before and after the change.
+    Yields DataFrames of up to `chunk_rows` rows as soon as they are mined, or
+    a single DataFrame at the end when `chunk_rows` is None.
+
+    When incremental mining is enabled, previously mined rows are yielded from
+    the mining cache first and only commits newer than its checkpoint are
+    traversed. With `mining.workers` above 1, commit ranges are mined in a
+    process pool; `mining.backend: native` reads the clone through git plumbing.
     """
     repo_url = config['io']['repo_url']
     local_path = config['io']['local_repo_path']
+    mining_cfg = config['mining']
     cols = config['columns']
     logging.info(f"Starting repository mining for {repo_url}")
-    
-    BUG_KEYWORDS = [
-        "fixed", "bug", "fixes", "fix", "crash", "solves", "resolves", "issue",
-        "regression", "fail", "npe", "except", "broken", "error", "hang",
-        "leak", "overflow", "avoid", "workaround", "break", "stop"
-    ]
-    BUG_REGEX = re.compile(
-        r'.*((solv(ed|es|e|ing))|(fix(s|es|ing|ed)?)|((error|bug|issue)(s)?)).*',
-        re.IGNORECASE
-    )
-    
-    clone_dir = os.path.dirname(local_path)
-    os.makedirs(clone_dir, exist_ok=True)
-    
-    repo_miner = Repository(repo_url, clone_repo_to=clone_dir)
-    bug_data = []
-    commits_processed = 0
-    
-    for commit in tqdm(repo_miner.traverse_commits(), desc="Mining Commits"):
-        if limit and commits_processed >= limit: break
-        is_bug_fix = (any(k in commit.msg.lower() for k in BUG_KEYWORDS) or bool(BUG_REGEX.match(commit.msg)))
-        if is_bug_fix:
-            commit_had_py_file = False
-            for mod in commit.modified_files:
-                if mod.diff and mod.new_path and mod.new_path.endswith('.py'):
-                    bug_data.append({
-                        cols['hash']: commit.hash,
-                        cols['message']: commit.msg,
-                        cols['filename']: mod.new_path,
-                        cols['diff']: mod.diff,
-                        cols['source_before']: mod.source_code_before,
-                        cols['source_current']: mod.source_code
-                    })
-                    commit_had_py_file = True
-            if commit_had_py_file: commits_processed += 1
-            
-    if not bug_data:
+
+    repo_path = _prepare_local_repo(repo_url, local_path)
+    blob_store = BlobStore(config['io']['blob_store_dir']) if mining_cfg['source_storage'] == 'blob_store' else None
+    cache = MiningCache(mining_cfg['cache_dir'], {'repo_url': repo_url, 'source_storage': mining_cfg['source_storage']})
+    if not mining_cfg['incremental']:
+        cache.reset()
+    elif cache.last_commit and not _is_ancestor_of_head(repo_path, cache.last_commit):
+        logging.warning(f"Checkpoint commit {cache.last_commit} is no longer in the history. Re-mining from scratch.")
+        cache.reset()
+
+    kept_hashes = set()
+    ready_rows = _apply_limit(cache.load_rows(), limit, cols['hash'], kept_hashes)
+    commits_processed = cache.commits_processed
+    if cache.last_commit:
+        logging.info(f"Loaded {len(ready_rows)} cached files from {commits_processed} commits (checkpoint {cache.last_commit[:10]}).")
+    if chunk_rows:
+        # Chunks end on commit boundaries, like freshly mined ones, so no commit is split between chunks.
+        start = 0
+        while start < len(ready_rows):
+            end = min(start + chunk_rows, len(ready_rows))
+            while end < len(ready_rows) and ready_rows[end][cols['hash']] == ready_rows[end - 1][cols['hash']]:
+                end += 1
+            yield pd.DataFrame(ready_rows[start:end])
+            start = end
+        ready_rows = []
+
+    if not (limit and commits_processed >= limit):
+        rev = f"{cache.last_commit}..HEAD" if cache.last_commit else "HEAD"
+        if mining_cfg['backend'] == 'native':
+            mined_commits = iter_commits_native(repo_path, rev, cols, is_bug_fix, blob_store)
+        elif mining_cfg['workers'] > 1:
+            mined_commits = _iter_commits_parallel(repo_path, rev, cols, blob_store, mining_cfg['workers'], mining_cfg['chunk_size'])
+        else:
+            mined_commits = _iter_commits_serial(repo_path, rev, cols, blob_store)
+
+        pending_rows = []
+        last_seen = None
+        commits_seen = 0
+        try:
+            for commit_hash, rows in tqdm(mined_commits, desc="Mining Commits"):
+                if rows:
+                    pending_rows.extend(rows)
+                    ready_rows.extend(_apply_limit(rows, limit, cols['hash'], kept_hashes))
+                    commits_processed += 1
+                last_seen = commit_hash
+                commits_seen += 1
+                if commits_seen % mining_cfg['checkpoint_every'] == 0:
+                    cache.append(pending_rows, last_seen, commits_processed)
+                    pending_rows = []
+                if chunk_rows and len(ready_rows) >= chunk_rows:
+                    yield pd.DataFrame(ready_rows)
+                    ready_rows = []
+                if limit and commits_processed >= limit: break
+        finally:
+            mined_commits.close()
+
+        if last_seen:
+            cache.append(pending_rows, last_seen, commits_processed)
+        logging.info(f"Traversed {commits_seen} new commits since the last checkpoint.")
+
+    if ready_rows:
+        yield pd.DataFrame(ready_rows)
+
+def mine_repository(limit: Optional[int] = None) -> pd.DataFrame:
+    """Mines the configured repository into a single DataFrame. See `stream_repository`."""
+    cols = config['columns']
+    with metrics.stage("mining"):
+        chunks = list(stream_repository(limit))
+    if not chunks:
         logging.error("No bug-fixing commits found. Exiting.")
         sys.exit()
-        
-    df = pd.DataFrame(bug_data)
-    logging.info(f"Mining complete. Found {len(df)} files in {commits_processed} commits.")
-    return df
\ No newline at end of file
+
+    df = pd.concat(chunks, ignore_index=True)
+    logging.info(f"Mining complete. Found {len(df)} files in {df[cols['hash']].nunique()} commits.")
+    return df
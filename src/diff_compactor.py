@@ -0,0 +1,164 @@
+# src/diff_compactor.py
+"""
+Shrinks unified diffs to a token budget before they are sent to an LLM.
+
+Edits that only change trailing whitespace or blank lines are dropped
+(indentation and inner whitespace are kept, since they can carry meaning), unchanged context is trimmed around each
+change, and long runs of added or removed lines (generated files, vendored
+code) are collapsed to their head and tail. If the diff still does not fit,
+context is removed entirely and changed lines are kept hunk by hunk, in order,
+while every hunk header is preserved for as long as the budget allows.
+"""
+OMITTED_CONTEXT = " ..."
+
+def _split_hunks(diff: str) -> list:
+    """
+    Splits a diff into hunks, each a list of lines starting with its '@@' header.
+    The 'diff --git' line that starts each file of a multi-file diff is kept as a hunk of its own.
+    """
+    hunks = []
+    for line in diff.splitlines():
+        if line.startswith('@@') or line.startswith('diff --git ') or not hunks:
+            hunks.append([line])
+        else:
+            hunks[-1].append(line)
+    return hunks
+
+def _normalize(line: str) -> str:
+    """A changed line's text without trailing whitespace."""
+    return line[1:].rstrip()
+
+def _whitespace_only_lines(body: list) -> set:
+    """
+    Indices of the lines of whitespace-only edits: added or removed blank lines,
+    and, within each block of removed lines directly followed by added lines,
+    the removed and added line at the same position when they differ only in
+    trailing whitespace.
+    """
+    paired = {i for i, line in enumerate(body) if line[:1] in ('+', '-') and not _normalize(line)}
+    i = 0
+    while i < len(body):
+        if not body[i].startswith('-'):
+            i += 1
+            continue
+        removed_start = i
+        while i < len(body) and body[i].startswith('-'):
+            i += 1
+        added_start = i
+        while i < len(body) and body[i].startswith('+'):
+            i += 1
+        for offset in range(min(added_start - removed_start, i - added_start)):
+            old, new = removed_start + offset, added_start + offset
+            if _normalize(body[old]) == _normalize(body[new]):
+                paired.update((old, new))
+    return paired
+
+def _compact_hunk(hunk: list, context_lines: int, max_block_lines: int) -> list:
+    """Returns the hunk's header and body with low-signal lines removed."""
+    header, body = (hunk[0], hunk[1:]) if hunk[0].startswith('@@') else (None, hunk)
+
+    # A line that changes only in trailing whitespace where it stands is treated as context.
+    whitespace_only = _whitespace_only_lines(body)
+    lines = []
+    for i, line in enumerate(body):
+        if i not in whitespace_only:
+            lines.append(line)
+        elif line.startswith('+'):
+            lines.append(' ' + line[1:])
+
+    changed = [i for i, line in enumerate(lines) if line[:1] in ('+', '-')]
+    if not changed:
+        # Text outside any hunk (e.g. "Binary files differ") is kept as it is.
+        return [header, " [whitespace-only changes omitted]"] if header else body
+
+    keep = set()
+    for i in changed:
+        keep.update(range(max(i - context_lines, 0), min(i + context_lines + 1, len(lines))))
+    compacted = [header] if header else []
+    previous = -1
+    for i in sorted(keep):
+        if previous >= 0 and i > previous + 1:
+            compacted.append(OMITTED_CONTEXT)
+        # Keep "\ No newline at end of file" markers only next to the line they describe.
+        if not lines[i].startswith('\\') or i - 1 in keep:
+            compacted.append(lines[i])
+        previous = i
+    return _collapse_blocks(compacted, max_block_lines)
+
+def _collapse_blocks(lines: list, max_block_lines: int) -> list:
+    """Replaces the middle of any run of more than `max_block_lines` same-sign changed lines with a marker."""
+    collapsed, run = [], []
+
+    def flush():
+        if len(run) > max_block_lines:
+            head, tail = max_block_lines // 2, max_block_lines // 4
+            collapsed.extend(run[:head])
+            collapsed.append(f"{run[0][0]}... [{len(run) - head - tail} lines omitted]")
+            collapsed.extend(run[len(run) - tail:])
+        else:
+            collapsed.extend(run)
+        run.clear()
+
+    for line in lines:
+        if run and line[:1] != run[0][:1]:
+            flush()
+        if line[:1] in ('+', '-') and not line.startswith('@@'):
+            run.append(line)
+        else:
+            flush()
+            collapsed.append(line)
+    flush()
+    return collapsed
+
+class DiffCompactor:
+    """Compacts diffs for one tokenizer, so budgets and counts are in that model's tokens."""
+    def __init__(self, tokenizer, token_budget: int, context_lines: int = 3, max_block_lines: int = 40):
+        self.tokenizer = tokenizer
+        self.token_budget = token_budget
+        self.context_lines = context_lines
+        self.max_block_lines = max_block_lines
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.tokenizer(text, add_special_tokens=False)['input_ids'])
+
+    def compact(self, diff: str) -> tuple:
+        """Returns (compacted diff, its token count)."""
+        hunks = _split_hunks(diff)
+        for context_lines in dict.fromkeys((self.context_lines, 0)):
+            text = '\n'.join(line for hunk in hunks for line in _compact_hunk(hunk, context_lines, self.max_block_lines))
+            n_tokens = self.count_tokens(text)
+            if n_tokens <= self.token_budget:
+                return text, n_tokens
+        hunks = [_compact_hunk(hunk, 0, self.max_block_lines) for hunk in hunks]
+        # Per-line costs only approximate the joined text, so shrink the limit by any overshoot and retry.
+        limit = self.token_budget
+        for _ in range(3):
+            text = self._fit_to_budget(hunks, limit)
+            n_tokens = self.count_tokens(text)
+            if n_tokens <= self.token_budget or limit <= 0:
+                break
+            limit -= n_tokens - self.token_budget
+        return text, n_tokens
+
+    def _fit_to_budget(self, hunks: list, limit: int) -> str:
+        """Keeps changed lines hunk by hunk while reserving room for the remaining hunk headers."""
+        hunks = [hunk for hunk in hunks if hunk]
+        costs = [[n + 1 for n in map(len, self.tokenizer(hunk, add_special_tokens=False)['input_ids'])] for hunk in hunks]
+        header_costs = [cost[0] for cost in costs]
+        kept, used = [], 0
+        for i, (hunk, cost) in enumerate(zip(hunks, costs)):
+            reserve = sum(header_costs[i + 1:])
+            if reserve + used + header_costs[i] > limit:
+                reserve = 0
+            if used + header_costs[i] > limit:
+                kept.append(f"... [{len(hunks) - i} more hunks omitted]")
+                break
+            kept.append(hunk[0])
+            used += header_costs[i]
+            for j in range(1, len(hunk)):
+                if used + cost[j] + reserve > limit:
+                    kept.append(f" ... [{len(hunk) - j} lines omitted]")
+                    break
+                kept.append(hunk[j])
+                used += cost[j]
+        return '\n'.join(kept)
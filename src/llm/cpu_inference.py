@@ -0,0 +1,125 @@
+# src/llm/cpu_inference.py
+"""
+CPU inference settings shared by the T5 and Qwen handlers.
+
+On GPU-less nodes the models are loaded in float32 with low peak memory,
+optionally capped to a RAM budget with the remaining weights offloaded to disk.
+Quantizing their linear layers to int8 or int4 weights is opt-in, since it
+changes the scores; the benchmark suite compares it against float32 on the same
+prompts. Generation throughput and the process's peak RSS are tracked per run.
+"""
+import os
+import time
+import logging
+import torch
+from torch import nn
+from src.config_loader import config
+from src.metrics import metrics, peak_rss_mb
+from src.utils import select_device
+
+def cpu_inference_active() -> bool:
+    """True when the CPU inference mode applies: forced on, or 'auto' without an accelerator."""
+    mode = config['cpu_inference']['enabled']
+    if mode == 'auto':
+        return select_device().type == 'cpu'
+    return bool(mode)
+
+def configure_threads() -> None:
+    """Applies the configured intra-op thread count, if any."""
+    threads = config['cpu_inference']['threads']
+    if threads:
+        torch.set_num_threads(threads)
+
+def cache_model_id(model_name: str) -> str:
+    """Identifies the model in response cache keys; quantized weights produce different outputs."""
+    scheme = config['cpu_inference']['quantization']
+    return f"{model_name}@{scheme}" if scheme and cpu_inference_active() else model_name
+
+def load_kwargs() -> dict:
+    """Keyword arguments for `from_pretrained` in CPU mode."""
+    cpu_cfg = config['cpu_inference']
+    kwargs = {"torch_dtype": torch.float32, "low_cpu_mem_usage": True}
+    if cpu_cfg['max_memory_gb']:
+        kwargs.update({
+            "device_map": "auto",
+            "max_memory": {"cpu": f"{cpu_cfg['max_memory_gb']}GiB"},
+            "offload_folder": cpu_cfg['offload_dir']
+        })
+    return kwargs
+
+def _int4_cpu_config(int4_config_cls):
+    """An int4 weight-only config with a CPU packing; the default one targets CUDA's tinygemm kernel."""
+    try:
+        return int4_config_cls(int4_packing_format="opaque")
+    except TypeError:
+        pass
+    try:
+        from torchao.dtypes import Int4CPULayout
+        return int4_config_cls(layout=Int4CPULayout())
+    except (ImportError, TypeError):
+        raise ValueError(
+            "cpu_inference.quantization 'int4' needs a torchao version with a CPU int4 packing "
+            "(int4_packing_format='opaque' or Int4CPULayout); use 'int8' or null instead."
+        )
+
+def quantize(model: nn.Module) -> nn.Module:
+    """Quantizes the model's linear layers as configured ('int8', 'int4' or null)."""
+    scheme = config['cpu_inference']['quantization']
+    if not scheme:
+        return model
+    if 'disk' in getattr(model, 'hf_device_map', {}).values():
+        logging.warning("Skipping quantization: part of the model is offloaded to disk (raise cpu_inference.max_memory_gb).")
+        return model
+    try:
+        from torchao.quantization import quantize_, Int8DynamicActivationInt8WeightConfig, Int4WeightOnlyConfig
+    except ImportError:
+        quantize_ = None
+    if scheme == 'int4':
+        if quantize_ is None:
+            raise ImportError("cpu_inference.quantization 'int4' requires the torchao package (pip install torchao).")
+        quantize_(model, _int4_cpu_config(Int4WeightOnlyConfig))
+    elif scheme == 'int8':
+        if quantize_ is not None:
+            quantize_(model, Int8DynamicActivationInt8WeightConfig())
+        else:
+            # Without torchao, fall back to PyTorch's built-in dynamic int8 quantization.
+            model = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+    else:
+        raise ValueError(f"Unknown cpu_inference.quantization '{scheme}'; expected 'int8', 'int4' or null.")
+    logging.info(f"Quantized {type(model).__name__} linear layers to {scheme}.")
+    return model
+
+class GenerationStats:
+    """Accumulates generated tokens and generation time for one model, and forwards them to the run metrics."""
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self.tokens = 0
+        self.seconds = 0.0
+        self.drafts = {}
+
+    def add(self, n_tokens: int, started: float, prompt_tokens: int = 0, task: str = None) -> None:
+        """Records `n_tokens` generated since `started` (a time.perf_counter() value)."""
+        seconds = time.perf_counter() - started
+        self.tokens += int(n_tokens)
+        self.seconds += seconds
+        metrics.record_generation(self.model_name, task, prompt_tokens, n_tokens, seconds)
+
+    def add_draft(self, task: str, drafted: int, accepted: int) -> None:
+        """Records how many draft-model tokens were proposed and accepted in an assisted generation."""
+        totals = self.drafts.setdefault(task or "default", [0, 0])
+        totals[0] += drafted
+        totals[1] += accepted
+        metrics.increment("draft_tokens", drafted, task=task or "default")
+        metrics.increment("draft_tokens_accepted", accepted, task=task or "default")
+
+    def log(self, name: str) -> None:
+        if not self.seconds:
+            return
+        logging.info(
+            f"{name}: generated {self.tokens} tokens in {self.seconds:.1f}s "
+            f"({self.tokens / self.seconds:.1f} tokens/sec), peak RSS {peak_rss_mb():.0f} MB "
+            f"[{torch.get_num_threads()} threads, pid {os.getpid()}]."
+        )
+        for task, (drafted, accepted) in self.drafts.items():
+            if drafted:
+                logging.info(f"{name} draft model ({task}): {accepted}/{drafted} proposed tokens accepted ({accepted * 100 / drafted:.1f}%).")
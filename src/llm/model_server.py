@@ -0,0 +1,269 @@
+# src/llm/model_server.py
+"""
+A long-lived local server that keeps the analysis and baseline LLMs loaded and
+serves them over a Unix socket, so pipeline runs skip model loading.
+
+Start it once with `python -m src.llm.model_server`. While it runs, pipeline
+runs get a `RemoteQwenHandler` and `RemoteBaselineGenerator` from
+`open_qwen_handler` / `open_baseline_generator`, which forward generation to
+the server; without it (or if it serves a different model configuration) the
+models are loaded in-process as before. Requests that arrive within
+`batch_wait_ms` of each other, from any number of clients, are merged into one
+batched model call.
+
+Messages are length-prefixed JSON: a 4-byte big-endian size, then the body.
+"""
+import os
+import sys
+import json
+import time
+import queue
+import signal
+import socket
+import struct
+import hashlib
+import logging
+import threading
+from typing import Optional
+from transformers import AutoTokenizer
+from src.config_loader import config
+from src.llm import cpu_inference
+from src.llm.qwen_handler import QwenHandler
+from src.llm.t5_handler import BaselineGenerator
+
+# Inference settings the server applies on behalf of its clients; both sides must agree on them.
+SERVER_INFERENCE_KEYS = [
+    "max_output_tokens", "structured_output", "structured_max_new_tokens", "assisted_tasks", "draft_tokens", "t5_generation"
+]
+
+def server_fingerprint() -> str:
+    """Identifies the models and decoding settings in use, so clients only use a server that matches their config."""
+    settings = {
+        "models": config['models'], "cpu_inference": config['cpu_inference'],
+        "inference": {key: config['inference'][key] for key in SERVER_INFERENCE_KEYS},
+    }
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()
+
+def _send(sock: socket.socket, message) -> None:
+    body = json.dumps(message).encode('utf-8')
+    sock.sendall(struct.pack('>I', len(body)) + body)
+
+def _recv_exact(sock: socket.socket, size: int) -> Optional[bytes]:
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+def _recv(sock: socket.socket):
+    """Reads one message, or returns None when the peer has closed the connection."""
+    header = _recv_exact(sock, 4)
+    if header is None:
+        return None
+    body = _recv_exact(sock, struct.unpack('>I', header)[0])
+    return None if body is None else json.loads(body)
+
+class ModelClient:
+    """One connection to the model server. Calls are serialized, so a client can be shared between threads."""
+    def __init__(self, socket_path: str):
+        self.socket_path = socket_path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(socket_path)
+        self._lock = threading.Lock()
+
+    def call(self, op: str, items: list = None):
+        with self._lock:
+            _send(self.sock, {"op": op, "items": items})
+            reply = _recv(self.sock)
+        if reply is None:
+            raise ConnectionError(f"The model server at {self.socket_path} closed the connection.")
+        if not reply["ok"]:
+            raise RuntimeError(f"Model server error: {reply['error']}")
+        return reply["result"]
+
+    def close(self) -> None:
+        self.sock.close()
+
+def connect_model_server() -> Optional[ModelClient]:
+    """Connects to a running model server that matches this config, or returns None if it should not be used."""
+    server_cfg = config['model_server']
+    if server_cfg['mode'] == 'off':
+        return None
+    try:
+        client = ModelClient(server_cfg['socket_path'])
+        info = client.call("info")
+    except OSError:
+        if server_cfg['mode'] == 'required':
+            raise
+        logging.info(f"No model server at {server_cfg['socket_path']}; loading models in-process.")
+        return None
+    if info["fingerprint"] != server_fingerprint():
+        client.close()
+        if server_cfg['mode'] == 'required':
+            raise RuntimeError(f"The model server at {server_cfg['socket_path']} serves a different model configuration.")
+        logging.warning(f"The model server at {server_cfg['socket_path']} serves a different model configuration; loading models in-process.")
+        return None
+    return client
+
+class RemoteQwenHandler(QwenHandler):
+    """A QwenHandler whose generation runs in the model server. Only the tokenizer is loaded locally."""
+    def __init__(self, client: ModelClient):
+        self.client = client
+        self.model_name = config['models']['analysis_llm']
+        logging.info(f"Using the Analysis LLM {self.model_name} served at {client.socket_path}.")
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        self.cache_model_id = cpu_inference.cache_model_id(self.model_name)
+        self.stats = cpu_inference.GenerationStats(self.model_name)
+        # The server keeps its own response and prefix caches.
+        self.response_cache = None
+        self.prefix_cache = None
+
+    def generate_batch(self, prompts: list) -> list:
+        return self.client.call("generate", prompts)
+
+    def score_batch(self, items: list) -> list:
+        return self.client.call("score", [list(item) for item in items])
+
+    def close(self) -> None:
+        """Closes the connection to the model server; the server keeps the model and its caches."""
+        self.client.close()
+
+class RemoteBaselineGenerator(BaselineGenerator):
+    """A BaselineGenerator whose batches are generated by the model server; response caching stays local."""
+    def __init__(self, device, client: ModelClient):
+        super().__init__(device)
+        self.client = client
+        logging.info(f"Using the Baseline LLM {self.model_name} served at {client.socket_path}.")
+
+    def _load_model(self):
+        return self.client
+
+    def _generate_batch(self, diffs: list) -> list:
+        return self.client.call("baseline", diffs)
+
+    def close(self) -> None:
+        """Reports response cache usage and closes the connection to the model server."""
+        super().close()
+        self.client.close()
+
+def open_qwen_handler() -> QwenHandler:
+    """The analysis LLM handler: served by the model server when one is running, otherwise loaded in-process."""
+    client = connect_model_server()
+    return RemoteQwenHandler(client) if client is not None else QwenHandler()
+
+def open_baseline_generator(device) -> BaselineGenerator:
+    """The baseline generator: served by the model server when one is running, otherwise loaded in-process."""
+    client = connect_model_server()
+    return RemoteBaselineGenerator(device, client) if client is not None else BaselineGenerator(device)
+
+class _Request:
+    def __init__(self, op: str, items: list):
+        self.op = op
+        self.items = items
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+class ModelServer:
+    """Serves both models from one process; a single worker thread runs all model calls."""
+    def __init__(self, socket_path: str, device):
+        server_cfg = config['model_server']
+        self.socket_path = socket_path
+        self.batch_wait = server_cfg['batch_wait_ms'] / 1000
+        self.max_merged_requests = server_cfg['max_merged_requests']
+        self.qwen_handler = QwenHandler()
+        self.baseline_generator = BaselineGenerator(device)
+        self.baseline_generator.model = self.baseline_generator._load_model()
+        self.requests = queue.Queue()
+        self.served = 0
+
+    def _run(self, op: str, items: list) -> list:
+        if op == "generate":
+            return self.qwen_handler.generate_batch(items)
+        if op == "score":
+            return self.qwen_handler.score_batch([tuple(item) for item in items])
+        if op == "baseline":
+            return self.baseline_generator.generate_messages(items)
+        raise ValueError(f"Unknown operation '{op}'")
+
+    def _work(self) -> None:
+        """Takes requests off the queue, merging those that arrive close together into one call per operation."""
+        while True:
+            pending = [self.requests.get()]
+            deadline = time.monotonic() + self.batch_wait
+            while len(pending) < self.max_merged_requests:
+                try:
+                    pending.append(self.requests.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            for op in dict.fromkeys(request.op for request in pending):
+                group = [request for request in pending if request.op == op]
+                try:
+                    results = self._run(op, [item for request in group for item in request.items])
+                    start = 0
+                    for request in group:
+                        request.result = results[start:start + len(request.items)]
+                        start += len(request.items)
+                except Exception as exc:
+                    logging.exception(f"Model server failed on a merged '{op}' call.")
+                    for request in group:
+                        request.error = f"{type(exc).__name__}: {exc}"
+                for request in group:
+                    request.done.set()
+            self.served += len(pending)
+
+    def _handle(self, conn: socket.socket) -> None:
+        with conn:
+            while True:
+                message = _recv(conn)
+                if message is None:
+                    return
+                if message["op"] == "info":
+                    _send(conn, {"ok": True, "result": {"fingerprint": server_fingerprint(), "pid": os.getpid(), "served": self.served}})
+                    continue
+                request = _Request(message["op"], message["items"] or [])
+                self.requests.put(request)
+                request.done.wait()
+                if request.error is not None:
+                    _send(conn, {"ok": False, "error": request.error})
+                else:
+                    _send(conn, {"ok": True, "result": request.result})
+
+    def serve_forever(self) -> None:
+        if os.path.exists(self.socket_path):
+            try:
+                ModelClient(self.socket_path).close()
+                raise RuntimeError(f"A model server is already listening on {self.socket_path}.")
+            except ConnectionRefusedError:
+                os.remove(self.socket_path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        listener.listen()
+        threading.Thread(target=self._work, daemon=True).start()
+        logging.info(f"Model server ready on {self.socket_path} (pid {os.getpid()}).")
+        try:
+            while True:
+                conn, _ = listener.accept()
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+        finally:
+            listener.close()
+            os.remove(self.socket_path)
+            self.qwen_handler.stats.log("Analysis LLM (server)")
+            self.baseline_generator.stats.log("Baseline LLM (server)")
+
+def main() -> None:
+    from src.utils import setup_logging, select_device
+    setup_logging()
+    # Exit through the `finally` of serve_forever so the socket file is removed.
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        ModelServer(config['model_server']['socket_path'], select_device()).serve_forever()
+    except KeyboardInterrupt:
+        logging.info("Model server stopped.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+# src/llm/prefix_cache.py
+"""
+An LRU of precomputed KV caches for prompt prefixes shared by several calls.
+
+The evaluate prompts for one diff only differ after the `[CODE DIFF]` block, so
+the key/value tensors for everything up to that point can be computed once and
+copied into each generate call instead of re-encoding the diff every time.
+"""
+import copy
+import logging
+from collections import OrderedDict
+from typing import Optional
+
+def cache_nbytes(cache) -> int:
+    """Returns the memory held by the key/value tensors of a transformers Cache."""
+    if hasattr(cache, 'layers'):
+        tensors = [t for layer in cache.layers for t in (getattr(layer, 'keys', None), getattr(layer, 'values', None))]
+    else:
+        tensors = list(getattr(cache, 'key_cache', [])) + list(getattr(cache, 'value_cache', []))
+    return sum(t.numel() * t.element_size() for t in tensors if t is not None)
+
+class PrefixKVCache:
+    """Keeps the most recently used prefix caches within a memory budget."""
+    def __init__(self, max_mb: float):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[object]:
+        """Returns a private copy of the cached prefix, safe for generate() to extend."""
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return copy.deepcopy(entry[0])
+
+    def put(self, key: str, cache) -> None:
+        nbytes = cache_nbytes(cache)
+        if nbytes > self.max_bytes:
+            return
+        if key in self.entries:
+            self.total_bytes -= self.entries.pop(key)[1]
+        self.entries[key] = (cache, nbytes)
+        self.total_bytes += nbytes
+        while self.total_bytes > self.max_bytes:
+            _, (_, evicted_bytes) = self.entries.popitem(last=False)
+            self.total_bytes -= evicted_bytes
+            logging.debug(f"Evicted a prefix cache entry of {evicted_bytes / 1e6:.1f} MB.")
@@ -20,6 +20,23 @@ def format_evaluate_prompt(diff: str, message: str) -> dict:
         "user": config['prompts']['evaluate']['user'].format(diff=diff, message=message)
     }
 
+def joint_message_key(number: int) -> str:
+    """JSON key of the `number`-th (1-based) message in a joint evaluation answer."""
+    return f"message_{number}"
+
+def format_evaluate_joint_prompt(diff: str, messages: list) -> dict:
+    """Formats the prompts for scoring all candidate messages of one diff in a single answer."""
+    templates = config['prompts']['evaluate_joint']
+    numbers = range(1, len(messages) + 1)
+    answer_format = ", ".join(f'"{joint_message_key(n)}": {{"score": <integer>, "justification": "<string>"}}' for n in numbers)
+    return {
+        "system": templates['system'],
+        "user": templates['user'].format(
+            diff=diff, format=answer_format,
+            messages="\n".join(templates['message'].format(number=n, message=msg) for n, msg in zip(numbers, messages))
+        )
+    }
+
 def format_classify_prompt(old_message: str, new_message: str) -> dict:
     """Formats the system and user prompts for the classification task."""
     return {
@@ -3,11 +3,42 @@
 Contains the handler for the advanced analysis LLM (Qwen), which performs
 rectification, evaluation, and classification of commit messages.
 """
+import hashlib
+import json
 import logging
+import copy
+import time
 import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM, LogitsProcessor
+from transformers import (
+    AutoTokenizer, AutoModelForCausalLM, LogitsProcessor, LogitsProcessorList, StoppingCriteriaList, DynamicCache
+)
 from src.config_loader import config
-from src.llm import prompt_templates
+from src.llm import prompt_templates, cpu_inference
+from src.llm.prefix_cache import PrefixKVCache
+from src.llm.response_cache import open_response_cache
+from src.llm.structured_output import (
+    TASK_SCHEMAS, SCORES, JOINT_EVALUATE_MESSAGES, SchemaTracker, SchemaLogitsProcessor, SchemaStoppingCriteria, compile_schemas
+)
+from src.utils import parse_json_from_response, clear_gpu_memory
+
+# Fields each task's answer must hold before it is cached; scores must also be one of SCORES.
+TASK_ANSWER_KEYS = {
+    "rectify": ["rectified_message"],
+    "evaluate": ["score"],
+    "evaluate_joint": [f"{prompt_templates.joint_message_key(n)}.score" for n in range(1, JOINT_EVALUATE_MESSAGES + 1)],
+    "justify": ["justification"],
+    "classify": ["improvement_category"],
+}
+
+def answer_parses(task, response: str) -> bool:
+    """Whether `response` holds every field its task needs; answers of prompts without a task always pass."""
+    for key in TASK_ANSWER_KEYS.get(task, []):
+        if key.endswith("score"):
+            if str(parse_json_from_response(response, key, is_score=True)) not in SCORES:
+                return False
+        elif not parse_json_from_response(response, key):
+            return False
+    return True
 
 # This class is a safety valve to prevent crashes from numerical instability.
 class SafeLogitsProcessor(LogitsProcessor):
@@ -23,46 +54,350 @@ class QwenHandler:
     """A handler for orchestrating complex tasks with the Qwen model."""
     def __init__(self):
         model_name = config['models']['analysis_llm']
+        self.model_name = model_name
         logging.info(f"Loading Analysis LLM: {model_name}...")
         self.tokenizer = AutoTokenizer.from_pretrained(model_name)
-        self.model = AutoModelForCausalLM.from_pretrained(
-            model_name, torch_dtype="auto", device_map="auto"
-        )
+        self.model = self._load_model(model_name)
+        self.cache_model_id = cpu_inference.cache_model_id(model_name)
+        self.stats = cpu_inference.GenerationStats(model_name)
         if self.tokenizer.pad_token is None:
             self.tokenizer.pad_token = self.tokenizer.eos_token
+        # Decoder-only models must be left-padded so every prompt ends right before its first new token.
+        self.tokenizer.padding_side = "left"
+        self.batch_size = config['inference']['qwen_batch_size']
+        self.batch_tokens = config['inference']['qwen_batch_tokens']
+        self.generation_params = {
+            "max_new_tokens": config['inference']['max_output_tokens'],
+            "do_sample": True, "temperature": 0.7, "top_p": 0.8
+        }
+        self.structured_output = config['inference']['structured_output']
+        self.structured_max_new_tokens = config['inference']['structured_max_new_tokens']
+        self.schemas = compile_schemas(self.tokenizer) if self.structured_output else {}
+        self.score_token_ids = self._score_token_ids()
+        self.response_cache = open_response_cache()
+        prefix_cache_mb = config['inference']['prefix_cache_mb']
+        self.prefix_cache = PrefixKVCache(prefix_cache_mb) if prefix_cache_mb and self.tokenizer.is_fast else None
+        self.draft_model = self._load_draft_model(config['models']['draft_llm'])
+        self.assisted_tasks = set(config['inference']['assisted_tasks'] or [])
         
         # Instantiate our safety valve
         self.safe_logits_processor = SafeLogitsProcessor()
         logging.info("Analysis LLM loaded successfully with SafeLogitsProcessor.")
 
+    @staticmethod
+    def _load_model(model_name: str) -> AutoModelForCausalLM:
+        if cpu_inference.cpu_inference_active():
+            cpu_inference.configure_threads()
+            return cpu_inference.quantize(AutoModelForCausalLM.from_pretrained(model_name, **cpu_inference.load_kwargs()))
+        return AutoModelForCausalLM.from_pretrained(model_name, torch_dtype="auto", device_map="auto")
+
+    def _load_draft_model(self, draft_name):
+        """Loads the optional draft model for assisted decoding; it must share the analysis model's tokenizer."""
+        if not draft_name:
+            return None
+        if AutoTokenizer.from_pretrained(draft_name).get_vocab() != self.tokenizer.get_vocab():
+            raise ValueError(f"Draft model {draft_name} does not share the tokenizer of {self.model_name}.")
+        logging.info(f"Loading draft model for assisted decoding: {draft_name}...")
+        draft_model = self._load_model(draft_name)
+        draft_model.generation_config.num_assistant_tokens = config['inference']['draft_tokens']
+        draft_model.generation_config.num_assistant_tokens_schedule = "heuristic"
+        return draft_model
+
+    def _is_assisted(self, task) -> bool:
+        return self.draft_model is not None and task in self.assisted_tasks
+
+    def _render(self, system_prompt: str, user_prompt: str) -> str:
+        messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}]
+        return self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+
+    def _score_token_ids(self) -> list:
+        """Token ids of the digits 1-5, which logprob scoring reads the score distribution from."""
+        ids = [self.tokenizer.encode(digit, add_special_tokens=False) for digit in SCORES]
+        return [token[0] for token in ids] if all(len(token) == 1 for token in ids) else None
+
+    def _is_structured(self, task) -> bool:
+        return self.structured_output and task in TASK_SCHEMAS
+
+    def _task_params(self, task) -> dict:
+        """Decoding parameters for a task; they are also part of the response cache key."""
+        params = dict(self.generation_params)
+        if self._is_structured(task):
+            params["max_new_tokens"] = self.structured_max_new_tokens[task]
+            params["structured_schema"] = TASK_SCHEMAS[task]
+        return params
+
+    def _plan_batches(self, lengths: list, max_new_tokens: int) -> list:
+        """
+        Groups prompt positions into batches, longest first, so each batch holds
+        similarly sized prompts. A batch is closed when it reaches `qwen_batch_size`
+        rows or when rows x (longest prompt + max_new_tokens) exceeds `qwen_batch_tokens`.
+        """
+        order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+        batches, current = [], []
+        for i in order:
+            longest = lengths[current[0]] if current else lengths[i]
+            if current and (len(current) >= self.batch_size or
+                            (len(current) + 1) * (longest + max_new_tokens) > self.batch_tokens):
+                batches.append(current)
+                current = []
+            current.append(i)
+        if current: batches.append(current)
+        return batches
+
+    def _generate_ids(self, input_ids: torch.Tensor, attention_mask: torch.Tensor, task=None, past_key_values=None) -> torch.Tensor:
+        params = self._task_params(task)
+        params.pop("structured_schema", None)
+        logits_processor = LogitsProcessorList([self.safe_logits_processor])
+        stopping_criteria = StoppingCriteriaList()
+        if self._is_structured(task):
+            tracker = SchemaTracker(self.schemas[task], input_ids.shape[0], input_ids.shape[1])
+            logits_processor.append(SchemaLogitsProcessor(tracker, self.tokenizer.eos_token_id))
+            stopping_criteria.append(SchemaStoppingCriteria(tracker))
+        # Assisted generation handles one sequence at a time and starts from an empty cache.
+        assisted = self._is_assisted(task) and input_ids.shape[0] == 1 and past_key_values is None
+        if assisted:
+            params["assistant_model"] = self.draft_model
+            forward_calls = {"main": 0, "draft": 0}
+            hooks = [
+                model.register_forward_hook(lambda *_, role=role: forward_calls.__setitem__(role, forward_calls[role] + 1))
+                for role, model in (("main", self.model), ("draft", self.draft_model))
+            ]
+        started = time.perf_counter()
+        try:
+            with torch.no_grad():
+                generated_ids = self.model.generate(
+                    input_ids,
+                    attention_mask=attention_mask,
+                    past_key_values=past_key_values,
+                    **params,
+                    pad_token_id=self.tokenizer.pad_token_id,
+                    logits_processor=logits_processor,
+                    stopping_criteria=stopping_criteria
+                )
+        finally:
+            if assisted:
+                for hook in hooks: hook.remove()
+        response_ids = generated_ids[:, input_ids.shape[1]:]
+        n_tokens = (response_ids != self.tokenizer.pad_token_id).sum().item()
+        self.stats.add(n_tokens, started, attention_mask.sum().item(), task)
+        if assisted:
+            # Every verification pass of the main model contributes one token of its own; the rest were accepted drafts.
+            self.stats.add_draft(task, forward_calls["draft"], max(0, n_tokens - forward_calls["main"]))
+        return response_ids
+
+    def _finish(self, task, response_ids: torch.Tensor, answer_prefix: str = "") -> str:
+        """
+        Decodes a response. The prompt's `answer_prefix` is put back in front of it;
+        structured answers also get their seed back and are completed if they were cut off.
+        """
+        text = self.tokenizer.decode(response_ids, skip_special_tokens=True)
+        if not self._is_structured(task):
+            return (answer_prefix + text).strip()
+        schema = self.schemas[task]
+        return schema.seed + answer_prefix + text + schema.replay(response_ids.tolist()).completion()
+
+    def _split_prefix(self, text: str, shared: str) -> tuple:
+        """
+        Tokenizes a prompt and returns (token ids, number of leading tokens up to
+        the end of `shared`). The prefix is cut at a token boundary of the full
+        prompt's own tokenization, so the cached tokens are exactly the ones the
+        model would have seen.
+        """
+        encoding = self.tokenizer(text, return_offsets_mapping=True)
+        ids = encoding.input_ids
+        prefix_end = text.index(shared) + len(shared)
+        # Drop the last token that touches the boundary and always leave at least one token to prefill.
+        n_prefix = min(sum(1 for _, end in encoding.offset_mapping if end <= prefix_end) - 1, len(ids) - 1)
+        return ids, max(n_prefix, 0)
+
+    def _prefix_kv(self, prefix_ids: list):
+        """A private copy of the KV cache of `prefix_ids`, computed and stored in the prefix cache on a miss."""
+        key = hashlib.sha1(torch.tensor(prefix_ids).numpy().tobytes()).hexdigest()
+        past_key_values = self.prefix_cache.get(key)
+        if past_key_values is None:
+            with torch.no_grad():
+                prefix_cache = self.model(
+                    torch.tensor([prefix_ids], device=self.model.device), past_key_values=DynamicCache(), use_cache=True
+                ).past_key_values
+            self.prefix_cache.put(key, prefix_cache)
+            past_key_values = copy.deepcopy(prefix_cache)
+        return past_key_values
+
+    def _generate_with_prefix(self, prompt_ids: list, n_prefix: int, task=None, answer_prefixes: list = None) -> list:
+        """
+        Generates responses for prompts whose first `n_prefix` tokens are the same,
+        re-using the KV cache of those tokens expanded to the batch. Each suffix is
+        left-padded right after the prefix; generate() derives positions from the
+        attention mask, so the padding does not shift them.
+        """
+        prefix = prompt_ids[0][:n_prefix]
+        suffixes = [ids[n_prefix:] for ids in prompt_ids]
+        width = max(map(len, suffixes))
+        pad_id = self.tokenizer.pad_token_id
+        input_ids = torch.tensor([prefix + [pad_id] * (width - len(s)) + s for s in suffixes], device=self.model.device)
+        attention_mask = torch.tensor([[1] * n_prefix + [0] * (width - len(s)) + [1] * len(s) for s in suffixes], device=self.model.device)
+        past_key_values = self._prefix_kv(prefix)
+        if len(prompt_ids) > 1:
+            past_key_values.batch_repeat_interleave(len(prompt_ids))
+        response_ids = self._generate_ids(input_ids, attention_mask, task, past_key_values)
+        return [self._finish(task, ids, answer_prefix) for ids, answer_prefix in zip(response_ids, answer_prefixes or [""] * len(prompt_ids))]
+
+    def generate_batch(self, prompts: list) -> list:
+        """
+        Generates responses for a list of {'system', 'user'} prompts, returned in input order.
+        A prompt's optional 'task' selects its structured-output schema, and an optional
+        'answer_prefix' is appended after the prompt as the start of the answer. Responses
+        already in the response cache are returned without generation; only answers
+        that parse are added to it. Prompts may
+        name a 'shared' substring of their user prompt; with the prefix cache enabled,
+        prompts of a task that share the text up to that substring are batched over
+        one KV cache of it, which is also re-used across calls.
+        """
+        tasks = [p.get('task') for p in prompts]
+        answer_prefixes = [p.get('answer_prefix', "") for p in prompts]
+        texts = [
+            self._render(p['system'], p['user']) + (TASK_SCHEMAS[task]["seed"] if self._is_structured(task) else "") + prefix
+            for p, task, prefix in zip(prompts, tasks, answer_prefixes)
+        ]
+        responses = [None] * len(texts)
+        cache_keys = [None] * len(texts)
+        if self.response_cache is not None:
+            for i, text in enumerate(texts):
+                cache_keys[i] = self.response_cache.make_key(self.cache_model_id, text, self._task_params(tasks[i]))
+                responses[i] = self.response_cache.get(cache_keys[i])
+        pending = [i for i in range(len(texts)) if responses[i] is None]
+
+        if self.prefix_cache is not None:
+            # Prompts of one task with the same prefix are batched over one copy of its KV cache.
+            groups = {}
+            for i in [i for i in pending if 'shared' in prompts[i]]:
+                ids, n_prefix = self._split_prefix(texts[i], prompts[i]['shared'])
+                if n_prefix > 0:
+                    groups.setdefault((tasks[i], tuple(ids[:n_prefix])), []).append((i, ids))
+            for (task, prefix), members in groups.items():
+                max_new_tokens = self._task_params(task)["max_new_tokens"]
+                for batch in self._plan_batches([len(ids) for _, ids in members], max_new_tokens):
+                    batch = [members[j] for j in batch]
+                    batch_responses = self._generate_with_prefix([ids for _, ids in batch], len(prefix), task, [answer_prefixes[i] for i, _ in batch])
+                    for (i, _), response in zip(batch, batch_responses):
+                        responses[i] = response
+
+        # Batch the remaining prompts per task, since each task has its own decoding constraints.
+        for task in dict.fromkeys(tasks[i] for i in pending if responses[i] is None):
+            batched = [i for i in pending if responses[i] is None and tasks[i] == task]
+            lengths = [len(ids) for ids in self.tokenizer([texts[i] for i in batched])['input_ids']]
+            if self._is_assisted(task):
+                batches = [[i] for i in range(len(batched))]
+            else:
+                batches = self._plan_batches(lengths, self._task_params(task)["max_new_tokens"])
+            for batch in batches:
+                batch = [batched[i] for i in batch]
+                model_inputs = self.tokenizer([texts[i] for i in batch], return_tensors="pt", padding=True).to(self.model.device)
+                response_ids = self._generate_ids(model_inputs.input_ids, model_inputs.attention_mask, task)
+                for i, ids in zip(batch, response_ids):
+                    responses[i] = self._finish(task, ids, answer_prefixes[i])
+
+        if self.response_cache is not None:
+            # A failed answer is not cached, so the next run samples the prompt again.
+            for i in pending:
+                if answer_parses(tasks[i], responses[i]):
+                    self.response_cache.put(cache_keys[i], responses[i])
+        return responses
+
     def _generate(self, system_prompt: str, user_prompt: str) -> str:
         """Generates a single response from the LLM, now with safety checks."""
-        messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}]
-        text = self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-        model_inputs = self.tokenizer([text], return_tensors="pt").to(self.model.device)
-        
-        with torch.no_grad():
-            generated_ids = self.model.generate(
-                model_inputs.input_ids,
-                attention_mask=model_inputs.attention_mask,
-                max_new_tokens=config['inference']['max_output_tokens'],
-                do_sample=True, temperature=0.7, top_p=0.8,
-                logits_processor=[self.safe_logits_processor]
-            )
-            response_ids = generated_ids[0][len(model_inputs.input_ids[0]):]
-        return self.tokenizer.decode(response_ids, skip_special_tokens=True).strip()
+        return self.generate_batch([{"system": system_prompt, "user": user_prompt}])[0]
+
+    def rectify_batch(self, diffs: list) -> list:
+        """Generates rectified commit messages for many diffs at once."""
+        return self.generate_batch([{**prompt_templates.format_rectify_prompt(diff), 'task': 'rectify'} for diff in diffs])
+
+    def evaluate_batch(self, items: list) -> list:
+        """Scores many (diff, message) pairs at once. Prompts for the same diff share a cacheable prefix."""
+        return self.generate_batch([
+            {**prompt_templates.format_evaluate_prompt(diff, msg), 'task': 'evaluate', 'shared': diff} for diff, msg in items
+        ])
+
+    def score_batch(self, items: list) -> list:
+        """
+        Scores many (diff, message) pairs from the logprobs of the score digit: one
+        forward pass over the evaluate prompt followed by '{"score": ', instead of
+        sampling an answer. Returns a {'score', 'expected', 'probs'} dict per item,
+        where 'score' is the most likely digit and 'expected' the probability-weighted mean.
+        """
+        if self.score_token_ids is None:
+            raise ValueError(f"Logprob scoring needs the digits 1-5 to be single tokens, which they are not for {self.model_name}.")
+        texts = [
+            self._render(prompt["system"], prompt["user"]) + TASK_SCHEMAS["evaluate"]["seed"]
+            for prompt in (prompt_templates.format_evaluate_prompt(diff, msg) for diff, msg in items)
+        ]
+        probs = [None] * len(texts)
+        cache_keys = [None] * len(texts)
+        if self.response_cache is not None:
+            for i, text in enumerate(texts):
+                cache_keys[i] = self.response_cache.make_key(self.cache_model_id, text, {"scoring": "logprob", "tokens": SCORES})
+                cached = self.response_cache.get(cache_keys[i])
+                probs[i] = json.loads(cached) if cached is not None else None
+        pending = [i for i in range(len(texts)) if probs[i] is None]
+
+        lengths = [len(ids) for ids in self.tokenizer([texts[i] for i in pending])['input_ids']]
+        for batch in self._plan_batches(lengths, 1):
+            batch = [pending[i] for i in batch]
+            model_inputs = self.tokenizer([texts[i] for i in batch], return_tensors="pt", padding=True).to(self.model.device)
+            # Left padding shifts positions unless they are derived from the attention mask, as generate() does.
+            position_ids = (model_inputs.attention_mask.cumsum(-1) - 1).clamp(min=0)
+            started = time.perf_counter()
+            with torch.no_grad():
+                logits = self.model(**model_inputs, position_ids=position_ids, logits_to_keep=1).logits[:, -1, :]
+            self.stats.add(0, started, model_inputs.attention_mask.sum().item(), "score")
+            digit_probs = torch.softmax(logits[:, self.score_token_ids].float(), dim=-1).tolist()
+            for i, row_probs in zip(batch, digit_probs):
+                probs[i] = row_probs
+                if self.response_cache is not None:
+                    self.response_cache.put(cache_keys[i], json.dumps(row_probs))
+
+        return [
+            {"score": max(range(len(p)), key=p.__getitem__) + 1, "expected": sum(k * q for k, q in enumerate(p, start=1)), "probs": p}
+            for p in probs
+        ]
+
+    def justify_batch(self, items: list) -> list:
+        """Generates a justification for each already chosen score of (diff, message, score) items."""
+        return self.generate_batch([
+            {**prompt_templates.format_evaluate_prompt(diff, msg), 'task': 'justify', 'shared': diff,
+             'answer_prefix': f'{{"score": {score}, "justification": "'}
+            for diff, msg, score in items
+        ])
+
+    def evaluate_joint_batch(self, items: list) -> list:
+        """Scores all candidate messages of each (diff, [messages]) item in one answer per item."""
+        return self.generate_batch([
+            {**prompt_templates.format_evaluate_joint_prompt(diff, messages), 'task': 'evaluate_joint'} for diff, messages in items
+        ])
+
+    def classify_batch(self, items: list) -> list:
+        """Classifies many (old_message, new_message) pairs at once."""
+        return self.generate_batch([
+            {**prompt_templates.format_classify_prompt(old, new), 'task': 'classify'} for old, new in items
+        ])
 
     def rectify_message(self, diff: str) -> str:
         """Generates a rectified commit message for a given diff."""
-        prompts = prompt_templates.format_rectify_prompt(diff)
-        return self._generate(prompts['system'], prompts['user'])
+        return self.rectify_batch([diff])[0]
 
     def evaluate_message(self, diff: str, message: str) -> str:
         """Generates a quality score and justification for a given message and diff."""
-        prompts = prompt_templates.format_evaluate_prompt(diff, message)
-        return self._generate(prompts['system'], prompts['user'])
+        return self.evaluate_batch([(diff, message)])[0]
 
     def classify_improvement(self, old_message: str, new_message: str) -> str:
         """Classifies the improvement between an old and new message."""
-        prompts = prompt_templates.format_classify_prompt(old_message, new_message)
-        return self._generate(prompts['system'], prompts['user'])
\ No newline at end of file
+        return self.classify_batch([(old_message, new_message)])[0]
+
+    def close(self) -> None:
+        """Releases the models and reports throughput and response cache usage."""
+        self.stats.log("Analysis LLM")
+        if self.response_cache is not None:
+            self.response_cache.log_stats("Analysis LLM")
+        self.model = None
+        self.draft_model = None
+        clear_gpu_memory()
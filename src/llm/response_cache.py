@@ -0,0 +1,92 @@
+# src/llm/response_cache.py
+"""
+A persistent cache of LLM responses keyed by model, rendered prompt and
+decoding parameters.
+
+Any change to a prompt template changes the rendered prompt and therefore the
+key, so editing one task's prompt only invalidates that task's entries. The
+cache is bounded by size and evicts the least recently used responses first.
+
+Entries never expire. Answers are sampled (temperature 0.7), so the first
+answer cached for a prompt is frozen and returned on every rerun; delete the
+cache file, or disable it, to sample again. Answers that fail to parse are not
+cached.
+"""
+import json
+import time
+import logging
+import hashlib
+import sqlite3
+from typing import Optional
+from src.config_loader import config
+
+class ResponseCache:
+    """An SQLite-backed LRU of generated responses."""
+    def __init__(self, path: str, max_mb: float):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses "
+            "(key TEXT PRIMARY KEY, response TEXT NOT NULL, nbytes INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self.conn.commit()
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM responses").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model_name: str, prompt: str, params: dict) -> str:
+        payload = json.dumps([model_name, prompt, params], sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        row = self.conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        with self.conn:
+            self.conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+        return row[0]
+
+    def put(self, key: str, response: str) -> None:
+        nbytes = len(key) + len(response.encode('utf-8'))
+        with self.conn:
+            previous = self.conn.execute("SELECT nbytes FROM responses WHERE key = ?", (key,)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, nbytes, last_used) VALUES (?, ?, ?, ?)",
+                (key, response, nbytes, time.time())
+            )
+        self.total_bytes += nbytes - (previous[0] if previous else 0)
+        if self.total_bytes > self.max_bytes:
+            self._evict()
+
+    def _evict(self) -> None:
+        """Deletes least recently used entries until the cache is back under 90% of its budget."""
+        # Other handlers may share the file, so re-read the true size before evicting.
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM responses").fetchone()[0]
+        target = int(self.max_bytes * 0.9)
+        freed = 0
+        victims = []
+        for key, nbytes in self.conn.execute("SELECT key, nbytes FROM responses ORDER BY last_used"):
+            if self.total_bytes - freed <= target: break
+            victims.append((key,))
+            freed += nbytes
+        with self.conn:
+            self.conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+        self.total_bytes -= freed
+        logging.info(f"Response cache evicted {len(victims)} entries ({freed / 1e6:.1f} MB).")
+
+    def log_stats(self, name: str) -> None:
+        total = self.hits + self.misses
+        if total:
+            logging.info(f"{name} response cache: {self.hits} hits, {self.misses} misses ({self.hits * 100 / total:.1f}% hit rate).")
+
+def open_response_cache() -> Optional[ResponseCache]:
+    """Opens the configured response cache, or returns None when caching is disabled."""
+    cache_cfg = config['response_cache']
+    if not cache_cfg['enabled']:
+        return None
+    return ResponseCache(cache_cfg['path'], cache_cfg['max_mb'])
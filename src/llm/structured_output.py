@@ -0,0 +1,198 @@
+# src/llm/structured_output.py
+"""
+Schema-constrained JSON decoding for the analysis LLM tasks.
+
+Each task's answer follows a fixed JSON layout, described here as a sequence of
+segments: literal text (braces, keys and separators), a choice from a closed set
+of values (scores, improvement categories), or a free-form string. The opening
+of the object is appended to the prompt, literals are forced token by token,
+choices are restricted to their valid tokens, and string values cannot contain
+quotes, backslashes, control characters or special tokens. Generation stops as
+soon as the object closes; an object cut off by the token limit is completed
+before parsing, so the parser always receives valid JSON.
+"""
+from typing import Optional
+import torch
+from transformers import LogitsProcessor, StoppingCriteria
+
+IMPROVEMENT_CATEGORIES = ["Cosmetic", "Semantic", "Corrective", "Trivial", "Regressive"]
+SCORES = ["1", "2", "3", "4", "5"]
+# Joint evaluation scores the developer, baseline and rectified messages of a row together.
+JOINT_EVALUATE_MESSAGES = 3
+
+def _joint_evaluate_schema(n_messages: int) -> dict:
+    segments = []
+    for number in range(1, n_messages + 1):
+        if number > 1:
+            segments.append(("literal", f'"}}, "message_{number}": {{"score": '))
+        segments += [("choice", SCORES), ("literal", ', "justification": "'), ("string",)]
+    return {"seed": '{"message_1": {"score": ', "segments": segments + [("literal", '"}}')]}
+
+TASK_SCHEMAS = {
+    "rectify": {
+        "seed": '{"rectified_message": "',
+        "segments": [("string",), ("literal", '"}')]
+    },
+    "evaluate": {
+        "seed": '{"score": ',
+        "segments": [("choice", SCORES), ("literal", ', "justification": "'), ("string",), ("literal", '"}')]
+    },
+    "evaluate_joint": _joint_evaluate_schema(JOINT_EVALUATE_MESSAGES),
+    # Justification for a score chosen from the logprobs; the prompt already ends with '{"score": N, "justification": "'.
+    "justify": {
+        "seed": "",
+        "segments": [("string",), ("literal", '"}')]
+    },
+    "classify": {
+        "seed": '{"improvement_category": "',
+        "segments": [("choice", IMPROVEMENT_CATEGORIES), ("literal", '", "reason": "'), ("string",), ("literal", '"}')]
+    },
+}
+
+class CompiledSchema:
+    """A task schema with every literal and choice converted to token ids for one tokenizer."""
+    def __init__(self, tokenizer, schema: dict, string_banned: torch.Tensor):
+        self.tokenizer = tokenizer
+        self.seed = schema["seed"]
+        self.string_banned = string_banned
+        self.segments = []
+        for segment in schema["segments"]:
+            if segment[0] == "string":
+                self.segments.append(("string", None))
+            elif segment[0] == "literal":
+                self.segments.append(("literal", tokenizer.encode(segment[1], add_special_tokens=False)))
+            else:
+                self.segments.append(("choice", [tokenizer.encode(option, add_special_tokens=False) for option in segment[1]]))
+
+    def new_state(self) -> 'SchemaState':
+        return SchemaState(self)
+
+    def replay(self, token_ids: list) -> 'SchemaState':
+        """Rebuilds the decoding state reached after `token_ids` were generated."""
+        state = self.new_state()
+        for token_id in token_ids:
+            state.advance(token_id)
+        return state
+
+class SchemaState:
+    """Tracks one sequence's position within a compiled schema."""
+    def __init__(self, schema: CompiledSchema):
+        self.schema = schema
+        self.segment = -1
+        self._next_segment(0)
+
+    @property
+    def done(self) -> bool:
+        return self.segment >= len(self.schema.segments)
+
+    def _next_segment(self, start_pos: int) -> None:
+        self.segment += 1
+        self.pos = start_pos
+        if not self.done and self.schema.segments[self.segment][0] == "choice":
+            self.candidates = list(self.schema.segments[self.segment][1])
+        if not self.done and self.schema.segments[self.segment][0] == "literal" and self.pos >= len(self.schema.segments[self.segment][1]):
+            self._next_segment(0)
+
+    def _closing_token(self) -> Optional[int]:
+        """The first token of the literal that ends the current string segment."""
+        following = self.schema.segments[self.segment + 1] if self.segment + 1 < len(self.schema.segments) else None
+        return following[1][0] if following and following[0] == "literal" else None
+
+    def advance(self, token_id: int) -> None:
+        if self.done:
+            return
+        kind, value = self.schema.segments[self.segment]
+        if kind == "literal":
+            self.pos += 1
+            if self.pos >= len(value): self._next_segment(0)
+        elif kind == "choice":
+            self.candidates = [c for c in self.candidates if len(c) > self.pos and c[self.pos] == token_id]
+            self.pos += 1
+            if not self.candidates or any(len(c) == self.pos for c in self.candidates): self._next_segment(0)
+        elif token_id == self._closing_token():
+            self._next_segment(1)
+
+    def mask(self, scores: torch.Tensor, eos_token_id: int) -> torch.Tensor:
+        """Returns `scores` with every token that would break the schema set to -inf."""
+        if self.done:
+            allowed = torch.full_like(scores, float('-inf'))
+            allowed[eos_token_id] = 0
+            return scores + allowed
+        kind, value = self.schema.segments[self.segment]
+        if kind == "string":
+            banned = self.schema.string_banned.to(scores.device)
+            masked = scores.masked_fill(banned[:scores.shape[-1]], float('-inf'))
+            closing = self._closing_token()
+            if closing is not None:
+                masked[closing] = scores[closing]
+            return masked
+        allowed_ids = [value[self.pos]] if kind == "literal" else sorted({c[self.pos] for c in self.candidates})
+        masked = torch.full_like(scores, float('-inf'))
+        masked[allowed_ids] = scores[allowed_ids]
+        return masked
+
+    def completion(self) -> str:
+        """Text that closes the object if generation stopped before the schema was complete."""
+        parts = []
+        for index in range(max(self.segment, 0), len(self.schema.segments)):
+            kind, value = self.schema.segments[index]
+            start = self.pos if index == self.segment else 0
+            if kind == "literal":
+                parts.append(self.schema.tokenizer.decode(value[start:]))
+            elif kind == "choice":
+                options = self.candidates if index == self.segment else value
+                parts.append(self.schema.tokenizer.decode(options[0][start:]))
+        return "".join(parts)
+
+def compile_schemas(tokenizer) -> dict:
+    """Compiles all task schemas for `tokenizer`. Decodes the vocabulary once to find unsafe string tokens."""
+    vocab_size = len(tokenizer)
+    token_texts = tokenizer.batch_decode([[i] for i in range(vocab_size)])
+    # Sized generously, since model heads are often padded beyond the tokenizer's vocabulary.
+    string_banned = torch.ones(vocab_size + 4096, dtype=torch.bool)
+    special_ids = set(tokenizer.all_special_ids) | set(getattr(tokenizer, 'added_tokens_decoder', {}).keys())
+    for token_id, text in enumerate(token_texts):
+        # Quotes and backslashes would need escaping and raw control characters are invalid in JSON strings.
+        string_banned[token_id] = token_id in special_ids or not text or any(c in '"\\' or c < ' ' for c in text)
+    return {task: CompiledSchema(tokenizer, schema, string_banned) for task, schema in TASK_SCHEMAS.items()}
+
+class SchemaTracker:
+    """
+    Keeps each sequence's schema state in step with the tokens generated after the
+    prompt. States follow whatever `input_ids` they are shown, so they stay correct
+    when assisted decoding scores draft tokens and rolls back rejected ones.
+    """
+    def __init__(self, schema: CompiledSchema, batch_size: int, prompt_length: int):
+        self.schema = schema
+        self.prompt_length = prompt_length
+        self.states = [schema.new_state() for _ in range(batch_size)]
+        self.consumed = [[] for _ in range(batch_size)]
+
+    def sync(self, input_ids: torch.LongTensor) -> list:
+        for row, tokens in enumerate(input_ids[:, self.prompt_length:].tolist()):
+            seen = self.consumed[row]
+            if tokens[:len(seen)] != seen:
+                self.states[row] = self.schema.replay(tokens)
+            else:
+                for token_id in tokens[len(seen):]:
+                    self.states[row].advance(token_id)
+            self.consumed[row] = tokens
+        return self.states
+
+class SchemaLogitsProcessor(LogitsProcessor):
+    """Applies each sequence's schema mask to the next-token scores."""
+    def __init__(self, tracker: SchemaTracker, eos_token_id: int):
+        self.tracker = tracker
+        self.eos_token_id = eos_token_id
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        states = self.tracker.sync(input_ids)
+        return torch.stack([state.mask(row, self.eos_token_id) for state, row in zip(states, scores)])
+
+class SchemaStoppingCriteria(StoppingCriteria):
+    """Stops sequences whose object has closed."""
+    def __init__(self, tracker: SchemaTracker):
+        self.tracker = tracker
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        return torch.tensor([state.done for state in self.tracker.sync(input_ids)], device=input_ids.device)
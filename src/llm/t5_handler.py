@@ -1,38 +1,149 @@
 # src/llm/t5_handler.py
 """Handles baseline commit message generation using the T5 model."""
 import logging
+import time
 import torch
 import pandas as pd
 from tqdm.auto import tqdm
 from transformers import AutoTokenizer, T5ForConditionalGeneration
 from src.config_loader import config
+from src.diff_compactor import DiffCompactor
+from src.llm import cpu_inference
+from src.llm.response_cache import open_response_cache
+from src.metrics import metrics
 from src.utils import clear_gpu_memory
 
-def generate_baseline_messages(df: pd.DataFrame, device: torch.device) -> pd.DataFrame:
-    """Generates baseline commit messages for rows that do not have them."""
-    model_name = config['models']['baseline_llm']
-    batch_size = config['inference']['t5_batch_size']
-    logging.info(f"Running baseline message generation with {model_name}...")
-    
-    rows_needing_baseline = df[df["Baseline_Message"].isnull()]
-    if rows_needing_baseline.empty:
-        logging.info("All baseline messages are already generated.")
-        return df
+class BaselineGenerator:
+    """Fills in missing baseline messages. The model is only loaded once a row misses the response cache."""
+    def __init__(self, device: torch.device):
+        inference_cfg = config['inference']
+        self.model_name = config['models']['baseline_llm']
+        self.device = device
+        self.batch_size = inference_cfg['t5_batch_size']
+        self.batch_tokens = inference_cfg['t5_batch_tokens']
+        self.generation_params = dict(inference_cfg['t5_generation'])
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        # Compact each diff to what fits the T5 encoder, rather than truncating it mid-hunk.
+        self.compactor = DiffCompactor(
+            self.tokenizer, self.generation_params["max_input_length"] - 1,
+            inference_cfg['diff_context_lines'], inference_cfg['diff_max_block_lines']
+        )
+        self.response_cache = open_response_cache()
+        self.stats = cpu_inference.GenerationStats(self.model_name)
+        self.model = None
+
+    def _plan_batches(self, lengths: dict) -> list:
+        """
+        Groups row indices into batches, longest diff first, so each batch pads to a
+        similar length. A batch is closed at `t5_batch_size` rows or when
+        rows x (longest input + max_length) x num_beams would exceed `t5_batch_tokens`.
+        """
+        per_row_extra = self.generation_params["max_length"]
+        beams = self.generation_params["num_beams"]
+        batches, current = [], []
+        for idx in sorted(lengths, key=lengths.get, reverse=True):
+            longest = lengths[current[0]] if current else lengths[idx]
+            if current and (len(current) >= self.batch_size or
+                            (len(current) + 1) * (longest + per_row_extra) * beams > self.batch_tokens):
+                batches.append(current)
+                current = []
+            current.append(idx)
+        if current: batches.append(current)
+        return batches
+
+    def fill(self, df: pd.DataFrame, show_progress: bool = True, on_batch=None) -> pd.Index:
+        """
+        Generates baseline messages for the rows of `df` that lack one. Returns the updated index.
+        Each batch's messages are written to `df` as soon as it finishes, and `on_batch`
+        (if given) is called with the batch's row indices so callers can checkpoint them.
+        """
+        rows_needing_baseline = df[df["Baseline_Message"].isnull()]
+        if rows_needing_baseline.empty:
+            return rows_needing_baseline.index
+        updated = rows_needing_baseline.index
+        compacted = {idx: self.compactor.compact(diff) for idx, diff in rows_needing_baseline["Diff"].items()}
+
+        # Serve what we can from the response cache before loading the model.
+        cache_keys = {}
+        if self.response_cache is not None:
+            cache_keys = {
+                idx: self.response_cache.make_key(cpu_inference.cache_model_id(self.model_name), diff, self.generation_params)
+                for idx, (diff, _) in compacted.items()
+            }
+            cached = {idx: self.response_cache.get(key) for idx, key in cache_keys.items()}
+            cached = {idx: msg for idx, msg in cached.items() if msg is not None}
+            if cached:
+                df.loc[list(cached.keys()), "Baseline_Message"] = list(cached.values())
+                if on_batch is not None:
+                    on_batch(list(cached.keys()))
+                rows_needing_baseline = rows_needing_baseline.drop(index=list(cached.keys()))
+            if rows_needing_baseline.empty:
+                return updated
+
+        if self.model is None:
+            self.model = self._load_model()
 
-    tokenizer = AutoTokenizer.from_pretrained(model_name)
-    model = T5ForConditionalGeneration.from_pretrained(model_name).to(device)
-    
-    diffs_to_process = rows_needing_baseline["Diff"].tolist()
-    all_messages = []
+        batches = self._plan_batches({idx: compacted[idx][1] for idx in rows_needing_baseline.index})
+        with tqdm(total=len(rows_needing_baseline), desc="Generating Baseline Messages", disable=not show_progress) as progress:
+            for batch in batches:
+                messages = self._generate_batch([compacted[idx][0] for idx in batch])
+                df.loc[batch, "Baseline_Message"] = messages
+                if self.response_cache is not None:
+                    for idx, msg in zip(batch, messages):
+                        self.response_cache.put(cache_keys[idx], msg)
+                if on_batch is not None:
+                    on_batch(batch)
+                progress.update(len(batch))
+        return updated
 
-    for i in tqdm(range(0, len(diffs_to_process), batch_size), desc="Generating Baseline Messages"):
-        batch_diffs = diffs_to_process[i:i + batch_size]
-        inputs = tokenizer(batch_diffs, return_tensors="pt", max_length=512, truncation=True, padding=True).to(device)
-        outputs = model.generate(**inputs, max_length=128, num_beams=4, early_stopping=True)
-        all_messages.extend(tokenizer.batch_decode(outputs, skip_special_tokens=True))
+    def _generate_batch(self, diffs: list) -> list:
+        """Generates messages for one planned batch of compacted diffs."""
+        generate_kwargs = {k: v for k, v in self.generation_params.items() if k != "max_input_length"}
+        inputs = self.tokenizer(
+            diffs, return_tensors="pt", max_length=self.generation_params["max_input_length"], truncation=True, padding=True
+        ).to(self.device)
+        started = time.perf_counter()
+        with torch.no_grad():
+            outputs = self.model.generate(**inputs, **generate_kwargs)
+        self.stats.add((outputs != self.tokenizer.pad_token_id).sum().item(), started, inputs.attention_mask.sum().item(), "baseline")
+        return self.tokenizer.batch_decode(outputs, skip_special_tokens=True)
+
+    def generate_messages(self, diffs: list) -> list:
+        """Generates messages for already compacted diffs in length-planned batches, returned in input order."""
+        if self.model is None:
+            self.model = self._load_model()
+        lengths = dict(enumerate(len(ids) for ids in self.tokenizer(diffs, truncation=True, max_length=self.generation_params["max_input_length"])['input_ids']))
+        messages = [None] * len(diffs)
+        for batch in self._plan_batches(lengths):
+            for i, msg in zip(batch, self._generate_batch([diffs[i] for i in batch])):
+                messages[i] = msg
+        return messages
+
+    def _load_model(self) -> T5ForConditionalGeneration:
+        if self.device.type == 'cpu' and cpu_inference.cpu_inference_active():
+            cpu_inference.configure_threads()
+            return cpu_inference.quantize(T5ForConditionalGeneration.from_pretrained(self.model_name, **cpu_inference.load_kwargs()))
+        return T5ForConditionalGeneration.from_pretrained(self.model_name).to(self.device)
+
+    def close(self) -> None:
+        """Releases the model and reports throughput and response cache usage."""
+        self.stats.log("Baseline LLM")
+        if self.response_cache is not None:
+            self.response_cache.log_stats("Baseline LLM")
+        self.model = None
+        clear_gpu_memory()
+
+def generate_baseline_messages(df: pd.DataFrame, device: torch.device, on_batch=None) -> pd.DataFrame:
+    """Generates baseline commit messages for rows that do not have them. See `BaselineGenerator.fill` for `on_batch`."""
+    logging.info(f"Running baseline message generation with {config['models']['baseline_llm']}...")
+    if not df["Baseline_Message"].isnull().any():
+        logging.info("All baseline messages are already generated.")
+        return df
 
-    df.loc[rows_needing_baseline.index, "Baseline_Message"] = all_messages
+    from src.llm.model_server import open_baseline_generator
+    with metrics.stage("baseline"):
+        generator = open_baseline_generator(device)
+        generator.fill(df, on_batch=on_batch)
+        generator.close()
     logging.info("Baseline message generation complete.")
-    del model, tokenizer
-    clear_gpu_memory()
-    return df
\ No newline at end of file
+    return df
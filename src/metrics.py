@@ -0,0 +1,209 @@
+# src/metrics.py
+"""
+Run instrumentation: per-stage wall time and memory, per-model/task token
+counts and throughput, and event counters such as parse failures.
+
+Everything is collected in the process-wide `metrics` object and written at
+the end of a run as a JSON report and as a Prometheus text-format file that
+node_exporter's textfile collector (or any scraper) can pick up.
+"""
+import os
+import sys
+import json
+import time
+import resource
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+def current_rss_mb() -> float:
+    """Current resident set size of this process in MB (falls back to the peak where /proc is unavailable)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1e6
+    except (OSError, ValueError):
+        return peak_rss_mb()
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere.
+    return peak / 1e6 if sys.platform == 'darwin' else peak / 1e3
+
+# How often the RSS of running stages is sampled.
+RSS_SAMPLE_SECONDS = 0.2
+
+def _cuda_torch():
+    """The torch module when it is already imported and CUDA is available, else None."""
+    torch = sys.modules.get('torch')
+    return torch if torch is not None and torch.cuda.is_available() else None
+
+def peak_vram_mb() -> float:
+    """Peak CUDA memory allocated in MB since the last peak reset (see `RunMetrics.stage`), or 0 without CUDA."""
+    torch = _cuda_torch()
+    return torch.cuda.max_memory_allocated() / 1e6 if torch is not None else 0.0
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    escaped = {k: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for k, v in labels.items()}
+    return "{" + ",".join(f'{k}="{v}"' for k, v in sorted(escaped.items())) + "}"
+
+class RunMetrics:
+    """
+    Thread-safe collector for one pipeline run.
+
+    Stage memory is measured while the stage runs: the highest RSS sampled
+    between its start and end and how far that is above the RSS at its start,
+    and the CUDA allocation peak after resetting the peak counter at its start.
+    The process-lifetime peaks are reported separately.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.stages = {}
+        self.generation = {}
+        self.counters = {}
+        # Highest RSS sampled so far for each running stage call.
+        self._running = {}
+        self._sampler = None
+        # CUDA peaks are reset per stage, so the process peak is kept here.
+        self._vram_peak_mb = 0.0
+
+    def _sample_rss(self) -> None:
+        while True:
+            time.sleep(RSS_SAMPLE_SECONDS)
+            with self._lock:
+                if not self._running:
+                    continue
+            rss = current_rss_mb()
+            with self._lock:
+                for call in self._running:
+                    self._running[call] = max(self._running[call], rss)
+
+    @contextmanager
+    def stage(self, name: str):
+        """Times a block of work and records the memory it used while it ran."""
+        call = object()
+        rss_start = current_rss_mb()
+        torch = _cuda_torch()
+        vram_start = 0.0
+        if torch is not None:
+            # Stages overlapping on other threads (streaming mode) share this counter.
+            torch.cuda.reset_peak_memory_stats()
+            vram_start = torch.cuda.memory_allocated() / 1e6
+        with self._lock:
+            self._running[call] = rss_start
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample_rss, daemon=True)
+                self._sampler.start()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            rss_end = current_rss_mb()
+            with self._lock:
+                rss_peak = max(self._running.pop(call), rss_end)
+            vram_peak = peak_vram_mb()
+            with self._lock:
+                self._vram_peak_mb = max(self._vram_peak_mb, vram_peak)
+            self.record_stage(name, seconds, rss_peak, rss_peak - rss_start, vram_peak, vram_peak - vram_start)
+
+    def timed_iter(self, name: str, iterable):
+        """Yields from `iterable`, recording the time spent producing each item (not consuming it) as stage `name`."""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def record_stage(self, name: str, seconds: float, rss_peak_mb: float = 0.0, rss_growth_mb: float = 0.0,
+                     vram_peak_mb: float = 0.0, vram_growth_mb: float = 0.0) -> None:
+        """Adds one call of a stage; memory fields keep the largest value over its calls."""
+        with self._lock:
+            entry = self.stages.setdefault(name, {
+                "calls": 0, "seconds": 0.0, "rss_peak_mb": 0.0, "rss_growth_mb": 0.0, "vram_peak_mb": 0.0, "vram_growth_mb": 0.0
+            })
+            entry["calls"] += 1
+            entry["seconds"] += seconds
+            for key, value in (("rss_peak_mb", rss_peak_mb), ("rss_growth_mb", rss_growth_mb),
+                               ("vram_peak_mb", vram_peak_mb), ("vram_growth_mb", vram_growth_mb)):
+                entry[key] = max(entry[key], value)
+
+    def record_generation(self, model: str, task: str, prompt_tokens: int, completion_tokens: int, seconds: float) -> None:
+        with self._lock:
+            entry = self.generation.setdefault((model, task or "default"), {
+                "calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "seconds": 0.0
+            })
+            entry["calls"] += 1
+            entry["prompt_tokens"] += int(prompt_tokens)
+            entry["completion_tokens"] += int(completion_tokens)
+            entry["seconds"] += seconds
+
+    def increment(self, name: str, value: int = 1, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def snapshot(self) -> dict:
+        """Returns all metrics as a JSON-serializable dict."""
+        with self._lock:
+            generation = []
+            for (model, task), entry in sorted(self.generation.items()):
+                tokens_per_s = entry["completion_tokens"] / entry["seconds"] if entry["seconds"] else None
+                generation.append({"model": model, "task": task, **entry, "tokens_per_s": tokens_per_s})
+            return {
+                "started": datetime.fromtimestamp(self.started, timezone.utc).isoformat(timespec='seconds'),
+                "wall_seconds": time.time() - self.started,
+                # Process-lifetime high-water marks; per-stage memory is in "stages".
+                "peak_rss_mb": peak_rss_mb(),
+                "peak_vram_mb": max(self._vram_peak_mb, peak_vram_mb()),
+                "stages": {name: dict(entry) for name, entry in self.stages.items()},
+                "generation": generation,
+                "counters": [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in sorted(self.counters.items())],
+            }
+
+    def to_prometheus(self, snapshot: dict) -> str:
+        """Renders a snapshot in the Prometheus text exposition format."""
+        lines = []
+
+        def family(name, kind, help_text, samples):
+            lines.extend([f"# HELP lab2_{name} {help_text}", f"# TYPE lab2_{name} {kind}"])
+            lines.extend(f"lab2_{name}{_labels(labels)} {value}" for labels, value in samples)
+
+        family("run_wall_seconds", "gauge", "Wall time of the run so far.", [({}, snapshot["wall_seconds"])])
+        family("peak_rss_bytes", "gauge", "Peak resident set size over the whole process lifetime.", [({}, snapshot["peak_rss_mb"] * 1e6)])
+        family("peak_vram_bytes", "gauge", "Peak CUDA memory allocated by the process.", [({}, snapshot["peak_vram_mb"] * 1e6)])
+        stages = snapshot["stages"].items()
+        family("stage_seconds_total", "counter", "Wall time spent in each stage.", [({"stage": n}, e["seconds"]) for n, e in stages])
+        family("stage_calls_total", "counter", "Times each stage ran.", [({"stage": n}, e["calls"]) for n, e in stages])
+        family("stage_rss_peak_bytes", "gauge", "Highest resident set size sampled while each stage ran.", [({"stage": n}, e["rss_peak_mb"] * 1e6) for n, e in stages])
+        family("stage_rss_growth_bytes", "gauge", "Largest resident set size increase within one call of each stage.", [({"stage": n}, e["rss_growth_mb"] * 1e6) for n, e in stages])
+        family("stage_vram_peak_bytes", "gauge", "Peak CUDA memory allocated while each stage ran.", [({"stage": n}, e["vram_peak_mb"] * 1e6) for n, e in stages])
+        generation = [({"model": g["model"], "task": g["task"]}, g) for g in snapshot["generation"]]
+        family("prompt_tokens_total", "counter", "Prompt tokens fed to each model and task.", [(l, g["prompt_tokens"]) for l, g in generation])
+        family("completion_tokens_total", "counter", "Tokens generated by each model and task.", [(l, g["completion_tokens"]) for l, g in generation])
+        family("generation_seconds_total", "counter", "Time spent generating.", [(l, g["seconds"]) for l, g in generation])
+        family("tokens_per_second", "gauge", "Generated tokens per second.", [(l, g["tokens_per_s"]) for l, g in generation if g["tokens_per_s"]])
+        for name in sorted({c["name"] for c in snapshot["counters"]}):
+            family(f"{name}_total", "counter", f"Count of {name.replace('_', ' ')}.",
+                   [(c["labels"], c["value"]) for c in snapshot["counters"] if c["name"] == name])
+        return "\n".join(lines) + "\n"
+
+    def write_reports(self, report_path: str, prometheus_path: str) -> dict:
+        """Writes the JSON report and the Prometheus file, each replaced atomically. Returns the snapshot."""
+        snapshot = self.snapshot()
+        for path, content in ((report_path, json.dumps(snapshot, indent=2)), (prometheus_path, self.to_prometheus(snapshot))):
+            if not path:
+                continue
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        return snapshot
+
+metrics = RunMetrics()
@@ -0,0 +1,81 @@
+# src/mining_cache.py
+"""
+Persists mined rows and a checkpoint of the last traversed commit on disk.
+
+Rows are stored as an append-only JSON Lines file. The checkpoint records the
+byte offset of the last complete flush, so a crash between writing rows and
+updating the checkpoint can never leave duplicated or half-written rows behind.
+"""
+import os
+import json
+import logging
+from typing import Optional
+
+class MiningCache:
+    """A persistent, append-only cache of mined repository rows."""
+    def __init__(self, cache_dir: str, settings: dict):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.rows_path = os.path.join(cache_dir, 'mined_rows.jsonl')
+        self.checkpoint_path = os.path.join(cache_dir, 'checkpoint.json')
+        self.settings = settings
+        self.checkpoint = self._load_checkpoint()
+
+    def _empty_checkpoint(self) -> dict:
+        return {'settings': self.settings, 'last_commit': None, 'commits_processed': 0, 'rows_offset': 0}
+
+    def _load_checkpoint(self) -> dict:
+        if not os.path.exists(self.checkpoint_path):
+            return self._empty_checkpoint()
+        try:
+            with open(self.checkpoint_path, 'r') as f:
+                checkpoint = json.load(f)
+        except (json.JSONDecodeError, OSError):
+            logging.warning("Mining checkpoint is unreadable. Starting from an empty cache.")
+            return self._empty_checkpoint()
+        if checkpoint.get('settings') != self.settings:
+            logging.warning("Mining cache was built for a different repository or row format. Starting from an empty cache.")
+            return self._empty_checkpoint()
+        return checkpoint
+
+    @property
+    def last_commit(self) -> Optional[str]:
+        return self.checkpoint['last_commit']
+
+    @property
+    def commits_processed(self) -> int:
+        return self.checkpoint['commits_processed']
+
+    def load_rows(self) -> list:
+        """Reads all rows covered by the checkpoint, ignoring any uncommitted tail."""
+        if not os.path.exists(self.rows_path):
+            return []
+        with open(self.rows_path, 'rb') as f:
+            data = f.read(self.checkpoint['rows_offset'])
+        return [json.loads(line) for line in data.splitlines() if line]
+
+    def append(self, rows: list, last_commit: str, commits_processed: int) -> None:
+        """Durably appends rows, then advances the checkpoint to `last_commit`."""
+        with open(self.rows_path, 'ab') as f:
+            f.truncate(self.checkpoint['rows_offset'])
+            for row in rows:
+                f.write((json.dumps(row) + '\n').encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+            rows_offset = f.tell()
+
+        self.checkpoint.update({
+            'last_commit': last_commit,
+            'commits_processed': commits_processed,
+            'rows_offset': rows_offset
+        })
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.checkpoint, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def reset(self) -> None:
+        """Discards all cached rows and the checkpoint."""
+        for path in (self.rows_path, self.checkpoint_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.checkpoint = self._empty_checkpoint()
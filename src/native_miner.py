@@ -0,0 +1,220 @@
+# src/native_miner.py
+"""
+A mining backend that talks to a local Git clone directly instead of through
+PyDriller commit objects.
+
+Commit messages for the whole range are read from a single `git log` stream and
+filtered with the precompiled bug-fix matcher. Diffs are then produced only for
+the matching commits by one long-lived `git diff-tree --stdin` process, and the
+before/after file contents are read from one long-lived `git cat-file --batch`
+process. Output rows are identical to the PyDriller backend's.
+"""
+import re
+import subprocess
+import threading
+from typing import Iterator, Optional, Tuple
+
+GIT_BASE_CMD = ['git', '-c', 'core.quotepath=off', '-c', 'diff.noprefix=false', '-c', 'diff.mnemonicPrefix=false']
+NULL_BLOB_ID = '0' * 40
+COMMIT_LINE = re.compile(rb'^[0-9a-f]{40}$')
+INDEX_LINE = re.compile(rb'^index ([0-9a-f]+)\.\.([0-9a-f]+)')
+HEADER_PREFIXES = (
+    b'old mode ', b'new mode ', b'deleted file mode ', b'new file mode ', b'similarity index ',
+    b'dissimilarity index ', b'rename from ', b'rename to ', b'copy from ', b'copy to ', b'index '
+)
+
+def _unquote_path(raw: bytes) -> str:
+    """Decodes a path as printed by git, including C-style quoted paths."""
+    if raw.startswith(b'"') and raw.endswith(b'"'):
+        raw = raw[1:-1].decode('unicode_escape').encode('latin-1')
+    return raw.decode('utf-8', 'replace')
+
+def _strip_side_prefix(raw: bytes) -> Optional[str]:
+    """Turns `a/path`, `b/path` or `/dev/null` from a patch header into a path."""
+    raw = raw.rstrip(b'\t')
+    if raw == b'/dev/null':
+        return None
+    quoted = raw.startswith(b'"')
+    body = raw[1:-1] if quoted else raw
+    if body[:2] in (b'a/', b'b/'):
+        body = body[2:]
+    return _unquote_path(b'"' + body + b'"' if quoted else body)
+
+class CatFileBatch:
+    """A long-lived `git cat-file --batch` process for reading blob contents."""
+    def __init__(self, repo_path: str):
+        self.proc = subprocess.Popen(
+            GIT_BASE_CMD + ['-C', repo_path, 'cat-file', '--batch'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE
+        )
+
+    def read(self, object_id: str) -> Optional[bytes]:
+        """Returns the raw bytes of an object, or None if it does not exist."""
+        self.proc.stdin.write(object_id.encode() + b'\n')
+        self.proc.stdin.flush()
+        header = self.proc.stdout.readline().split()
+        if len(header) < 3 or header[1] == b'missing':
+            return None
+        data = self.proc.stdout.read(int(header[2]))
+        self.proc.stdout.read(1)
+        return data
+
+    def close(self) -> None:
+        self.proc.stdin.close()
+        self.proc.wait()
+
+def _decode_source(blob_id: Optional[str], cat_file: CatFileBatch) -> Optional[str]:
+    """Mirrors PyDriller's `source_code`: missing and empty blobs both become None."""
+    if not blob_id or blob_id == NULL_BLOB_ID:
+        return None
+    content = cat_file.read(blob_id)
+    return content.decode('utf-8', 'ignore') if content else None
+
+def _load_source(blob_id: Optional[str], cat_file: CatFileBatch, blob_store, known_keys: dict) -> Optional[str]:
+    """Returns the file body, or its blob-store key; each git blob is read at most once per run."""
+    if blob_store is None:
+        return _decode_source(blob_id, cat_file)
+    if blob_id not in known_keys:
+        known_keys[blob_id] = blob_store.put(_decode_source(blob_id, cat_file))
+    return known_keys[blob_id]
+
+def iter_commit_messages(repo_path: str, rev: str) -> Iterator[Tuple[str, list, str]]:
+    """Streams (hash, parents, stripped message) for every commit of `rev`, oldest first."""
+    proc = subprocess.Popen(
+        GIT_BASE_CMD + ['-C', repo_path, '-c', 'log.showSignature=false', 'log', '--reverse', '-z',
+                        '--no-color', '--format=%H%x1f%P%x1f%B', rev],
+        stdout=subprocess.PIPE
+    )
+    try:
+        buffer = b''
+        for chunk in iter(lambda: proc.stdout.read(1 << 16), b''):
+            buffer += chunk
+            *records, buffer = buffer.split(b'\0')
+            for record in records:
+                commit_hash, parents, message = record.split(b'\x1f', 2)
+                yield commit_hash.decode(), parents.decode().split(), message.decode('utf-8', 'replace').strip()
+        if buffer.strip():
+            commit_hash, parents, message = buffer.split(b'\x1f', 2)
+            yield commit_hash.decode(), parents.decode().split(), message.decode('utf-8', 'replace').strip()
+    finally:
+        proc.stdout.close()
+        proc.kill()
+        proc.wait()
+
+def _path_from_git_line(rest: bytes) -> Optional[str]:
+    """Extracts the `b/` side of a `diff --git a/... b/...` line."""
+    separator = b' "b/' if rest.endswith(b'"') else b' b/'
+    position = rest.rfind(separator)
+    return _strip_side_prefix(rest[position + 1:]) if position >= 0 else None
+
+def _iter_file_patches(lines: list) -> Iterator[dict]:
+    """Splits one commit's patch output into per-file headers and diff bodies."""
+    current = None
+    in_header = False
+    for line in lines:
+        if line.startswith(b'diff --git '):
+            if current: yield current
+            current = {
+                'fallback_path': _path_from_git_line(line[len(b'diff --git '):].rstrip(b'\n')),
+                'new_path': None, 'has_plus_line': False, 'a_blob': None, 'b_blob': None, 'deleted': False, 'body': []
+            }
+            in_header = True
+            continue
+        if current is None:
+            continue
+        if in_header:
+            stripped = line.rstrip(b'\n')
+            if stripped.startswith(HEADER_PREFIXES):
+                index_match = INDEX_LINE.match(stripped)
+                if index_match:
+                    current['a_blob'], current['b_blob'] = index_match.group(1).decode(), index_match.group(2).decode()
+                elif stripped.startswith(b'rename to ') or stripped.startswith(b'copy to '):
+                    current['fallback_path'] = _unquote_path(stripped.split(b' to ', 1)[1])
+                elif stripped.startswith(b'deleted file mode '):
+                    current['deleted'] = True
+                continue
+            if stripped.startswith(b'--- '):
+                continue
+            if stripped.startswith(b'+++ '):
+                current['new_path'] = _strip_side_prefix(stripped[4:])
+                current['has_plus_line'] = True
+                in_header = False
+                continue
+            in_header = False
+        current['body'].append(line)
+    if current: yield current
+
+class DiffTreeStream:
+    """
+    A long-lived `git diff-tree --stdin` process. Commit hashes are fed from a
+    background thread and the patches are read back in the same order.
+    """
+    def __init__(self, repo_path: str, commit_hashes: list):
+        self.proc = subprocess.Popen(
+            GIT_BASE_CMD + ['-C', repo_path, 'diff-tree', '--stdin', '--always', '--root', '-r', '-M', '-p',
+                            '--abbrev=40', '--full-index', '--no-ext-diff', '--no-color'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE
+        )
+        self.writer = threading.Thread(target=self._feed, args=(commit_hashes,), daemon=True)
+        self.writer.start()
+        self.next_hash = None
+
+    def _feed(self, commit_hashes: list) -> None:
+        try:
+            for commit_hash in commit_hashes:
+                self.proc.stdin.write(commit_hash.encode() + b'\n')
+            self.proc.stdin.close()
+        except (BrokenPipeError, ValueError):
+            pass
+
+    def patches_for(self, commit_hash: str) -> list:
+        """Reads the per-file patches of `commit_hash`, which must be the next commit fed."""
+        if self.next_hash is None:
+            self.next_hash = self.proc.stdout.readline().rstrip(b'\n').decode() or None
+        if self.next_hash != commit_hash:
+            return []
+        self.next_hash, lines = None, []
+        for line in iter(self.proc.stdout.readline, b''):
+            if COMMIT_LINE.match(line.rstrip(b'\n')):
+                self.next_hash = line.rstrip(b'\n').decode()
+                break
+            lines.append(line)
+        return list(_iter_file_patches(lines))
+
+    def close(self) -> None:
+        self.proc.stdout.close()
+        self.proc.kill()
+        self.proc.wait()
+
+def iter_commits_native(repo_path: str, rev: str, cols: dict, is_bug_fix, blob_store=None) -> Iterator[Tuple[str, list]]:
+    """
+    Yields (hash, rows) for every commit of `rev` in PyDriller's traversal order.
+    Only bug-fix commits with exactly one parent (or none, for the root commit)
+    are diffed, matching PyDriller's treatment of merge commits.
+    """
+    commits = list(iter_commit_messages(repo_path, rev))
+    to_diff = [h for h, parents, msg in commits if len(parents) <= 1 and is_bug_fix(msg)]
+    diff_stream = DiffTreeStream(repo_path, to_diff)
+    cat_file = CatFileBatch(repo_path)
+    to_diff = set(to_diff)
+    known_keys = {}
+    try:
+        for commit_hash, _, message in commits:
+            rows = []
+            if commit_hash in to_diff:
+                for patch in diff_stream.patches_for(commit_hash):
+                    new_path = None if patch['deleted'] else (patch['new_path'] if patch['has_plus_line'] else patch['fallback_path'])
+                    diff = b''.join(patch['body']).decode('utf-8', 'ignore')
+                    if diff and new_path and new_path.endswith('.py'):
+                        rows.append({
+                            cols['hash']: commit_hash,
+                            cols['message']: message,
+                            cols['filename']: new_path,
+                            cols['diff']: diff,
+                            cols['source_before']: _load_source(patch['a_blob'], cat_file, blob_store, known_keys),
+                            cols['source_current']: _load_source(patch['b_blob'], cat_file, blob_store, known_keys)
+                        })
+            yield commit_hash, rows
+    finally:
+        diff_stream.close()
+        cat_file.close()
@@ -1,49 +1,288 @@
 # src/pipeline.py
-"""The main pipeline orchestrator class."""
+"""
+The main pipeline orchestrator class.
+
+The model libraries are imported inside the stages that load a model, so
+running only the mining stage does not import torch or transformers.
+"""
+import os
 import logging
-import pandas as pd
+import queue
+import threading
+from functools import cached_property
 from tqdm.auto import tqdm
 from src.config_loader import config
-from src.data_miner import mine_repository
+from src.data_miner import mine_repository, stream_repository
 from src.data_handler import DataHandler
-from src.llm.t5_handler import generate_baseline_messages
-from src.llm.qwen_handler import QwenHandler
-from src.row_processor import RowProcessor
-from src.utils import select_device, clear_gpu_memory
+from src.metrics import metrics
+from src.utils import select_device, release_memory_if_needed
+from src.work_planner import plan_work
+
+STAGES = ("mine", "baseline", "analyze")
+
+_END_OF_STREAM = object()
+# How often a stage blocked on a queue checks whether the run is stopping.
+_POLL_SECONDS = 0.5
+
+class _Stopped(Exception):
+    """Raised in a stage when another stage failed and the run is stopping."""
+
+def _put(outbox: queue.Queue, item, stopped) -> None:
+    """Puts `item` on a bounded queue, giving up with `_Stopped` once `stopped()` is true."""
+    while True:
+        if stopped():
+            raise _Stopped()
+        try:
+            outbox.put(item, timeout=_POLL_SECONDS)
+            return
+        except queue.Full:
+            pass
+
+def _drain(inbox: queue.Queue, stop: threading.Event = None):
+    """
+    Yields items from `inbox` until the end-of-stream marker arrives or, when
+    `stop` is given, until it is set.
+    """
+    while True:
+        if stop is not None and stop.is_set():
+            return
+        try:
+            item = inbox.get(timeout=_POLL_SECONDS)
+        except queue.Empty:
+            continue
+        if item is _END_OF_STREAM:
+            return
+        yield item
+
+def _start_stage(work, outbox, errors: list, stop: threading.Event) -> threading.Thread:
+    """
+    Runs `work` on a daemon thread. An exception is recorded and sets `stop`, so
+    the other stages stop instead of blocking on a queue nobody drains; the end
+    of its output is always signalled unless the run is stopping.
+    """
+    def target():
+        try:
+            work()
+        except _Stopped:
+            pass
+        except BaseException as exc:
+            errors.append(exc)
+            stop.set()
+        finally:
+            if outbox is not None:
+                try:
+                    _put(outbox, _END_OF_STREAM, stop.is_set)
+                except _Stopped:
+                    pass
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    return thread
+
+def plan_analysis(rows):
+    """Groups rows into units of work (see `src.work_planner`) and logs how much work that saves."""
+    plan = plan_work(rows, config['inference']['analysis_unit'])
+    if len(plan) < plan.rows:
+        metrics.increment("deduplicated_rows", plan.rows - len(plan))
+        logging.info(f"Planned {plan.rows} rows as {len(plan)} unit(s) of work.")
+    return plan
+
+def write_run_reports(suffix: str = "") -> None:
+    """Writes the run's metrics as JSON and Prometheus text files; `suffix` keeps per-process reports apart."""
+    metrics_cfg = config['metrics']
+    paths = [
+        "{0}{2}{1}".format(*os.path.splitext(base), suffix) if base else base
+        for base in (metrics_cfg['report_path'], metrics_cfg['prometheus_path'])
+    ]
+    snapshot = metrics.write_reports(*paths)
+    logging.info(f"Run metrics written to {', '.join(p for p in paths if p)} (peak RSS {snapshot['peak_rss_mb']:.0f} MB).")
 
 class AnalysisPipeline:
     """Orchestrates the full ETL and analysis pipeline."""
     def __init__(self):
         self.config = config
-        self.device = select_device()
 
-    def run(self) -> None:
-        """Executes all stages of the pipeline."""
-        logging.info(f"Selected device: {self.device}")
-        
+    @cached_property
+    def device(self):
+        device = select_device()
+        logging.info(f"Selected device: {device}")
+        return device
+
+    def run(self, stages: tuple = STAGES) -> None:
+        """
+        Executes the given stages of the pipeline (all of them by default), then
+        writes the run's metrics reports. Mining always runs, since the later
+        stages work on the mined rows; it reads the mining cache when it is current.
+        """
+        try:
+            if self.config['pipeline']['mode'] == 'streaming' and tuple(stages) == STAGES:
+                self._run_streaming()
+            else:
+                self._run_phased(stages)
+        finally:
+            write_run_reports()
+
+    def _run_phased(self, stages: tuple = STAGES) -> None:
+        """Runs each stage over all rows before starting the next."""
         # 1. Extract
         mined_df = mine_repository(self.config['io']['processing_limit'])
+        if "baseline" not in stages and "analyze" not in stages:
+            logging.info(f"Mined {len(mined_df)} rows.")
+            return
         
         # 2. Initialize Data Handler
         data_handler = DataHandler(mined_df)
+        # With the compact schema the handler keeps its own converted copy.
+        del mined_df
         
         # 3. Baseline Message Generation
+        if "baseline" in stages:
+            self._generate_baselines(data_handler)
+
+        # 4. Advanced Analysis
+        if "analyze" in stages:
+            self._analyze(data_handler, require_baselines="baseline" not in stages)
+        data_handler.finalize()
+
+    def _generate_baselines(self, data_handler: DataHandler) -> None:
+        from src.llm.t5_handler import generate_baseline_messages
         df = data_handler.get_dataframe()
-        df = generate_baseline_messages(df, self.device)
+        unsaved = []
+
+        def checkpoint_baselines(indices):
+            unsaved.extend(indices)
+            if len(unsaved) >= self.config['inference']['t5_checkpoint_rows']:
+                data_handler.mark_updated(unsaved)
+                data_handler.save_progress()
+                unsaved.clear()
+
+        df = generate_baseline_messages(df, self.device, on_batch=checkpoint_baselines)
+        data_handler.mark_updated(unsaved)
         data_handler.save_progress()
 
-        # 4. Advanced Analysis
-        qwen_handler = QwenHandler()
+    def _analyze(self, data_handler: DataHandler, require_baselines: bool = False) -> None:
+        """Runs the analysis LLM over unanalyzed rows; with `require_baselines`, rows without a baseline message are left for later."""
+        from src.llm.model_server import open_qwen_handler
+        from src.row_processor import RowProcessor
+        with metrics.stage("load_analysis_model"):
+            qwen_handler = open_qwen_handler()
+        try:
+            row_processor = RowProcessor(qwen_handler)
+
+            rows_to_process = data_handler.get_rows_to_process(column_to_check="Rectifier_Score")
+            if require_baselines:
+                missing = rows_to_process["Baseline_Message"].isnull()
+                if missing.any():
+                    logging.warning(f"Skipping {int(missing.sum())} rows without a baseline message; run the baseline stage first.")
+                    rows_to_process = rows_to_process[~missing]
+
+            if not rows_to_process.empty:
+                logging.info(f"Found {len(rows_to_process)} rows requiring advanced analysis.")
+                plan = plan_analysis(rows_to_process)
+                rows_per_batch = self.config['inference']['analysis_batch_rows']
+                with tqdm(total=len(rows_to_process), desc="Advanced Analysis") as progress:
+                    for start in range(0, len(plan.units), rows_per_batch):
+                        batch = plan.units.iloc[start:start + rows_per_batch]
+                        with metrics.stage("analysis"):
+                            results = row_processor.process_units(plan, batch)
+                        for idx, processed_data in results.items():
+                            data_handler.update_row(idx, processed_data)
+                        data_handler.save_progress()
+                        release_memory_if_needed()
+                        progress.update(len(results))
+            else:
+                logging.info("All rows have already been analyzed.")
+        finally:
+            # Release the model (and any model-server connection) even when a batch fails.
+            qwen_handler.close()
+
+    def _run_streaming(self) -> None:
+        """
+        Executes the stages concurrently. Mined rows flow in chunks through bounded
+        queues to a baseline thread, the analysis loop on this thread, and a
+        persistence thread, so analysis starts on the first chunk while later
+        commits are still being mined. Both models stay loaded for the whole run.
+        """
+        from src.llm.model_server import open_qwen_handler, open_baseline_generator
+        from src.row_processor import RowProcessor
+        pipeline_cfg = self.config['pipeline']
+        data_handler = DataHandler()
+        handler_lock = threading.Lock()
+        baseline_generator = open_baseline_generator(self.device)
+        with metrics.stage("load_analysis_model"):
+            qwen_handler = open_qwen_handler()
         row_processor = RowProcessor(qwen_handler)
-        
-        rows_to_process = data_handler.get_rows_to_process(column_to_check="Rectifier_Score")
-        
-        if not rows_to_process.empty:
-            logging.info(f"Found {len(rows_to_process)} rows requiring advanced analysis.")
-            for idx, row in tqdm(rows_to_process.iterrows(), total=len(rows_to_process), desc="Advanced Analysis"):
-                processed_data = row_processor.process(row)
-                data_handler.update_row(idx, processed_data)
-                data_handler.save_progress()
-                clear_gpu_memory()
-        else:
-            logging.info("All rows have already been analyzed.")
\ No newline at end of file
+        to_baseline, to_analysis, to_persist = (queue.Queue(maxsize=pipeline_cfg['queue_size']) for _ in range(3))
+        errors = []
+        stop = threading.Event()
+
+        def mine():
+            chunks = stream_repository(self.config['io']['processing_limit'], pipeline_cfg['stream_chunk_rows'])
+            for chunk in metrics.timed_iter("mining", chunks):
+                with handler_lock:
+                    rows = data_handler.add_rows(chunk)
+                _put(to_baseline, rows, stop.is_set)
+
+        def generate_baselines():
+            for rows in _drain(to_baseline, stop):
+                with metrics.stage("baseline"):
+                    updated = baseline_generator.fill(rows, show_progress=False)
+                if len(updated):
+                    with handler_lock:
+                        for idx in updated:
+                            data_handler.update_row(idx, {"Baseline_Message": rows.at[idx, "Baseline_Message"]})
+                        data_handler.save_progress()
+                pending = rows[rows["Rectifier_Score"].isnull()]
+                if not pending.empty:
+                    # Planning and tokenizing diffs here keeps that work off the generation thread.
+                    plan = plan_analysis(pending)
+                    _put(to_analysis, (plan, row_processor.compact_diffs(plan.units)), stop.is_set)
+
+        def persist():
+            for results in _drain(to_persist):
+                with handler_lock:
+                    for idx, processed_data in results.items():
+                        data_handler.update_row(idx, processed_data)
+                    data_handler.save_progress()
+
+        stages = [
+            _start_stage(mine, to_baseline, errors, stop),
+            _start_stage(generate_baselines, to_analysis, errors, stop),
+        ]
+        persister = _start_stage(persist, None, errors, stop)
+
+        rows_per_batch = self.config['inference']['analysis_batch_rows']
+        # The persister saves everything it is given until the end marker, so finished results are kept while stopping.
+        persister_gone = lambda: not persister.is_alive()
+        try:
+            with tqdm(desc="Advanced Analysis", unit="row") as progress:
+                for plan, compacted in _drain(to_analysis, stop):
+                    for start in range(0, len(plan.units), rows_per_batch):
+                        batch = plan.units.iloc[start:start + rows_per_batch]
+                        with metrics.stage("analysis"):
+                            results = row_processor.process_units(plan, batch, compacted[start:start + rows_per_batch])
+                        _put(to_persist, results, persister_gone)
+                        progress.update(len(results))
+                    release_memory_if_needed()
+        except _Stopped:
+            pass
+        except BaseException:
+            stop.set()
+            raise
+        finally:
+            try:
+                _put(to_persist, _END_OF_STREAM, persister_gone)
+            except _Stopped:
+                pass
+            persister.join()
+            for stage in stages:
+                stage.join()
+            # Release the models (and any model-server connections) whether or not a stage failed.
+            baseline_generator.close()
+            qwen_handler.close()
+        if errors:
+            raise errors[0]
+
+        if data_handler.df is None:
+            logging.error("No bug-fixing commits found.")
+            return
+        data_handler.finalize()
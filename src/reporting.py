@@ -1,11 +1,17 @@
 # src/reporting.py
-"""Module for generating the final text-based report from the results CSV."""
+"""Module for generating the final text-based report from the results summary."""
 import logging
+from typing import Union
 import pandas as pd
+from src.summary_index import summarize_dataframe
 
-def generate_text_report(df: pd.DataFrame) -> None:
-    """Analyzes the final DataFrame and prints a summary report to the console."""
+def generate_text_report(results: Union[dict, pd.DataFrame]) -> None:
+    """
+    Prints a summary report to the console. `results` is a summary from
+    `src.summary_index` (see `load_summary`), or a results DataFrame to summarize.
+    """
     logging.info("Generating final text-based report...")
+    summary = summarize_dataframe(results) if isinstance(results, pd.DataFrame) else results
     
     score_cols = {
         "Developer (RQ1)": "Developer_Score",
@@ -16,26 +22,25 @@ def generate_text_report(df: pd.DataFrame) -> None:
     report_lines = ["\n", "="*50, " DETAILED SCORE ANALYSIS", "="*50]
 
     for name, col in score_cols.items():
-        numeric_scores = pd.to_numeric(df[col], errors='coerce')
-        valid_scores = numeric_scores.dropna().astype(int)
-        valid_scores = valid_scores[valid_scores > 0]
+        histogram = {int(score): count for score, count in summary["scores"].get(col, {}).items()}
+        valid_scores = pd.Series({score: count for score, count in histogram.items() if score > 0}, dtype='int64', name='count')
         
         if not valid_scores.empty:
-            avg_score = valid_scores.mean()
-            hit_rate = len(valid_scores) * 100 / len(df)
+            avg_score = (valid_scores.index * valid_scores).sum() / valid_scores.sum()
+            hit_rate = valid_scores.sum() * 100 / summary["rows"]
             
             report_lines.append(f"\n--- {name} ---")
             report_lines.append(f"Average Score: {avg_score:.2f} / 5")
             report_lines.append(f"Hit Rate (valid scores > 0): {hit_rate:.1f}%")
             report_lines.append("Score Distribution:")
-            report_lines.append(valid_scores.value_counts().sort_index().to_string())
+            report_lines.append(valid_scores.sort_index().rename_axis(col).to_string())
         else:
             report_lines.append(f"\n--- {name} ---\nNo valid scores found.")
 
     report_lines.extend(["\n", "="*50, " RECTIFICATION IMPROVEMENT ANALYSIS", "="*50])
-    if "Improvement_Category" in df.columns and not df["Improvement_Category"].dropna().empty:
+    if summary["categories"]:
         report_lines.append("Improvement Category Distribution:")
-        report_lines.append(df["Improvement_Category"].value_counts().to_string())
+        report_lines.append(pd.Series(summary["categories"], name='count').rename_axis("Improvement_Category").to_string())
     report_lines.append("="*50 + "\n")
 
-    print("\n".join(report_lines))
\ No newline at end of file
+    print("\n".join(report_lines))
@@ -1,42 +1,184 @@
 # src/row_processor.py
 """
-Contains the logic for processing a single row of the DataFrame with the
-advanced analysis LLM.
+Contains the logic for processing rows of the DataFrame with the advanced
+analysis LLM. Rows are processed in groups so that every task stage can be
+submitted to the model as one batch. Within a batch, each distinct prompt is
+generated once and its answer shared by every row that needs it.
 """
+import copy
 import pandas as pd
 from src.config_loader import config
+from src.diff_compactor import DiffCompactor
+from src.llm.prompt_templates import joint_message_key
 from src.llm.qwen_handler import QwenHandler
+from src.llm.structured_output import SCORES
+from src.metrics import metrics
 from src.utils import parse_json_from_response
 
+EVAL_TARGETS = {
+    "Developer": ("Developer_Score", "Developer_Justification", "Message"),
+    "Baseline_LLM": ("Baseline_LLM_Score", "Baseline_LLM_Justification", "Baseline_Message"),
+    "Rectifier": ("Rectifier_Score", "Rectifier_Justification", "Rectified_Message")
+}
+EXPECTED_SCORE_COLS = {
+    "Developer_Score": "Developer_Score_Expected",
+    "Baseline_LLM_Score": "Baseline_LLM_Score_Expected",
+    "Rectifier_Score": "Rectifier_Score_Expected"
+}
+
 class RowProcessor:
     def __init__(self, qwen_handler: QwenHandler):
         self.handler = qwen_handler
-        self.max_input_chars = config['inference']['max_input_chars']
+        inference_cfg = config['inference']
+        # A private tokenizer copy lets diffs be compacted on another thread while the handler's tokenizer is in use.
+        self.compactor = DiffCompactor(
+            copy.deepcopy(qwen_handler.tokenizer), inference_cfg['diff_token_budget'],
+            inference_cfg['diff_context_lines'], inference_cfg['diff_max_block_lines']
+        )
+        self.evaluation_mode = inference_cfg['evaluation_mode']
+        if self.evaluation_mode not in ("per_message", "joint"):
+            raise ValueError(f"Unknown inference.evaluation_mode '{self.evaluation_mode}'; expected 'per_message' or 'joint'.")
+        self.scoring = inference_cfg['scoring']
+        if self.scoring not in ("generate", "logprob"):
+            raise ValueError(f"Unknown inference.scoring '{self.scoring}'; expected 'generate' or 'logprob'.")
+        self.logprob_justifications = inference_cfg['logprob_justifications']
+        if self.evaluation_mode == "joint" and self.scoring == "generate" and inference_cfg['analysis_unit'] == "commit":
+            # Joint prompts score a diff's three messages together, but in commit mode the baseline messages are per file.
+            raise ValueError("inference.evaluation_mode 'joint' does not support inference.analysis_unit 'commit'; use 'per_message' or logprob scoring.")
 
     def process(self, row_data: pd.Series) -> dict:
         """Performs the full rectify, evaluate, and classify sequence for a single row."""
-        diff = row_data["Diff"][:self.max_input_chars]
-        results = {}
+        return self.process_batch(pd.DataFrame([row_data]))[row_data.name]
+
+    @staticmethod
+    def _run_unique(task: str, fn, items: list) -> list:
+        """Calls `fn` on the distinct items only and returns its response for every item, in order."""
+        unique = list(dict.fromkeys(items))
+        if len(unique) < len(items):
+            metrics.increment("deduplicated_prompts", len(items) - len(unique), task=task)
+        responses = dict(zip(unique, fn(unique)))
+        return [responses[item] for item in items]
+
+    @staticmethod
+    def _parse_score(task: str, response: str, key: str) -> int:
+        """The score under `key`, or 0 (counted as a parse failure) when it is missing or not one of SCORES."""
+        score = parse_json_from_response(response, key, is_score=True)
+        if str(score) not in SCORES:
+            metrics.increment("parse_failures", task=task)
+            return 0
+        return score
+
+    def compact_diffs(self, rows: pd.DataFrame) -> list:
+        """Returns (compacted diff, token count) for each row."""
+        return [self.compactor.compact(diff) for diff in rows["Diff"]]
+
+    def process_units(self, plan, units: pd.DataFrame, compacted: list = None) -> dict:
+        """
+        Processes a batch of a `WorkPlan`'s units and returns {row index: results}
+        for every row they stand for. The plan's `row_targets` are scored for
+        each member row against the row's own diff instead of the unit's.
+        """
+        targets = [target for target in EVAL_TARGETS if target not in plan.row_targets]
+        unit_results = self.process_batch(units, compacted, targets)
+        row_results = self.evaluate_rows(plan.member_rows(units), plan.row_targets) if plan.row_targets else {}
+        return plan.fan_out(unit_results, row_results)
+
+    def process_batch(self, rows: pd.DataFrame, compacted: list = None, targets: list = None) -> dict:
+        """
+        Performs the rectify, evaluate, and classify sequence for many rows,
+        one batched model call per stage. Returns {row index: results}.
+        `compacted` may hold the rows' precomputed `compact_diffs` output, and
+        `targets` limits evaluation to some keys of EVAL_TARGETS (all by default).
+        """
+        indices = list(rows.index)
+        compacted = compacted if compacted is not None else self.compact_diffs(rows)
+        diffs = [diff for diff, _ in compacted]
+        results = {idx: {"Diff_Tokens": n_tokens} for idx, (_, n_tokens) in zip(indices, compacted)}
 
         # 1. Rectify
-        rectified_resp = self.handler.rectify_message(diff)
-        rectified_msg = parse_json_from_response(rectified_resp, 'rectified_message')
-        results["Rectified_Message"] = rectified_msg or "fix: rectification failed"
-        
+        for idx, rectified_resp in zip(indices, self._run_unique("rectify", self.handler.rectify_batch, diffs)):
+            rectified_msg = parse_json_from_response(rectified_resp, 'rectified_message')
+            if not rectified_msg:
+                metrics.increment("parse_failures", task="rectify")
+            results[idx]["Rectified_Message"] = rectified_msg or "fix: rectification failed"
+
         # 2. Evaluate
-        messages_to_eval = {
-            "Developer": ("Developer_Score", "Developer_Justification", row_data["Message"]),
-            "Baseline_LLM": ("Baseline_LLM_Score", "Baseline_LLM_Justification", row_data["Baseline_Message"]),
-            "Rectifier": ("Rectifier_Score", "Rectifier_Justification", results["Rectified_Message"])
+        targets = list(targets if targets is not None else EVAL_TARGETS)
+        candidates = {
+            idx: [results[idx]["Rectified_Message"] if target == "Rectifier" else row[EVAL_TARGETS[target][2]] for target in targets]
+            for idx, (_, row) in zip(indices, rows.iterrows())
         }
-        for name, (score_col, just_col, msg) in messages_to_eval.items():
-            eval_resp = self.handler.evaluate_message(diff, msg)
-            results[score_col] = parse_json_from_response(eval_resp, 'score', is_score=True)
-            results[just_col] = parse_json_from_response(eval_resp, 'justification')
+        if self.scoring == "logprob":
+            self._evaluate_logprob(indices, diffs, candidates, results, targets)
+        elif self.evaluation_mode == "joint":
+            self._evaluate_joint(indices, diffs, candidates, results, targets)
+        else:
+            self._evaluate_per_message(indices, diffs, candidates, results, targets)
 
         # 3. Classify
-        classify_resp = self.handler.classify_improvement(row_data["Message"], results["Rectified_Message"])
-        results["Improvement_Category"] = parse_json_from_response(classify_resp, 'improvement_category')
-        results["Improvement_Reason"] = parse_json_from_response(classify_resp, 'reason')
+        classify_items = [(row["Message"], results[idx]["Rectified_Message"]) for idx, row in rows.iterrows()]
+        for idx, classify_resp in zip(indices, self._run_unique("classify", self.handler.classify_batch, classify_items)):
+            results[idx]["Improvement_Category"] = parse_json_from_response(classify_resp, 'improvement_category')
+            if not results[idx]["Improvement_Category"]:
+                metrics.increment("parse_failures", task="classify")
+            results[idx]["Improvement_Reason"] = parse_json_from_response(classify_resp, 'reason')
         
-        return results
\ No newline at end of file
+        return results
+
+    def evaluate_rows(self, rows: pd.DataFrame, targets: list) -> dict:
+        """
+        Scores the messages of `targets` (keys of EVAL_TARGETS, but not the
+        rectified message) against each row's own diff, one prompt per message.
+        Returns {row index: results}.
+        """
+        indices = list(rows.index)
+        diffs = [diff for diff, _ in self.compact_diffs(rows)]
+        candidates = {idx: [row[EVAL_TARGETS[target][2]] for target in targets] for idx, row in rows.iterrows()}
+        results = {idx: {} for idx in indices}
+        if self.scoring == "logprob":
+            self._evaluate_logprob(indices, diffs, candidates, results, targets)
+        else:
+            self._evaluate_per_message(indices, diffs, candidates, results, targets)
+        return results
+
+    @staticmethod
+    def _eval_jobs(indices: list, diffs: list, candidates: dict, targets: list) -> list:
+        """One (row index, score column, justification column, diff, message) job per candidate message."""
+        return [
+            (idx, EVAL_TARGETS[target][0], EVAL_TARGETS[target][1], diff, msg)
+            for idx, diff in zip(indices, diffs)
+            for target, msg in zip(targets, candidates[idx])
+        ]
+
+    def _evaluate_per_message(self, indices: list, diffs: list, candidates: dict, results: dict, targets: list) -> None:
+        """Scores each candidate message in its own prompt."""
+        eval_jobs = self._eval_jobs(indices, diffs, candidates, targets)
+        eval_resps = self._run_unique("evaluate", self.handler.evaluate_batch, [(diff, msg) for _, _, _, diff, msg in eval_jobs])
+        for (idx, score_col, just_col, _, _), eval_resp in zip(eval_jobs, eval_resps):
+            results[idx][score_col] = self._parse_score("evaluate", eval_resp, 'score')
+            results[idx][just_col] = parse_json_from_response(eval_resp, 'justification')
+
+    def _evaluate_logprob(self, indices: list, diffs: list, candidates: dict, results: dict, targets: list) -> None:
+        """Reads each candidate message's score from the digit logprobs; justifications are generated only if configured."""
+        eval_jobs = self._eval_jobs(indices, diffs, candidates, targets)
+        scores = self._run_unique("score", self.handler.score_batch, [(diff, msg) for _, _, _, diff, msg in eval_jobs])
+        for (idx, score_col, _, _, _), score in zip(eval_jobs, scores):
+            results[idx][score_col] = score["score"]
+            results[idx][EXPECTED_SCORE_COLS[score_col]] = round(score["expected"], 4)
+        if not self.logprob_justifications:
+            return
+        justify_items = [(diff, msg, score["score"]) for (_, _, _, diff, msg), score in zip(eval_jobs, scores)]
+        justify_resps = self._run_unique("justify", self.handler.justify_batch, justify_items)
+        for (idx, _, just_col, _, _), justify_resp in zip(eval_jobs, justify_resps):
+            results[idx][just_col] = parse_json_from_response(justify_resp, 'justification')
+
+    def _evaluate_joint(self, indices: list, diffs: list, candidates: dict, results: dict, targets: list) -> None:
+        """Scores all of a row's candidate messages in one prompt and maps the answer back onto the columns."""
+        joint_items = [(diff, tuple(candidates[idx])) for idx, diff in zip(indices, diffs)]
+        eval_resps = self._run_unique("evaluate_joint", self.handler.evaluate_joint_batch, joint_items)
+        for idx, eval_resp in zip(indices, eval_resps):
+            for number, target in enumerate(targets, start=1):
+                score_col, just_col, _ = EVAL_TARGETS[target]
+                key = joint_message_key(number)
+                results[idx][score_col] = self._parse_score("evaluate_joint", eval_resp, f"{key}.score")
+                results[idx][just_col] = parse_json_from_response(eval_resp, f"{key}.justification")
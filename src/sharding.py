@@ -0,0 +1,289 @@
+# src/sharding.py
+"""
+Sharded analysis across processes or machines that share a filesystem.
+
+Rows are hash-partitioned on Hash+Filename (on Hash alone for commit-level
+analysis) into work units, and shard i of N
+owns the units whose number is congruent to i mod N. Each shard writes the rows
+it finishes to its own durable results part. A unit is claimed through a lease
+file that is refreshed while the unit is processed; once a shard has finished
+its own units it re-reads the other parts and takes over units that still
+have unfinished rows and whose lease has expired (e.g. because their shard
+crashed) or that no shard currently holds. `merge_shards` combines
+all parts into the output that `DataHandler` and the reporting expect.
+"""
+import os
+import re
+import glob
+import time
+import fcntl
+import socket
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import pandas as pd
+from src.config_loader import config
+from src.data_miner import mine_repository
+from src.data_handler import DataHandler
+from src.results_store import ResultsStore
+
+def parse_shard_spec(spec: str) -> tuple:
+    """Parses an 'i/N' shard specification into (i, N)."""
+    index, count = (int(part) for part in spec.split('/'))
+    if not 0 <= index < count:
+        raise ValueError(f"Invalid shard '{spec}': expected i/N with 0 <= i < N.")
+    return index, count
+
+def work_unit_of(commit_hash: str, filename: str, n_units: int) -> int:
+    """Stable hash partition of a row's Hash+Filename key; pass an empty filename to keep a commit's rows together."""
+    digest = hashlib.sha1(f"{commit_hash}\x1f{filename}".encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % n_units
+
+LEASE_FILE = re.compile(r'unit-(\d+)\.lease\.(\d+)$')
+
+class UnitLeases:
+    """
+    Lease files for the work units of a sharded run.
+
+    A unit's lease is the highest generation of its `unit-NNNNN.lease.<n>`
+    files, holding the owner and the time it was last claimed or renewed (0
+    once released). A unit is claimed by creating the next generation with
+    link(), which fails if the file exists (also on NFS), so exactly one shard
+    wins each takeover and no lease is ever seen half written. Expiry is
+    judged from the recorded time rather than the file's mtime, which NFS
+    takes from the server's clock.
+    """
+    def __init__(self, shard_dir: str, owner: str, lease_seconds: float):
+        self.shard_dir = shard_dir
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self.held = {}
+
+    def _path(self, unit: int, generation: int) -> str:
+        return os.path.join(self.shard_dir, f"unit-{unit:05d}.lease.{generation}")
+
+    def _leases(self) -> dict:
+        """{unit: [generations]} of the lease files in the shard directory."""
+        leases = {}
+        for path in glob.glob(os.path.join(self.shard_dir, "unit-*.lease.*")):
+            match = LEASE_FILE.match(os.path.basename(path))
+            if match:
+                leases.setdefault(int(match.group(1)), []).append(int(match.group(2)))
+        return {unit: sorted(generations) for unit, generations in leases.items()}
+
+    @staticmethod
+    def _read(path: str) -> tuple:
+        """(owner, claim or renewal time) recorded in a lease file; an unreadable lease counts as released."""
+        with open(path) as f:
+            content = f.read()
+        try:
+            owner, stamp = content.rsplit('\n', 1)
+            return owner, float(stamp)
+        except ValueError:
+            return "an unreadable lease", 0.0
+
+    def _write_tmp(self, unit: int, stamp: float) -> str:
+        tmp_path = os.path.join(self.shard_dir, f"unit-{unit:05d}.tmp.{socket.gethostname()}.{os.getpid()}")
+        with open(tmp_path, 'w') as f:
+            f.write(f"{self.owner}\n{stamp}")
+        return tmp_path
+
+    def _write(self, unit: int, stamp: float) -> None:
+        os.replace(self._write_tmp(unit, stamp), self._path(unit, self.held[unit]))
+
+    def _expired(self, stamp: float) -> bool:
+        return time.time() - stamp > self.lease_seconds
+
+    def try_claim(self, unit: int) -> bool:
+        """Claims a unit that is unleased, leased by us, or whose lease has expired or been released."""
+        while True:
+            generations = self._leases().get(unit, [])
+            if generations:
+                try:
+                    holder, stamp = self._read(self._path(unit, generations[-1]))
+                except FileNotFoundError:
+                    # Superseded and removed by a takeover; look again.
+                    continue
+                if holder == self.owner:
+                    self.held[unit] = generations[-1]
+                    self.renew(unit)
+                    return True
+                if not self._expired(stamp):
+                    return False
+                if stamp:
+                    logging.warning(f"Taking over unit {unit} from {holder}, whose lease expired.")
+            generation = generations[-1] + 1 if generations else 0
+            tmp_path = self._write_tmp(unit, time.time())
+            try:
+                os.link(tmp_path, self._path(unit, generation))
+            except FileExistsError:
+                # Another shard claimed this generation first; its lease decides.
+                continue
+            finally:
+                os.remove(tmp_path)
+            self.held[unit] = generation
+            for old in generations:
+                try:
+                    os.remove(self._path(unit, old))
+                except FileNotFoundError:
+                    pass
+            return True
+
+    def renew(self, unit: int) -> None:
+        self._write(unit, time.time())
+
+    def release(self, unit: int) -> None:
+        # The released generation stays as a marker, so generation numbers only grow.
+        self._write(unit, 0)
+        del self.held[unit]
+
+    def live_units(self) -> list:
+        """Units whose current lease is held and unexpired."""
+        live = []
+        for unit, generations in sorted(self._leases().items()):
+            try:
+                if not self._expired(self._read(self._path(unit, generations[-1]))[1]):
+                    live.append(unit)
+            except FileNotFoundError:
+                pass
+        return live
+
+# Parts live in the shared directory, possibly on NFS, where SQLite's WAL mode does not work across machines.
+PART_JOURNAL_MODE = "DELETE"
+
+def _part_paths(shard_dir: str) -> list:
+    return sorted(glob.glob(os.path.join(shard_dir, "part-*.sqlite")))
+
+def _load_parts(shard_dir: str) -> dict:
+    """Reads every results part. Parts are applied in name order, so merging is deterministic."""
+    results = {}
+    for path in _part_paths(shard_dir):
+        store = ResultsStore(path, PART_JOURNAL_MODE)
+        results.update(store.load())
+        store.close()
+    return results
+
+def _mine_shared() -> pd.DataFrame:
+    """Mines under a file lock, so one shard fills the mining cache and the others read it."""
+    shard_dir = config['sharding']['dir']
+    os.makedirs(shard_dir, exist_ok=True)
+    with open(os.path.join(shard_dir, "mining.lock"), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            return mine_repository(config['io']['processing_limit'])
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def run_shard(shard_index: int, n_shards: int, torch_threads: int = None) -> int:
+    """Processes shard `shard_index` of `n_shards`, then steals leftover units. Returns the rows processed."""
+    # Imported here so pool workers only pay for model libraries when they run a shard.
+    import torch
+    from src.llm.model_server import open_qwen_handler, open_baseline_generator
+    from src.row_processor import RowProcessor
+    from src.metrics import metrics
+    from src.pipeline import plan_analysis, write_run_reports
+    from src.utils import select_device, release_memory_if_needed
+
+    shard_cfg = config['sharding']
+    shard_dir = shard_cfg['dir']
+    cols = config['columns']
+    torch_threads = shard_cfg['torch_threads'] or torch_threads
+    if torch_threads:
+        torch.set_num_threads(torch_threads)
+
+    data_handler = DataHandler(_mine_shared())
+    data_handler.merge_results(_load_parts(shard_dir), persist=False)
+    df = data_handler.get_dataframe()
+    n_units = n_shards * shard_cfg['units_per_shard']
+    # Commit-level analysis needs all files of a commit in the same unit.
+    by_commit = config['inference']['analysis_unit'] == 'commit'
+    units = pd.Series(
+        [work_unit_of(h, "" if by_commit else f, n_units) for h, f in zip(df[cols['hash']], df[cols['filename']])], index=df.index
+    )
+
+    own_units = [u for u in range(n_units) if u % n_shards == shard_index]
+    other_units = [u for u in range(n_units) if u % n_shards != shard_index] if shard_cfg['work_stealing'] else []
+    # A stable owner lets a restarted shard resume the units it still holds leases on.
+    leases = UnitLeases(shard_dir, f"shard {shard_index}/{n_shards}@{socket.gethostname()}", shard_cfg['lease_seconds'])
+    part = ResultsStore(os.path.join(shard_dir, f"part-{shard_index:03d}.sqlite"), PART_JOURNAL_MODE)
+    device = select_device()
+    baseline_generator, row_processor = None, None
+    rows_per_batch = config['inference']['analysis_batch_rows']
+    processed = 0
+    leased_elsewhere = []
+
+    for unit in own_units + other_units:
+        if unit not in own_units:
+            # Pick up whatever other shards have saved in their parts since we started.
+            data_handler.merge_results(_load_parts(shard_dir), persist=False)
+        pending = df[(units == unit) & df[cols['rectifier_score']].isnull()]
+        if pending.empty:
+            continue
+        if not leases.try_claim(unit):
+            if unit in own_units:
+                leased_elsewhere.append(unit)
+            continue
+        if leases.held[unit] > 0:
+            # Another shard held this unit before; it saves its rows before releasing, so pick them up.
+            data_handler.merge_results(_load_parts(shard_dir), persist=False)
+            pending = df[(units == unit) & df[cols['rectifier_score']].isnull()]
+            if pending.empty:
+                leases.release(unit)
+                continue
+        logging.info(f"Shard {shard_index}/{n_shards}: processing {len(pending)} rows of unit {unit}.")
+        if row_processor is None:
+            baseline_generator = open_baseline_generator(device)
+            row_processor = RowProcessor(open_qwen_handler())
+        rows = data_handler.with_commit_fields(pending.copy())
+        with metrics.stage("baseline"):
+            baseline_generator.fill(rows, show_progress=False, on_batch=lambda _: leases.renew(unit))
+        plan = plan_analysis(rows)
+        for start in range(0, len(plan.units), rows_per_batch):
+            batch = plan.units.iloc[start:start + rows_per_batch]
+            with metrics.stage("analysis"):
+                batch_results = row_processor.process_units(plan, batch)
+            for idx, results in batch_results.items():
+                DataHandler.set_values(rows, idx, results)
+            part.write(data_handler.result_records(rows.loc[list(batch_results)]))
+            leases.renew(unit)
+            release_memory_if_needed()
+            processed += len(batch_results)
+        leases.release(unit)
+
+    part.close()
+    if leased_elsewhere:
+        logging.warning(
+            f"Shard {shard_index}/{n_shards}: skipped units {leased_elsewhere}, which another owner holds unexpired leases on; "
+            f"they can be taken over once the leases are older than sharding.lease_seconds ({shard_cfg['lease_seconds']}s)."
+        )
+    if baseline_generator is not None:
+        baseline_generator.close()
+        row_processor.handler.close()
+    logging.info(f"Shard {shard_index}/{n_shards} finished after processing {processed} rows.")
+    write_run_reports(f".shard-{shard_index:03d}")
+    return processed
+
+def _run_pool_shard(shard_index: int, n_shards: int) -> int:
+    from src.utils import setup_logging
+    setup_logging()
+    # Split the cores between the local shards unless a thread count is configured.
+    return run_shard(shard_index, n_shards, torch_threads=max(1, (os.cpu_count() or 1) // n_shards))
+
+def run_local_shards(n_shards: int) -> None:
+    """Runs all shards in a local process pool and merges their parts."""
+    # Mine once up front so the workers start from a warm mining cache.
+    mined_df = _mine_shared()
+    logging.info(f"Starting {n_shards} local shard processes.")
+    with ProcessPoolExecutor(max_workers=n_shards, mp_context=multiprocessing.get_context('spawn')) as pool:
+        processed = sum(pool.map(_run_pool_shard, range(n_shards), [n_shards] * n_shards))
+    logging.info(f"All shards finished; {processed} rows processed.")
+    merge_shards(mined_df)
+
+def merge_shards(mined_df: pd.DataFrame = None) -> None:
+    """Combines all shard result parts with existing results into the final output."""
+    data_handler = DataHandler(mined_df if mined_df is not None else _mine_shared())
+    merged = data_handler.merge_results(_load_parts(config['sharding']['dir']))
+    logging.info(f"Merged {merged} rows from {len(_part_paths(config['sharding']['dir']))} shard parts.")
+    data_handler.save_progress()
+    data_handler.finalize()
@@ -0,0 +1,74 @@
+# src/status.py
+"""
+Reports how far a run has got without mining or loading any model: rows in the
+mining cache, baseline and analysis progress in the stored results, shard parts
+and the freshness of the results summary.
+"""
+import os
+import glob
+import json
+from src.config_loader import config
+from src.results_store import ResultsStore
+
+def _mining_status() -> list:
+    cache_dir = config['mining']['cache_dir']
+    checkpoint_path = os.path.join(cache_dir, 'checkpoint.json')
+    if not os.path.exists(checkpoint_path):
+        return ["Mining cache: empty"]
+    with open(checkpoint_path) as f:
+        checkpoint = json.load(f)
+    rows = 0
+    rows_path = os.path.join(cache_dir, 'mined_rows.jsonl')
+    if os.path.exists(rows_path):
+        with open(rows_path, 'rb') as f:
+            rows = f.read(checkpoint['rows_offset']).count(b'\n')
+    lines = [f"Mining cache: {rows} rows from {checkpoint['commits_processed']} commits, last commit {checkpoint['last_commit']}"]
+    if checkpoint['settings'].get('repo_url') != config['io']['repo_url']:
+        lines.append(f"  (built for {checkpoint['settings'].get('repo_url')}, not the configured repository)")
+    return lines
+
+def _results_counts() -> tuple:
+    """(stored rows, rows with a baseline message, analyzed rows), or None if there are no results yet."""
+    cols = config['columns']
+    counted = [cols['baseline_msg'], cols['rectifier_score']]
+    if config['io']['results_backend'] == 'sqlite' and os.path.exists(config['io']['results_db_path']):
+        store = ResultsStore(config['io']['results_db_path'])
+        try:
+            filled = store.count_filled(counted)
+            return len(store), filled[counted[0]], filled[counted[1]]
+        finally:
+            store.close()
+    if os.path.exists(config['io']['output_csv_path']):
+        import pandas as pd
+        df = pd.read_csv(config['io']['output_csv_path'], usecols=lambda c: c in counted)
+        return (len(df),) + tuple(int(df[col].notnull().sum()) if col in df.columns else 0 for col in counted)
+    return None
+
+def _shard_status() -> list:
+    shard_dir = config['sharding']['dir']
+    parts = glob.glob(os.path.join(shard_dir, "part-*.sqlite"))
+    if not parts:
+        return []
+    from src.sharding import UnitLeases
+    leased = UnitLeases(shard_dir, None, config['sharding']['lease_seconds']).live_units()
+    return [f"Shards: {len(parts)} results parts in {shard_dir}, {len(leased)} units currently leased"]
+
+def collect_status() -> list:
+    """Lines describing the progress of the configured run."""
+    lines = _mining_status()
+    counts = _results_counts()
+    if counts is None:
+        lines.append("Results: none yet")
+    else:
+        stored, baselines, analyzed = counts
+        lines.append(f"Results: {stored} rows stored, {baselines} with a baseline message, {analyzed} analyzed")
+    lines.extend(_shard_status())
+    summary_path = config['io']['summary_path']
+    if os.path.exists(summary_path):
+        with open(summary_path) as f:
+            summary = json.load(f)
+        lines.append(f"Summary: {summary['rows']} rows, updated {summary.get('updated', 'unknown')}")
+    return lines
+
+def print_status() -> None:
+    print("\n".join(collect_status()))
@@ -0,0 +1,133 @@
+# src/summary_index.py
+"""
+A compact summary of the results that reporting and plotting read instead of
+the full results file: per-source score histograms, row counts and improvement
+category counts.
+
+The DataHandler keeps the summary up to date as rows are saved, adjusting only
+the counts of changed rows, and writes it next to the results. The summary
+records the size and modification time of the results CSV it matches; when it
+is missing or out of date, readers fall back to a chunked scan of just the
+summary columns of the CSV.
+"""
+import os
+import json
+import logging
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Optional
+import pandas as pd
+from src.config_loader import config
+
+def score_columns() -> list:
+    cols = config['columns']
+    return [cols['dev_score'], cols['llm_score'], cols['rectifier_score']]
+
+def _score_value(value) -> Optional[int]:
+    """The histogram bucket of a score cell, or None for a missing or non-numeric score."""
+    try:
+        return None if pd.isna(value) else int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+def _category_value(value) -> Optional[str]:
+    return value if isinstance(value, str) and value else None
+
+def _file_signature(path: str) -> Optional[dict]:
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return {"path": os.path.abspath(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+class SummaryIndex:
+    """Incrementally maintained counts over the score and category columns of the results."""
+    def __init__(self):
+        self.rows = 0
+        self.scores = {col: Counter() for col in score_columns()}
+        self.categories = Counter()
+        self._counted = {}
+
+    def update(self, df: pd.DataFrame, indices) -> None:
+        """Re-counts the rows at `indices` of `df`, replacing whatever they contributed before."""
+        self.rows = len(df)
+        score_cols = list(self.scores)
+        category_col = config['columns']['improvement_cat']
+        subset = df.loc[list(indices), score_cols + [category_col]]
+        for idx, *values in subset.itertuples(name=None):
+            entry = tuple(_score_value(v) for v in values[:-1]) + (_category_value(values[-1]),)
+            previous = self._counted.get(idx)
+            if previous == entry:
+                continue
+            for counts, old, new in zip(list(self.scores.values()) + [self.categories], previous or (None,) * len(entry), entry):
+                if old is not None:
+                    counts[old] -= 1
+                    if not counts[old]: del counts[old]
+                if new is not None:
+                    counts[new] += 1
+            self._counted[idx] = entry
+
+    def to_dict(self, results_path: Optional[str] = None) -> dict:
+        """The summary as JSON-serializable data; `results_path` names the results file it matches, if any."""
+        return {
+            "rows": self.rows,
+            "scores": {col: {str(k): v for k, v in sorted(counts.items())} for col, counts in self.scores.items()},
+            "categories": dict(self.categories.most_common()),
+            "results_file": _file_signature(results_path) if results_path else None,
+            "updated": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        }
+
+    def write(self, path: str, results_path: Optional[str] = None) -> None:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.to_dict(results_path), f, indent=2)
+        os.replace(tmp_path, path)
+
+def summarize_dataframe(df: pd.DataFrame) -> dict:
+    """Builds the summary of an in-memory results DataFrame."""
+    summary = SummaryIndex()
+    summary.update(df, df.index)
+    return summary.to_dict()
+
+def scan_results_csv(csv_path: str, chunk_rows: int = 100_000) -> dict:
+    """Builds the summary by reading only the score and category columns of the CSV, in chunks."""
+    score_cols = score_columns()
+    category_col = config['columns']['improvement_cat']
+    rows = 0
+    scores = {col: Counter() for col in score_cols}
+    categories = Counter()
+    wanted = set(score_cols + [category_col])
+    for chunk in pd.read_csv(csv_path, usecols=lambda c: c in wanted, chunksize=chunk_rows):
+        rows += len(chunk)
+        for col in score_cols:
+            if col in chunk.columns:
+                values = pd.to_numeric(chunk[col], errors='coerce').dropna().astype(int)
+                scores[col].update(values.value_counts().to_dict())
+        if category_col in chunk.columns:
+            values = chunk[category_col].dropna()
+            categories.update(values[values != ""].value_counts().to_dict())
+    return {
+        "rows": rows,
+        "scores": {col: {str(k): v for k, v in sorted(counts.items())} for col, counts in scores.items()},
+        "categories": dict(categories.most_common()),
+        "results_file": _file_signature(csv_path),
+    }
+
+def load_summary() -> Optional[dict]:
+    """
+    Returns the summary of the results CSV: the summary file when it matches the
+    CSV, otherwise a column-pruned scan of the CSV. None if neither exists.
+    """
+    summary_path = config['io']['summary_path']
+    csv_path = config['io']['output_csv_path']
+    if os.path.exists(summary_path):
+        with open(summary_path) as f:
+            summary = json.load(f)
+        recorded = summary.get("results_file")
+        if recorded and recorded == _file_signature(csv_path):
+            return summary
+        if not os.path.exists(csv_path):
+            return summary
+        logging.info(f"{summary_path} does not match {csv_path}; scanning the results instead.")
+    if not os.path.exists(csv_path):
+        return None
+    return scan_results_csv(csv_path)
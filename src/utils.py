@@ -1,12 +1,16 @@
 # src/utils.py
-"""Utility functions used across the data processing pipeline."""
+"""
+Utility functions used across the data processing pipeline.
+
+torch is imported inside the functions that use it, so commands that never
+touch a model (reports, status) do not pay for importing it.
+"""
 import logging
 import sys
 import gc
 import re
 import json
 from typing import Any
-import torch
 
 def setup_logging():
     logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] - %(message)s', stream=sys.stdout, datefmt='%Y-%m-%d %H:%M:%S')
@@ -14,18 +18,60 @@ def setup_logging():
     logging.getLogger("transformers").setLevel(logging.WARNING)
 
 def select_device():
+    import torch
     if torch.cuda.is_available(): return torch.device("cuda")
     if torch.backends.mps.is_available(): return torch.device("mps")
     return torch.device("cpu")
 
 def clear_gpu_memory():
+    import torch
     gc.collect()
     if torch.cuda.is_available(): torch.cuda.empty_cache()
     elif torch.backends.mps.is_available(): torch.mps.empty_cache()
 
+# RSS at the first cleanup check, once the models are loaded; the "auto" RSS threshold is relative to it.
+_loaded_rss_mb = None
+
+def _rss_threshold_mb(memory_cfg: dict, rss_mb: float):
+    """The configured RSS threshold, or with "auto" the loaded RSS plus `rss_headroom_mb`."""
+    global _loaded_rss_mb
+    threshold = memory_cfg['rss_threshold_mb']
+    if threshold != 'auto':
+        return threshold
+    if _loaded_rss_mb is None:
+        _loaded_rss_mb = rss_mb
+        logging.info(f"Memory cleanup runs once RSS exceeds {rss_mb + memory_cfg['rss_headroom_mb']:.0f} MB "
+                     f"({rss_mb:.0f} MB with the models loaded + {memory_cfg['rss_headroom_mb']} MB headroom).")
+    return _loaded_rss_mb + memory_cfg['rss_headroom_mb']
+
+def release_memory_if_needed() -> bool:
+    """
+    Runs `clear_gpu_memory` only when memory use crosses the configured thresholds
+    (process RSS, or the fraction of CUDA memory reserved), instead of after every batch.
+    Returns True if it cleaned up.
+    """
+    from src.config_loader import config
+    from src.metrics import metrics, current_rss_mb
+    memory_cfg = config['memory']
+    rss_mb = current_rss_mb()
+    rss_threshold = _rss_threshold_mb(memory_cfg, rss_mb)
+    over_rss = bool(rss_threshold) and rss_mb > rss_threshold
+    over_vram = False
+    if memory_cfg['vram_threshold_fraction']:
+        import torch
+        if torch.cuda.is_available():
+            total = torch.cuda.get_device_properties(0).total_memory
+            over_vram = torch.cuda.memory_reserved() / total > memory_cfg['vram_threshold_fraction']
+    if not (over_rss or over_vram):
+        return False
+    clear_gpu_memory()
+    metrics.increment("memory_cleanups", reason="rss" if over_rss else "vram")
+    return True
+
 def parse_json_from_response(response: str, key: str, is_score: bool = False) -> Any:
     """
     Safely extracts a value from a JSON object embedded in an LLM response string.
+    A dotted `key` such as "message_1.score" reaches into nested objects.
     If `is_score` is True, it aggressively attempts to convert the value to an integer.
     """
     default_value = 0 if is_score else ""
@@ -33,8 +79,9 @@ def parse_json_from_response(response: str, key: str, is_score: bool = False) ->
     if not json_match:
         return default_value
     try:
-        json_obj = json.loads(json_match.group(0))
-        value = json_obj.get(key)
+        value = json.loads(json_match.group(0))
+        for part in key.split('.'):
+            value = value.get(part) if isinstance(value, dict) else None
 
         if value is None:
             return default_value
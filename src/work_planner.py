@@ -0,0 +1,98 @@
+# src/work_planner.py
+"""
+Plans the analysis LLM work for a set of rows before it is run.
+
+Rows whose analysis inputs are the same (the diff, compared after dropping
+hunk line numbers and trailing whitespace, the developer message and the
+baseline message) are grouped into one unit of work: cherry-picks and
+branches merged with their original commits are analyzed once and the results
+are fanned out to every row of the unit. Units are ordered by diff, so units
+that share a diff but not their messages land in the same analysis batch,
+where `RowProcessor` runs each distinct prompt only once.
+
+With `inference.analysis_unit: commit`, the pending files of a commit form
+one unit, keyed on the concatenated commit diff and the developer message, and
+the unit is analyzed against the concatenated diff. Every row of the commit
+then shares Rectified_Message, the Developer and Rectifier scores and
+justifications, Improvement_Category, Improvement_Reason and Diff_Tokens.
+Baseline messages are generated per file, so each row's baseline message is
+still scored against that file's own diff (the plan's `row_targets`).
+"""
+import re
+import hashlib
+import pandas as pd
+
+HUNK_HEADER = re.compile(r'^@@ -\d+(?:,\d+)? \+\d+(?:,\d+)? @@')
+
+def diff_key(diff: str) -> str:
+    """Hash of a diff with hunk line numbers and trailing whitespace removed, so moved but identical changes match."""
+    normalized = '\n'.join(HUNK_HEADER.sub('@@', line.rstrip()) for line in str(diff).splitlines())
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+def commit_diff(filenames: list, diffs: list) -> str:
+    """Concatenates per-file diffs into one multi-file diff, each file under its own 'diff --git' line."""
+    return '\n'.join(
+        f"diff --git a/{filename} b/{filename}\n{diff}" for filename, diff in sorted(zip(filenames, diffs))
+    )
+
+# Evaluation targets (keys of `row_processor.EVAL_TARGETS`) scored per row rather than per unit, by analysis unit.
+ROW_TARGETS = {"file": (), "commit": ("Baseline_LLM",)}
+
+class WorkPlan:
+    """The units of work for a set of rows and the rows that each unit stands for."""
+    def __init__(self, units: pd.DataFrame, members: dict, rows: pd.DataFrame, row_targets: tuple = ()):
+        self.units = units
+        self.members = members
+        self.source = rows
+        self.rows = len(rows)
+        self.row_targets = row_targets
+
+    def member_rows(self, units: pd.DataFrame) -> pd.DataFrame:
+        """The planned rows, with their own diffs, that the given units stand for."""
+        return self.source.loc[[idx for unit in units.index for idx in self.members[unit]]]
+
+    def fan_out(self, unit_results: dict, row_results: dict = None) -> dict:
+        """
+        Maps {unit index: results} to {row index: results} for every member row of
+        those units, adding any per-row results from `row_results` {row index: results}.
+        """
+        row_results = row_results or {}
+        return {
+            idx: {**results, **row_results.get(idx, {})}
+            for unit, results in unit_results.items() for idx in self.members[unit]
+        }
+
+    def __len__(self) -> int:
+        return len(self.units)
+
+def plan_work(rows: pd.DataFrame, analysis_unit: str = "file") -> WorkPlan:
+    """
+    Groups `rows` into units of work. Each unit is represented by its first row;
+    in commit mode that row's diff is replaced by the concatenated commit diff,
+    and the baseline message is left out of the key since it is scored per row.
+    """
+    if analysis_unit not in ROW_TARGETS:
+        raise ValueError(f"Unknown inference.analysis_unit '{analysis_unit}'; expected 'file' or 'commit'.")
+    source = rows
+    rows = rows.copy()
+    if analysis_unit == "commit":
+        by_commit = rows.groupby("Hash", sort=False, observed=True)
+        combined = by_commit.apply(lambda group: commit_diff(group["Filename"].astype(str).tolist(), group["Diff"].tolist()))
+        rows["Diff"] = rows["Hash"].astype(str).map(combined.rename(index=str)).astype(object)
+        keys = pd.Series(
+            [(diff_key(diff), str(msg)) for diff, msg in zip(rows["Diff"].tolist(), rows["Message"].tolist())],
+            index=rows.index
+        )
+    else:
+        keys = pd.Series(
+            [(diff_key(diff), str(msg), str(baseline)) for diff, msg, baseline in zip(rows["Diff"].tolist(), rows["Message"].tolist(), rows["Baseline_Message"].tolist())],
+            index=rows.index
+        )
+    members = {}
+    for idx, key in keys.items():
+        members.setdefault(key, []).append(idx)
+    representatives = [indices[0] for indices in members.values()]
+    units = rows.loc[representatives]
+    order = sorted(range(len(units)), key=lambda i: keys[representatives[i]])
+    units = units.iloc[order]
+    return WorkPlan(units, {indices[0]: indices for indices in members.values()}, source, ROW_TARGETS[analysis_unit])
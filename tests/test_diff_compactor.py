@@ -0,0 +1,38 @@
+# tests/test_diff_compactor.py
+"""Whitespace-only edit detection in src.diff_compactor."""
+from src.diff_compactor import _compact_hunk
+
+HEADER = "@@ -1,3 +1,3 @@"
+
+def compact(body: list) -> list:
+    return _compact_hunk([HEADER] + body, context_lines=3, max_block_lines=40)
+
+def test_reindented_line_is_kept():
+    body = ["-x = 1", "+    x = 1"]
+    assert compact(body) == [HEADER] + body
+
+def test_whitespace_inside_string_literal_is_kept():
+    body = ['-msg = "a b"', '+msg = "ab"']
+    assert compact(body) == [HEADER] + body
+
+def test_inner_whitespace_change_is_kept():
+    body = ['-msg = "a  b"', '+msg = "a b"']
+    assert compact(body) == [HEADER] + body
+
+def test_trailing_whitespace_change_becomes_context():
+    assert compact(["-a = 1  ", "+a = 1"]) == [HEADER, " [whitespace-only changes omitted]"]
+
+def test_added_and_removed_blank_lines_are_dropped():
+    assert compact(["-", "+   ", "+"]) == [HEADER, " [whitespace-only changes omitted]"]
+
+def test_lines_swapped_around_context_are_kept():
+    body = ["-    return a", "+    return b", " x = 0", "-    return b", "+    return a"]
+    assert compact(body) == [HEADER] + body
+
+def test_lines_moved_within_a_block_are_kept():
+    body = ["-first()", "-second()", "+second()", "+first()"]
+    assert compact(body) == [HEADER] + body
+
+def test_only_the_trailing_whitespace_pair_is_dropped():
+    body = ["-keep()  ", "-old()", "+keep()", "+new()"]
+    assert compact(body) == [HEADER, "-old()", " keep()", "+new()"]
@@ -0,0 +1,21 @@
+# tests/test_row_processor.py
+"""Score parsing in src.row_processor."""
+from src.metrics import metrics
+from src.row_processor import RowProcessor
+
+def parse_failures() -> int:
+    return sum(value for (name, _), value in metrics.counters.items() if name == "parse_failures")
+
+def test_valid_score_is_kept():
+    assert RowProcessor._parse_score("evaluate", '{"score": 4, "justification": "ok"}', "score") == 4
+
+def test_out_of_range_score_is_a_parse_failure():
+    before = parse_failures()
+    assert RowProcessor._parse_score("evaluate", '{"score": 1000}', "score") == 0
+    assert RowProcessor._parse_score("evaluate_joint", '{"message_1": {"score": -3}}', "message_1.score") == 0
+    assert parse_failures() == before + 2
+
+def test_missing_score_is_a_parse_failure():
+    before = parse_failures()
+    assert RowProcessor._parse_score("evaluate", "no json here", "score") == 0
+    assert parse_failures() == before + 1
@@ -0,0 +1,49 @@
+# tests/test_sharding.py
+"""Unit leases in src.sharding."""
+import os
+import time
+from src.sharding import UnitLeases
+
+def leases(tmp_path, owner: str, lease_seconds: float = 60) -> UnitLeases:
+    return UnitLeases(str(tmp_path), owner, lease_seconds)
+
+def test_live_lease_is_not_taken_over(tmp_path):
+    assert leases(tmp_path, "a").try_claim(1)
+    assert not leases(tmp_path, "b").try_claim(1)
+    assert leases(tmp_path, "a").try_claim(1)
+
+def test_expired_lease_is_taken_over_in_a_new_generation(tmp_path):
+    assert leases(tmp_path, "a", lease_seconds=0.5).try_claim(1)
+    time.sleep(0.6)
+    b = leases(tmp_path, "b", lease_seconds=0.5)
+    assert b.try_claim(1)
+    assert b.held[1] == 1
+    assert sorted(os.listdir(tmp_path)) == ["unit-00001.lease.1"]
+    assert not leases(tmp_path, "c", lease_seconds=0.5).try_claim(1)
+
+def test_only_one_of_two_takeovers_wins(tmp_path):
+    assert leases(tmp_path, "a", lease_seconds=0.5).try_claim(1)
+    time.sleep(0.6)
+    b, c = leases(tmp_path, "b", lease_seconds=0.5), leases(tmp_path, "c", lease_seconds=0.5)
+    # c read a's expired lease just before b's takeover landed.
+    stale_listing, stale_lease = c._leases(), c._read(c._path(1, 0))
+    assert b.try_claim(1)
+    listings, reads = iter([stale_listing]), iter([stale_lease])
+    c._leases = lambda: next(listings, None) or UnitLeases._leases(c)
+    c._read = lambda path: next(reads, None) or UnitLeases._read(path)
+    assert not c.try_claim(1)
+    assert b.live_units() == [1] and b.held[1] == 1
+
+def test_released_lease_can_be_claimed(tmp_path):
+    a = leases(tmp_path, "a")
+    assert a.try_claim(1)
+    a.release(1)
+    assert leases(tmp_path, "b").try_claim(1)
+
+def test_expiry_uses_the_recorded_time_not_the_mtime(tmp_path):
+    a = leases(tmp_path, "a")
+    assert a.try_claim(1)
+    path = a._path(1, 0)
+    os.utime(path, (0, 0))
+    assert not leases(tmp_path, "b").try_claim(1)
+    assert a.live_units() == [1]
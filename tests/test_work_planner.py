@@ -0,0 +1,45 @@
+# tests/test_work_planner.py
+"""Grouping rows into units of work in src.work_planner."""
+import pandas as pd
+from src.work_planner import plan_work
+
+def rows() -> pd.DataFrame:
+    return pd.DataFrame({
+        "Hash": ["c1", "c1", "c2", "c3"],
+        "Filename": ["a.py", "b.py", "a.py", "a.py"],
+        "Diff": ["@@ -1 +1 @@\n-a\n+b", "@@ -1 +1 @@\n-c\n+d", "@@ -1 +1 @@\n-a\n+b", "@@ -5 +5 @@\n-a\n+b"],
+        "Message": ["fix: one", "fix: one", "fix: two", "fix: one"],
+        "Baseline_Message": ["base a", "base b", "base a", "base c"],
+    }, index=[10, 11, 12, 13])
+
+def test_file_mode_groups_identical_diffs_and_messages():
+    plan = plan_work(rows(), "file")
+    assert len(plan) == 4
+    assert plan.row_targets == ()
+
+def test_file_mode_ignores_hunk_line_numbers():
+    df = rows()
+    df.loc[13, "Baseline_Message"] = "base a"
+    plan = plan_work(df, "file")
+    assert sorted(sorted(members) for members in plan.members.values()) == [[10, 13], [11], [12]]
+
+def test_commit_mode_makes_one_unit_per_commit_despite_baselines():
+    plan = plan_work(rows(), "commit")
+    assert sorted(sorted(members) for members in plan.members.values()) == [[10, 11], [12], [13]]
+    assert plan.row_targets == ("Baseline_LLM",)
+    unit = next(unit for unit, members in plan.members.items() if 11 in members)
+    assert "diff --git a/a.py b/a.py" in plan.units.at[unit, "Diff"]
+    assert "diff --git a/b.py b/b.py" in plan.units.at[unit, "Diff"]
+
+def test_member_rows_keep_their_own_diffs():
+    df = rows()
+    plan = plan_work(df, "commit")
+    unit = next(unit for unit, members in plan.members.items() if 11 in members)
+    member_rows = plan.member_rows(plan.units.loc[[unit]])
+    assert member_rows["Diff"].tolist() == df.loc[[10, 11], "Diff"].tolist()
+
+def test_fan_out_adds_row_results_to_shared_results():
+    plan = plan_work(rows(), "commit")
+    unit = next(unit for unit, members in plan.members.items() if 11 in members)
+    results = plan.fan_out({unit: {"Developer_Score": 4}}, {10: {"Baseline_LLM_Score": 2}, 11: {"Baseline_LLM_Score": 3}})
+    assert results == {10: {"Developer_Score": 4, "Baseline_LLM_Score": 2}, 11: {"Developer_Score": 4, "Baseline_LLM_Score": 3}}
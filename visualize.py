@@ -1,42 +1,46 @@
 # visualize.py
-"""Orchestrates the generation of all visualizations for the Lab 2 report."""
+"""
+Orchestrates the generation of all visualizations for the Lab 2 report.
+
+Figures are rendered by `plotting.renderer`: in parallel processes, skipping
+figures whose inputs are unchanged, plus one set of variant figures for each
+summary listed under `visuals.variants` in config.yaml.
+"""
 import sys
 import os
-import pandas as pd
+import json
 
 sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
 
 from src.config_loader import config
-from plotting import styler, plot_generators
+from src.summary_index import load_summary
+from plotting.renderer import figure_jobs, render_figures
 
 def main():
     """Main function to load final data and generate all outputs."""
     input_csv = config['io']['output_csv_path']
     output_dir = config['io']['visuals_dir']
+    visuals_cfg = config['visuals']
     # ---------------------------------------------------------
-    os.makedirs(output_dir, exist_ok=True)
-    
-    try:
-        df = pd.read_csv(input_csv)
-    except FileNotFoundError:
+
+    # Plots only need score histograms and category counts, not the full results.
+    summary = load_summary()
+    if summary is None:
         print(f"FATAL: Final results file '{input_csv}' not found. Please run main.py first.")
         sys.exit()
 
-    styler.apply_global_styles()
-
-    plots_to_generate = {
-        "figure_1_quality_comparison.png": plot_generators.create_quality_comparison_chart,
-        "figure_2_score_distribution.png": plot_generators.create_score_distribution_chart,
-        "figure_3_improvement_breakdown.png": plot_generators.create_improvement_breakdown_chart,
-    }
+    jobs = figure_jobs(summary, strip_max_points=visuals_cfg['strip_max_points'])
+    for variant, summary_path in (visuals_cfg['variants'] or {}).items():
+        if not os.path.exists(summary_path):
+            print(f"WARNING: Summary '{summary_path}' for variant '{variant}' not found; skipping it.")
+            continue
+        with open(summary_path) as f:
+            jobs.extend(figure_jobs(json.load(f), variant=variant, strip_max_points=visuals_cfg['strip_max_points']))
 
     print("--- Generating Lab 2 Report Visualizations ---")
-    for filename, generator_func in plots_to_generate.items():
-        print(f"Generating {filename}...")
-        fig = generator_func(df)
-        fig.savefig(os.path.join(output_dir, filename), bbox_inches='tight')
-    
+    render_figures(jobs, output_dir, workers=visuals_cfg['workers'], skip_unchanged=visuals_cfg['skip_unchanged'])
+
     print(f"\nAll plots saved to '{output_dir}' directory.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()